@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""Measure AI form pipeline throughput and Zope worker occupancy offline.
+
+E editors run N pipelines each, generating a form, refining it and saving
+it as a new form version (a ZODB commit), against the `OfflineModel` of
+`zopyx.surveyjs.testing_llm`; no provider or network is involved. Their
+requests are served by W simulated Zope workers. In "sync" mode the
+workers run the model calls themselves (as before background jobs), in
+"jobs" mode they submit them to a `JobQueue` and answer status polls.
+Reported are pipelines per second, the median pipeline time and the share
+of time the workers were busy, i.e. not available to respondents:
+
+    python benchmarks/ai_pipeline.py --editors 16 --workers 4 --latency 0.5
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+from datetime import timezone
+from functools import partial
+from OFS.Application import Application
+from OFS.SimpleItem import SimpleItem
+from ZODB.FileStorage import FileStorage
+from ZODB.POSException import ConflictError
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import provideAdapter
+from zope.interface import implementer
+from zopyx.surveyjs.browser.ai_generator import generate_form
+from zopyx.surveyjs.browser.ai_generator import refine_form
+from zopyx.surveyjs.browser.ai_jobs import JobQueue
+from zopyx.surveyjs.browser.ai_jobs import QUEUED
+from zopyx.surveyjs.browser.ai_jobs import RUNNING
+from zopyx.surveyjs.storage import get_form_store
+from zopyx.surveyjs.storage import get_form_versions
+from zopyx.surveyjs.testing_llm import install
+from zopyx.surveyjs.testing_llm import MODEL_ID
+from zopyx.surveyjs.testing_llm import OfflineModel
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import transaction
+import uuid
+import ZODB
+
+
+REFINEMENT = "Add a field for the phone number"
+
+
+@implementer(IAttributeAnnotatable)
+class Survey(SimpleItem):
+    pass
+
+
+class Workers(object):
+    """`count` Zope workers serving requests, counting their busy time"""
+
+    def __init__(self, count):
+        self.count = count
+        self.busy = 0.0
+        self._slots = threading.Semaphore(count)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def request(self):
+        with self._slots:
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self.busy += time.perf_counter() - started
+
+
+def save(db, name, form_json):
+    tm = transaction.TransactionManager()
+    conn = db.open(transaction_manager=tm)
+    try:
+        while True:
+            tm.begin()
+            try:
+                app = conn.root()["Application"]
+                data = dict(
+                    id=str(uuid.uuid4()),
+                    created=datetime.now(timezone.utc),
+                    user=name,
+                    form_json=form_json,
+                )
+                get_form_versions(app[name]).add(data, get_form_store(app.site))
+                tm.commit()
+                return
+            except ConflictError:
+                tm.abort()
+    finally:
+        conn.close()
+
+
+def run_sync(workers, db, name, func):
+    with workers.request():
+        return func()
+
+
+def run_job(workers, queue, poll, name, func):
+    with workers.request():
+        job = queue.submit(func, name)
+    while True:
+        time.sleep(poll)
+        with workers.request():
+            info = queue.get(job.id, name)
+        if info["status"] not in (QUEUED, RUNNING):
+            return info
+
+
+def editor(run, workers, db, name, pipelines, candidates, timings):
+    for pipeline in range(pipelines):
+        started = time.perf_counter()
+        prompt = f"Form {pipeline} of {name}"
+        generate = partial(generate_form, prompt, MODEL_ID, candidates=candidates)
+        result = run(name, generate)
+        refined = run(name, partial(refine_form, result["json"], REFINEMENT, MODEL_ID))
+        with workers.request():
+            save(db, name, refined["json"])
+        timings.append(time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--editors", type=int, default=16)
+    parser.add_argument("--pipelines", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--job-workers", type=int, default=4)
+    parser.add_argument("--candidates", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--chunk-delay", type=float, default=0.002)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--poll", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    provideAdapter(AttributeAnnotations)
+
+    for mode in ("sync", "jobs"):
+        rng = random.Random(args.seed)
+        calls = args.editors * args.pipelines * 4
+        failures = [
+            "invalid-json" if rng.random() < args.failure_rate else None
+            for _ in range(calls)
+        ]
+        model = OfflineModel(
+            latency=args.latency,
+            chunk_size=32,
+            chunk_delay=args.chunk_delay,
+            failures=failures,
+        )
+        names = [f"editor{index}" for index in range(args.editors)]
+
+        with tempfile.TemporaryDirectory() as tmpdir, install(model):
+            db = ZODB.DB(
+                FileStorage(os.path.join(tmpdir, "Data.fs")), pool_size=args.workers
+            )
+            with db.transaction() as conn:
+                app = conn.root()["Application"] = Application()
+                app._setObject("site", Survey())
+                for name in names:
+                    app._setObject(name, Survey())
+
+            workers = Workers(args.workers)
+            queue = JobQueue(
+                max_workers=args.job_workers, max_pending=args.editors * 2
+            )
+            if mode == "sync":
+                run = partial(run_sync, workers, db)
+            else:
+                run = partial(run_job, workers, queue, args.poll)
+            timings = []
+            threads = [
+                threading.Thread(
+                    target=editor,
+                    args=(
+                        run,
+                        workers,
+                        db,
+                        name,
+                        args.pipelines,
+                        args.candidates,
+                        timings,
+                    ),
+                )
+                for name in names
+            ]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            queue.shutdown()
+
+            with db.transaction() as conn:
+                app = conn.root()["Application"]
+                versions = sum(len(get_form_versions(app[name])) for name in names)
+            db.close()
+
+        total = args.editors * args.pipelines
+        assert versions == total, (versions, total)
+        print(
+            f"mode={mode:4s} editors={args.editors} workers={args.workers} "
+            f"pipelines={total} model_calls={len(model.prompts)} "
+            f"throughput={total / elapsed:.2f}/s "
+            f"p50={statistics.median(timings):.2f}s "
+            f"occupancy={workers.busy / (args.workers * elapsed):.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Measure ConflictError rates of concurrent poll submissions.
+
+N writer threads append results to the same survey result container, each
+submission in its own transaction against a local FileStorage (as
+`save_poll` does). Run it for a single-shard container (the layout of a
+plain OOBTree) and for the default sharded container:
+
+    python benchmarks/conflicts.py --writers 8 --submissions 500
+"""
+
+from datetime import datetime
+from datetime import timezone
+from ZODB.FileStorage import FileStorage
+from ZODB.POSException import ConflictError
+from zopyx.surveyjs.storage import NUM_SHARDS
+from zopyx.surveyjs.storage import ResultContainer
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+import transaction
+import uuid
+import ZODB
+
+
+def make_record():
+    return dict(
+        poll_id=str(uuid.uuid1()),
+        created=datetime.now(timezone.utc),
+        user="benchmark",
+        result={"name": "x" * 40, "rating": 4, "choices": ["a", "b"]},
+    )
+
+
+def writer(db, submissions, stats, lock):
+    tm = transaction.TransactionManager()
+    conn = db.open(transaction_manager=tm)
+    conflicts = 0
+    try:
+        for _ in range(submissions):
+            while True:
+                tm.begin()
+                try:
+                    conn.root()["results"].add(make_record())
+                    tm.commit()
+                    break
+                except ConflictError:
+                    tm.abort()
+                    conflicts += 1
+    finally:
+        conn.close()
+    with lock:
+        stats["conflicts"] += conflicts
+
+
+def run(num_shards, writers, submissions):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = ZODB.DB(
+            FileStorage(os.path.join(tmpdir, "Data.fs")), pool_size=writers
+        )
+        with db.transaction() as conn:
+            conn.root()["results"] = ResultContainer(num_shards=num_shards)
+
+        stats = dict(conflicts=0)
+        lock = threading.Lock()
+        threads = [
+            threading.Thread(target=writer, args=(db, submissions, stats, lock))
+            for _ in range(writers)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - started
+
+        with db.transaction() as conn:
+            count = len(conn.root()["results"])
+        db.close()
+
+    total = writers * submissions
+    assert count == total, (count, total)
+    print(
+        f"shards={num_shards:3d} writers={writers} submissions={total} "
+        f"conflicts={stats['conflicts']} "
+        f"rate={stats['conflicts'] / total:.2%} "
+        f"throughput={total / duration:.0f}/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--submissions", type=int, default=500)
+    parser.add_argument("--shards", type=int, nargs="*", default=[1, NUM_SHARDS])
+    args = parser.parse_args()
+    for num_shards in args.shards:
+        run(num_shards, args.writers, args.submissions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Compare the storage size of the original and the compact result format.
+
+Stores N submissions in the original format (a plain `OOBTree` of dicts
+keyed by uuid strings), converts them with `compact_results` and reports
+the packed FileStorage size before and after the conversion. The
+original tree has no indexes, the compact size includes the user and
+poll id indexes of the container:
+
+    python benchmarks/record_size.py --submissions 20000
+"""
+
+from BTrees.OOBTree import OOBTree
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from ZODB.FileStorage import FileStorage
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import provideAdapter
+from zope.interface import implementer
+from zopyx.surveyjs.storage import compact_results
+from zopyx.surveyjs.storage import RESULTS_KEY
+
+import argparse
+import os
+import persistent
+import random
+import tempfile
+import time
+import transaction
+import uuid
+import ZODB
+
+
+@implementer(IAttributeAnnotatable)
+class Survey(persistent.Persistent):
+    pass
+
+
+def make_record(number, users):
+    return dict(
+        poll_id=str(uuid.uuid1()),
+        created=datetime(2024, 1, 1, tzinfo=timezone.utc)
+        + timedelta(seconds=number),
+        user=random.choice(users),
+        result={
+            "name": "Jane Doe",
+            "rating": random.randint(1, 5),
+            "choices": random.sample(["red", "green", "blue", "yellow"], 2),
+            "comment": "x" * random.randint(0, 80),
+        },
+    )
+
+
+def packed_size(db, path):
+    db.pack(time.time() + 1)
+    return os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--submissions", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=500)
+    args = parser.parse_args()
+    provideAdapter(AttributeAnnotations)
+    users = ["user-%d@example.org" % i for i in range(args.users)] + [None]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "Data.fs")
+        db = ZODB.DB(FileStorage(path))
+        conn = db.open()
+        survey = conn.root()["survey"] = Survey()
+        results = IAnnotations(survey)[RESULTS_KEY] = OOBTree()
+        for number in range(args.submissions):
+            data = make_record(number, users)
+            results[data["poll_id"]] = data
+            if number % 1000 == 999:
+                transaction.commit()
+        transaction.commit()
+        before = packed_size(db, path)
+
+        started = time.perf_counter()
+        compact_results(survey, on_batch=transaction.commit)
+        transaction.commit()
+        duration = time.perf_counter() - started
+        after = packed_size(db, path)
+        conn.close()
+        db.close()
+
+    print(
+        f"submissions={args.submissions} "
+        f"original={before / 1024:.0f}KiB ({before / args.submissions:.0f}B/record) "
+        f"compact={after / 1024:.0f}KiB ({after / args.submissions:.0f}B/record) "
+        f"saved={1 - after / before:.0%} conversion={duration:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Compare the tokens of full and patch mode AI refinements.
+
+Builds forms of N questions and one-word edits of them (a renamed title)
+and estimates the prompt and completion tokens of `refine_form` in both
+modes: "full" sends the form and gets the complete form back, "patch"
+sends the same compact form and gets a JSON patch back. The prompt of
+the previous full mode, with the form indented, is listed as `indented`.
+Tokens are estimated from the text length (`estimate_tokens`), as for
+models not reporting their usage:
+
+    python benchmarks/refine_tokens.py --questions 10 50 200
+"""
+
+from zopyx.surveyjs.browser.ai_generator import compact_json
+from zopyx.surveyjs.browser.ai_generator import estimate_tokens
+from zopyx.surveyjs.browser.ai_generator import REFINE_FULL
+from zopyx.surveyjs.browser.ai_generator import REFINE_PATCH
+from zopyx.surveyjs.browser.ai_generator import REFINE_PROMPT
+from zopyx.surveyjs.browser.ai_generator import refine_prompt
+from zopyx.surveyjs.patches import make_patch
+
+import argparse
+import copy
+import json
+
+
+REFINEMENT = 'Rename the title of question 3 to "Surname"'
+
+
+def make_form(questions):
+    elements = [
+        dict(type="text", name="uuid", visible=False),
+        dict(type="text", name="created", visible=False),
+    ]
+    for i in range(questions):
+        element = dict(
+            type=("text", "radiogroup", "checkbox", "comment")[i % 4],
+            name=f"question{i}",
+            title=f"Question number {i} of the form",
+            isRequired=i % 3 == 0,
+        )
+        if element["type"] in ("radiogroup", "checkbox"):
+            element["choices"] = [f"Option {c}" for c in range(1, 5)]
+        elements.append(element)
+    return dict(title="Benchmark form", pages=[dict(name="page1", elements=elements)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, nargs="+", default=[10, 50, 200])
+    args = parser.parse_args()
+
+    print(
+        "questions  prompt: indented    full   patch"
+        "  completion: full  patch  total saved"
+    )
+    for questions in args.questions:
+        form = make_form(questions)
+        refined = copy.deepcopy(form)
+        refined["pages"][0]["elements"][5]["title"] = "Surname"
+
+        indented = estimate_tokens(
+            REFINE_PROMPT.format(form=json.dumps(form, indent=2), refinement=REFINEMENT)
+        )
+        prompt_full = estimate_tokens(refine_prompt(form, REFINEMENT, REFINE_FULL))
+        prompt_patch = estimate_tokens(refine_prompt(form, REFINEMENT, REFINE_PATCH))
+        completion_full = estimate_tokens(compact_json(refined))
+        completion_patch = estimate_tokens(compact_json(make_patch(form, refined)))
+        saved = 1 - (prompt_patch + completion_patch) / (indented + completion_full)
+        print(
+            f"{questions:>9} {indented:>17} {prompt_full:>7} {prompt_patch:>7}"
+            f" {completion_full:>17} {completion_patch:>6} {saved:>11.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
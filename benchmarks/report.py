@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Measure the response time of the cross-survey report.
+
+Sets up the functional testing layer of zopyx.surveyjs (a Plone site on a
+DemoStorage), creates N surveys with submissions in a folder, indexes
+them in the `portal_catalog` and requests `@@surveys-report-json` through
+the Zope publisher, once with a minimized ZODB cache and then warm. The
+layer keeps its data in memory, so "cold" measures unpickling, not disk
+reads. Needs the test dependencies of the package (plone.app.testing):
+
+    python benchmarks/report.py --surveys 10000
+"""
+
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from plone import api
+from plone.app.testing import setRoles
+from plone.app.testing import TEST_USER_ID
+from plone.app.testing import TEST_USER_NAME
+from plone.app.testing import TEST_USER_PASSWORD
+from plone.testing.z2 import Browser
+from zopyx.surveyjs.catalog import SURVEY_INDEXES
+from zopyx.surveyjs.stats import get_stats
+from zopyx.surveyjs.storage import get_results
+from zopyx.surveyjs.testing import ZOPYX_SURVEYJS_FUNCTIONAL_TESTING
+
+import argparse
+import json
+import random
+import statistics
+import time
+import transaction
+import uuid
+
+
+# Surveys created per transaction
+BATCH_SIZE = 500
+
+
+def layers_of(layer):
+    """`layer` and its bases, bases first, as the test runner sets them up"""
+    ordered = []
+
+    def visit(layer):
+        for base in layer.__bases__:
+            visit(base)
+        if layer not in ordered:
+            ordered.append(layer)
+
+    visit(layer)
+    return ordered
+
+
+def add_submissions(survey, now, count):
+    results = get_results(survey)
+    stats = get_stats(survey)
+    for _ in range(count):
+        created = now - timedelta(minutes=random.randint(0, 20000))
+        result = {"rating": random.randint(1, 5)}
+        results.add(
+            dict(poll_id=str(uuid.uuid4()), created=created, user=None, result=result)
+        )
+        stats.add(result, {}, created)
+
+
+def create_surveys(portal, count, active, submissions):
+    now = datetime.now(timezone.utc)
+    folder = api.content.create(container=portal, type="Folder", id="surveys")
+    for number in range(count):
+        survey = api.content.create(
+            container=folder, type="Survey", id=f"survey-{number}", title="Survey"
+        )
+        if random.random() < active:
+            add_submissions(survey, now, random.randint(1, submissions))
+            survey.reindexObject(idxs=list(SURVEY_INDEXES))
+        if number % BATCH_SIZE == BATCH_SIZE - 1:
+            transaction.commit()
+            portal._p_jar.cacheGC()
+    transaction.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--surveys", type=int, default=10000)
+    parser.add_argument("--active", type=float, default=0.3)
+    parser.add_argument("--submissions", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    layer = ZOPYX_SURVEYJS_FUNCTIONAL_TESTING
+    layers = layers_of(layer)
+    for each in layers:
+        each.setUp()
+    for each in layers:
+        each.testSetUp()
+    try:
+        portal = layer["portal"]
+        setRoles(portal, TEST_USER_ID, ["Manager"])
+        started = time.perf_counter()
+        create_surveys(portal, args.surveys, args.active, args.submissions)
+        setup = time.perf_counter() - started
+
+        browser = Browser(layer["app"])
+        browser.handleErrors = False
+        browser.addHeader(
+            "Authorization", f"Basic {TEST_USER_NAME}:{TEST_USER_PASSWORD}"
+        )
+        url = portal.absolute_url() + "/@@surveys-report-json"
+        timings = []
+        for run in range(args.runs):
+            if run == 0:
+                portal._p_jar.db().cacheMinimize()
+            started = time.perf_counter()
+            browser.open(url)
+            timings.append(time.perf_counter() - started)
+        report = json.loads(browser.contents)
+    finally:
+        for each in reversed(layers):
+            each.testTearDown()
+        for each in reversed(layers):
+            each.tearDown()
+
+    print(
+        f"surveys={report['surveys']} responses={report['responses']} "
+        f"active_7d={report['activity']['7d']['surveys']} "
+        f"setup={setup:.0f}s "
+        f"cold={timings[0] * 1000:.0f}ms "
+        f"warm={statistics.median(timings[1:]) * 1000:.0f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
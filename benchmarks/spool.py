@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Compare synchronous and spooled poll submission throughput.
+
+N writer threads submit results to one survey against a local FileStorage.
+The synchronous path commits every submission in its own transaction (as
+`save_poll` does by default). The spooled path appends submissions to a
+`SubmissionSpool` while its worker drains them in batched transactions.
+Both acknowledgement throughput and the time until everything is stored
+are reported:
+
+    python benchmarks/spool.py --writers 8 --submissions 500
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+from datetime import timezone
+from OFS.Application import Application
+from OFS.SimpleItem import SimpleItem
+from ZODB.FileStorage import FileStorage
+from ZODB.POSException import ConflictError
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import provideAdapter
+from zope.interface import implementer
+from zope.interface import Interface
+from zopyx.surveyjs.interfaces import IResultStorage
+from zopyx.surveyjs.storage import annotation_results
+from zopyx.surveyjs.storage import get_results
+from zopyx.surveyjs.submissions import add_submission
+from zopyx.surveyjs.submissions import BATCH_SIZE
+from zopyx.surveyjs.submissions import SpoolWorker
+from zopyx.surveyjs.submissions import SubmissionSpool
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+import transaction
+import uuid
+import ZODB
+
+
+@implementer(IAttributeAnnotatable)
+class Survey(SimpleItem):
+    pass
+
+
+def make_record():
+    return dict(
+        poll_id=str(uuid.uuid1()),
+        created=datetime.now(timezone.utc),
+        user="benchmark",
+        result={"name": "x" * 40, "rating": 4, "choices": ["a", "b"]},
+    )
+
+
+def synchronous_writer(db, submissions):
+    tm = transaction.TransactionManager()
+    conn = db.open(transaction_manager=tm)
+    try:
+        for _ in range(submissions):
+            while True:
+                tm.begin()
+                try:
+                    add_submission(conn.root()["Application"].survey, make_record())
+                    tm.commit()
+                    break
+                except ConflictError:
+                    tm.abort()
+    finally:
+        conn.close()
+
+
+def spooled_writer(spool, submissions):
+    for _ in range(submissions):
+        spool.append("/survey", make_record())
+
+
+def run(mode, writers, submissions, batch_size):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = ZODB.DB(FileStorage(os.path.join(tmpdir, "Data.fs")), pool_size=writers)
+        with db.transaction() as conn:
+            app = conn.root()["Application"] = Application()
+            app._setObject("survey", Survey())
+
+        @contextmanager
+        def open_root():
+            conn = db.open()
+            try:
+                yield conn.root()["Application"]
+            finally:
+                conn.close()
+
+        if mode == "sync":
+            target, arg, worker = synchronous_writer, db, None
+        else:
+            spool = SubmissionSpool(os.path.join(tmpdir, "spool"), batch_size)
+            worker = SpoolWorker(spool, open_root, interval=0.05)
+            target, arg = spooled_writer, spool
+
+        threads = [
+            threading.Thread(target=target, args=(arg, submissions))
+            for _ in range(writers)
+        ]
+        started = time.perf_counter()
+        if worker is not None:
+            worker.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        acknowledged = time.perf_counter() - started
+        if worker is not None:
+            worker.stop()
+            spool.drain(open_root)
+        stored = time.perf_counter() - started
+
+        with open_root() as app:
+            count = len(get_results(app.survey))
+        db.close()
+
+    total = writers * submissions
+    assert count == total, (count, total)
+    print(
+        f"mode={mode:5s} writers={writers} submissions={total} "
+        f"acknowledged={total / acknowledged:.0f}/s "
+        f"stored={total / stored:.0f}/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--submissions", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    provideAdapter(AttributeAnnotations)
+    provideAdapter(annotation_results, (Interface,), IResultStorage, name="annotation")
+    for mode in ("sync", "spool"):
+        run(mode, args.writers, args.submissions, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -54,9 +54,15 @@ setup(
         'plone.api>=1.8.4',
         'plone.restapi ',
         'plone.app.dexterity',
+        'plone.indexer',
+        'plone.protect',
         'llm',
+        'z3c.caching',
     ],
     extras_require={
+        'xlsx': [
+            'openpyxl',
+        ],
         'test': [
             'plone.app.testing',
             # Plone KGS does not use this version, because it would break
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""Monthly archives of sealed poll results.
+
+Results are partitioned by the (UTC) month of their submission.
+`seal_results` moves the records of closed months out of the live
+`IResultStorage` into one gzip compressed NDJSON file per month, stored
+as a ZODB blob. Blobs live on disk next to the database and are never
+loaded into the object cache, so memory and cache use of a survey is
+bounded by its live months, however many years of results it keeps.
+
+`storage.get_results` merges archives and live results transparently;
+only views reading old results open (and decompress) an archive.
+"""
+
+from .storage import ARCHIVES_KEY
+from .storage import date_key
+from .storage import EPOCH
+from .storage import get_live_results
+from .storage import normalize_user
+from .storage import SLOTS
+from BTrees.IOBTree import IOBTree
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from itertools import islice
+from operator import itemgetter
+from persistent import Persistent
+from ZODB.blob import Blob
+from zope.annotation.interfaces import IAnnotations
+
+import gzip
+import heapq
+import orjson
+
+
+# Records per gzip member of an archive
+BLOCK_SIZE = 1000
+
+
+def month_key(dt):
+    """Partition key (`YYYYMM`) of a datetime"""
+    return dt.year * 100 + dt.month
+
+
+def month_start(key):
+    """Start of the month of a partition key"""
+    return datetime(key // 100, key % 100, 1, tzinfo=timezone.utc)
+
+
+def next_month(key):
+    """Partition key of the month after `key`"""
+    year, month = divmod(key, 100)
+    return key + 1 if month < 12 else (year + 1) * 100 + 1
+
+
+def month_of(pos):
+    """Partition key of a result position"""
+    return month_key(EPOCH + timedelta(microseconds=pos // SLOTS))
+
+
+class ResultArchive(Persistent):
+    """The sealed results of one month.
+
+    Records are stored oldest first as `[position, poll_id, user, result]`
+    JSON lines in a gzip compressed blob, written as one gzip member per
+    `BLOCK_SIZE` records. `offsets` are the file offsets of the members,
+    newest first reads decompress one member at a time. The bounds of the
+    positions and the distinct users are kept in the ZODB to skip archives
+    without opening them.
+    """
+
+    offsets = ()
+
+    def __init__(self, month, items):
+        """Streams the `(position, record)` items, oldest first, into the
+        blob"""
+        self.month = month
+        self.count = 0
+        self.first = self.last = None
+        users = set()
+        offsets = []
+        items = iter(items)
+        self.blob = Blob()
+        with self.blob.open("w") as fp:
+            while True:
+                block = list(islice(items, BLOCK_SIZE))
+                if not block:
+                    break
+                offsets.append(fp.tell())
+                with gzip.GzipFile(fileobj=fp, mode="wb", mtime=0) as archive:
+                    for pos, data in block:
+                        record = [pos, data["poll_id"], data["user"], data["result"]]
+                        archive.write(orjson.dumps(record) + b"\n")
+                        users.add(normalize_user(data["user"]))
+                if self.first is None:
+                    self.first = block[0][0]
+                self.last = block[-1][0]
+                self.count += len(block)
+            offsets.append(fp.tell())
+        self.users = tuple(sorted(users))
+        self.offsets = tuple(offsets)
+
+    def _lines(self):
+        with self.blob.open("r") as fp:
+            with gzip.GzipFile(fileobj=fp, mode="rb") as archive:
+                yield from archive
+
+    def _reversed_lines(self):
+        if not self.offsets:
+            # archives written before the blocks are one gzip member
+            yield from reversed(list(self._lines()))
+            return
+        with self.blob.open("r") as fp:
+            for start, end in reversed(list(zip(self.offsets, self.offsets[1:]))):
+                fp.seek(start)
+                block = gzip.decompress(fp.read(end - start))
+                yield from reversed(block.splitlines())
+
+    @staticmethod
+    def _item(line):
+        pos, poll_id, user, result = orjson.loads(line)
+        created = EPOCH + timedelta(microseconds=pos // SLOTS)
+        return pos, dict(poll_id=poll_id, created=created, user=user, result=result)
+
+    def items(self, reverse=False):
+        """Iterate over `(position, record)` in submission order"""
+        lines = self._reversed_lines() if reverse else self._lines()
+        for line in lines:
+            yield self._item(line)
+
+    def get(self, poll_id, default=None):
+        # only decode lines containing the poll id
+        needle = orjson.dumps(poll_id)
+        for line in self._lines():
+            if needle in line:
+                pos, data = self._item(line)
+                if data["poll_id"] == poll_id:
+                    return data
+        return default
+
+
+class ResultArchives(Persistent):
+    """The archives of a survey by month, see `seal_results`.
+
+    `_ids` maps the poll ids of archived records to their month, so lookups
+    by `poll_id` (e.g. the duplicate check of the submission spool) open
+    one archive at most.
+    """
+
+    def __init__(self):
+        self._archives = IOBTree()
+        self._ids = OOBTree()
+        self._length = Length()
+
+    def __len__(self):
+        return self._length()
+
+    def __contains__(self, poll_id):
+        return bool(poll_id) and poll_id in self._ids
+
+    def months(self):
+        """The archives, oldest first"""
+        return list(self._archives.values())
+
+    @property
+    def last(self):
+        """Newest archived position (-1 without archives)"""
+        if not self._archives:
+            return -1
+        return self._archives[self._archives.maxKey()].last
+
+    def add(self, month, items):
+        """Seal `(position, record)` items of a month, oldest first.
+
+        The items are streamed into the archive. Items sealed later for a
+        month already archived (results submitted late, e.g. through the
+        spool) are merged into its archive. Returns the number of added
+        items.
+        """
+
+        def track(items):
+            for pos, data in items:
+                self._ids[data["poll_id"]] = month
+                yield pos, data
+
+        items = track(items)
+        archive = self._archives.get(month)
+        count = 0
+        if archive is not None:
+            count = archive.count
+            items = heapq.merge(archive.items(), items, key=itemgetter(0))
+        archive = ResultArchive(month, items)
+        if archive.count > count:
+            self._archives[month] = archive
+            self._length.change(archive.count - count)
+        return archive.count - count
+
+    def get(self, poll_id, default=None):
+        month = self._ids.get(poll_id) if poll_id else None
+        if month is None:
+            return default
+        return self._archives[month].get(poll_id, default)
+
+    def items(self, reverse=True, after=None, users=None):
+        """Iterate over `(position, record)` like `IResultStorage.values`.
+
+        Archives outside of `after` or without any of `users` are skipped
+        without opening them.
+        """
+        if users is not None:
+            users = set(users)
+        archives = self._archives.values()
+        for archive in reversed(archives) if reverse else archives:
+            if after is not None and (
+                archive.first >= after if reverse else archive.last <= after
+            ):
+                continue
+            if users is not None and users.isdisjoint(archive.users):
+                continue
+            for pos, data in archive.items(reverse):
+                if after is not None and (pos >= after if reverse else pos <= after):
+                    continue
+                if users is not None and normalize_user(data["user"]) not in users:
+                    continue
+                yield pos, data
+
+    def users(self, prefix=""):
+        """Distinct archived users starting with `prefix`"""
+        return {
+            user
+            for archive in self._archives.values()
+            for user in archive.users
+            if user.startswith(prefix)
+        }
+
+    def clear(self):
+        self._archives = IOBTree()
+        self._ids = OOBTree()
+        self._length.set(0)
+
+
+def get_archives(context):
+    """Return the `ResultArchives` of a survey"""
+    annos = IAnnotations(context)
+    archives = annos.get(ARCHIVES_KEY)
+    if archives is None:
+        archives = annos[ARCHIVES_KEY] = ResultArchives()
+    return archives
+
+
+def month_items(results, end):
+    """The `(position, record)` items of `results` before position `end`,
+    oldest first"""
+    records = zip(results.positions(reverse=False), results.values(reverse=False))
+    for pos, data in records:
+        if pos >= end:
+            return
+        yield pos, data
+
+
+def seal_results(context, before=None, on_batch=None):
+    """Move the results of closed months into archives.
+
+    Seals every month before the month of `before` (default: now, so all
+    months but the current one). Every month is streamed into its archive
+    in one batch and `on_batch` is called after it (e.g. to commit).
+    Returns the number of sealed records.
+    """
+    live = get_live_results(context)
+    archives = get_archives(context)
+    limit = month_start(month_key(before or datetime.now(timezone.utc)))
+    limit = date_key(limit) * SLOTS
+    sealed = 0
+    while True:
+        first = next(iter(live.positions(reverse=False)), None)
+        if first is None or first >= limit:
+            return sealed
+        month = month_of(first)
+        end = min(limit, date_key(month_start(next_month(month))) * SLOTS)
+        archives.add(month, month_items(live, end))
+        # the records are removed in batches, not collected while sealing
+        while True:
+            batch = islice(month_items(live, end), BLOCK_SIZE)
+            poll_ids = [data["poll_id"] for _, data in batch]
+            if not poll_ids:
+                break
+            for poll_id in poll_ids:
+                live.remove(poll_id)
+            sealed += len(poll_ids)
+        if on_batch is not None:
+            on_batch()
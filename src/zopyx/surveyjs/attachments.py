@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Blob storage for files uploaded with poll submissions.
+
+SurveyJS file questions submit `{name, type, content}` objects whose
+`content` is a data URI. `extract_attachments` moves the file data into
+ZODB blobs and replaces `content` by the id of the stored `Attachment`,
+so result records stay small.
+"""
+
+from BTrees.OOBTree import OOBTree
+from persistent import Persistent
+from ZODB.blob import Blob
+from zope.annotation.interfaces import IAnnotations
+from zope.interface import implementer
+from ZPublisher.HTTPResponse import make_content_disposition
+from ZPublisher.Iterators import IStreamIterator
+
+import base64
+import binascii
+import re
+import urllib.parse
+import uuid
+
+
+ATTACHMENTS_KEY = "zopyx.surveyjs.attachments"
+
+DATA_URI = re.compile(r"^data:(?P<type>[^;,]*)(?P<params>(;[^;,]*)*),", re.DOTALL)
+
+MEDIA_TYPE = re.compile(r"^[a-z0-9!#$&^_.+-]+/[a-z0-9!#$&^_.+-]+$")
+
+# Types `download-attachment` serves inline, all other files are served
+# as download. Raster images only, SVG documents can run script.
+INLINE_TYPES = frozenset(("image/gif", "image/jpeg", "image/png", "image/webp"))
+
+
+def media_type(content_type):
+    """Return `content_type` normalized, application/octet-stream if it is
+    no valid media type"""
+    content_type = (content_type or "").strip().lower()
+    if MEDIA_TYPE.match(content_type) is None:
+        return "application/octet-stream"
+    return content_type
+
+
+def content_disposition(content_type, filename):
+    """The `Content-Disposition` header serving a file of `content_type`.
+
+    Non-ASCII filenames are sent as RFC 6266 `filename*`, quotes,
+    backslashes and control characters are dropped.
+    """
+    disposition = "inline" if media_type(content_type) in INLINE_TYPES else "attachment"
+    filename = re.sub(r'["\\\x00-\x1f\x7f]', "", filename) or "attachment"
+    return make_content_disposition(disposition, filename)
+
+
+def decode_data_uri(uri):
+    """Return `(content_type, data)` of a data URI or None"""
+    match = DATA_URI.match(uri)
+    if match is None:
+        return None
+    payload = uri[match.end() :]
+    try:
+        if ";base64" in match.group("params"):
+            data = base64.b64decode(payload, validate=True)
+        else:
+            data = urllib.parse.unquote_to_bytes(payload)
+    except (binascii.Error, ValueError):
+        return None
+    content_type = match.group("type").strip()
+    return media_type(content_type) if content_type else "text/plain", data
+
+
+class Attachment(Persistent):
+    """A file uploaded with a poll submission"""
+
+    def __init__(self, attachment_id, poll_id, filename, content_type, data):
+        self.id = attachment_id
+        self.poll_id = poll_id
+        self.filename = filename
+        self.content_type = content_type
+        self.size = len(data)
+        self.blob = Blob()
+        with self.blob.open("w") as fp:
+            fp.write(data)
+
+
+def get_attachments(context):
+    """Return the attachments of a survey keyed by their id"""
+    annos = IAnnotations(context)
+    attachments = annos.get(ATTACHMENTS_KEY)
+    if attachments is None:
+        attachments = annos[ATTACHMENTS_KEY] = OOBTree()
+    return attachments
+
+
+def clear_attachments(context):
+    """Drop all attachments of a survey"""
+    IAnnotations(context)[ATTACHMENTS_KEY] = OOBTree()
+
+
+def is_upload(value):
+    return (
+        isinstance(value, dict)
+        and isinstance(value.get("content"), str)
+        and value["content"].startswith("data:")
+    )
+
+
+def extract_attachments(context, result, poll_id):
+    """Store the uploaded files of a poll result as attachments.
+
+    Returns a copy of `result` where every uploaded file has its data URI
+    replaced by `{"attachment": <id>, "size": <bytes>}` next to `name` and
+    `type`. File answers can be nested in dynamic panels and matrices, so
+    the whole result is searched.
+    """
+    attachments = None
+
+    def convert(value):
+        nonlocal attachments
+        if is_upload(value):
+            decoded = decode_data_uri(value["content"])
+            if decoded is None:
+                return value
+            content_type, data = decoded
+            if attachments is None:
+                attachments = get_attachments(context)
+            attachment = Attachment(
+                uuid.uuid4().hex,
+                poll_id,
+                value.get("name") or "attachment",
+                # the type of the data URI, not the type the client claims
+                content_type,
+                data,
+            )
+            attachments[attachment.id] = attachment
+            converted = dict((k, v) for k, v in value.items() if k != "content")
+            converted.update(attachment=attachment.id, size=attachment.size)
+            return converted
+        if isinstance(value, dict):
+            return dict((k, convert(v)) for k, v in value.items())
+        if isinstance(value, list):
+            return [convert(v) for v in value]
+        return value
+
+    return convert(result)
+
+
+def parse_range(header, size):
+    """Parse a single byte range of a `Range` header.
+
+    Returns `(start, end)` with an inclusive `end`, None if the header is
+    missing or can't be handled (the whole file is served then) and
+    raises ValueError for an unsatisfiable range.
+    """
+    if not header or not header.startswith("bytes=") or not size:
+        return None
+    spec = header[len("bytes=") :].strip()
+    if "," in spec or "-" not in spec:
+        # multipart ranges are not supported, serve the whole file
+        return None
+    first, last = (part.strip() for part in spec.split("-", 1))
+    try:
+        if not first:
+            # suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise ValueError(header)
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise ValueError(header)
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+@implementer(IStreamIterator)
+class range_iterator(object):
+    """Stream the byte range `start..end` (inclusive) of a file"""
+
+    def __init__(self, filename, start, end, streamsize=1 << 16):
+        self.fp = open(filename, "rb")
+        self.fp.seek(start)
+        self.remaining = self.length = end - start + 1
+        self.streamsize = streamsize
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.remaining <= 0:
+            self.fp.close()
+            raise StopIteration
+        data = self.fp.read(min(self.streamsize, self.remaining))
+        if not data:
+            self.fp.close()
+            raise StopIteration
+        self.remaining -= len(data)
+        return data
+
+    next = __next__
+
+    def __len__(self):
+        return self.length
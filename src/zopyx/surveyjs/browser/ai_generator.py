@@ -5,6 +5,292 @@ This module provides functions for generating SurveyJS forms using LLM models.
 Extracted from experimental/survey_bot.py for reuse in web views.
 """
 
+from ..forms import InvalidForm
+from ..forms import validate_form
+from ..patches import apply_patch
+from ..patches import PatchError
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from functools import partial
+
+import copy
+import hashlib
+import json
+import logging
+import orjson
+import threading
+import time
+
+
+LOG = logging.getLogger("zopyx.surveyjs")
+
+# Prompt template of `generate_survey_json`, `{question}` is replaced by the
+# description of the form
+GENERATE_PROMPT = """
+    Generate a SurveyJS JSON object for a survey based on the following question:
+    "{question}"
+
+    The JSON should represent a simple survey with one page and relevant question types (e.g., text, checkbox, radiobutton).
+    Ensure the output is valid JSON and only the JSON. Do not include any additional text or markdown formatting outside the JSON object.
+    Reason about fields belonging semantically together like lastname and firstname. These fields should be placed on the same row.
+    Always include a hidden field "uuid" as string with an generated UUID4 as default and a hidden field "created" as str.
+    Always use a dynamic matrix field where you can add, remote and edit rows for a given set of columns.
+    """
+
+# Prompt templates of `refine_form`, `{form}` is replaced by the compact
+# JSON of the current form and `{refinement}` by the requested changes.
+# In "full" mode the model returns the complete form, in "patch" mode only
+# an RFC 6902 JSON patch, so the completion doesn't grow with the form.
+REFINE_PROMPT = """
+    You are refining an existing SurveyJS form. Here is the current form definition:
+
+    {form}
+
+    The user wants to make the following changes:
+    "{refinement}"
+
+    Please modify the form JSON according to the user's request. Return ONLY the complete updated JSON.
+    Important guidelines:
+    - Maintain all existing fields unless explicitly asked to change or remove them
+    - Preserve the form structure, field names, and IDs where possible
+    - Keep the hidden "uuid" and "created" fields
+    - Ensure the output is valid JSON with no additional text or markdown formatting
+    - Apply the requested changes while maintaining form coherence
+    - If adding new fields, follow the same patterns as existing fields
+    - Use semantic grouping (e.g., related fields on the same row)
+    """
+
+PATCH_PROMPT = """
+    You are refining an existing SurveyJS form. Here is the current form definition:
+
+    {form}
+
+    The user wants to make the following changes:
+    "{refinement}"
+
+    Return ONLY an RFC 6902 JSON Patch (a JSON array of operations) that applies these changes to the form above.
+    Important guidelines:
+    - Use the operations "add", "remove", "replace" and "move" with JSON pointer paths like "/pages/0/elements/2/title"
+    - List indexes count from 0, use "-" to append to a list, later operations see the effect of earlier ones
+    - Do not return the complete form, no additional text or markdown formatting
+    - Maintain all existing fields unless explicitly asked to change or remove them
+    - Keep the hidden "uuid" and "created" fields
+    - If adding new fields, follow the same patterns as existing fields
+    """
+
+# Refinement modes of `refine_form`
+REFINE_PATCH = "patch"
+REFINE_FULL = "full"
+REFINE_MODES = (REFINE_PATCH, REFINE_FULL)
+
+# Seconds the AI settings are cached per process. Saving the control panel
+# clears them right away in the saving process, other processes of a ZEO
+# cluster pick up the change after this delay.
+SETTINGS_TTL = 60
+
+# Characters per token when estimating the usage of models not reporting it
+CHARS_PER_TOKEN = 4
+
+# Concurrent candidate generations of `generate_form`; the first valid form
+# wins. Every candidate costs a model call, 1 only retries invalid forms.
+GENERATE_CANDIDATES = 2
+
+# Model calls of `generate_form` at most, retries of invalid forms included
+GENERATE_ATTEMPTS = 4
+
+# Number of cached generations and their lifetime in seconds
+CACHE_SIZE = 128
+CACHE_TTL = 24 * 3600
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    Normalizes a prompt for cache lookups.
+
+    Prompts differing only in case or whitespace produce the same form, so
+    whitespace runs are collapsed and the text is case folded.
+    """
+    return " ".join(text.split()).casefold()
+
+
+class GenerationCache(object):
+    """
+    Thread-safe LRU cache of LLM generations with a time to live.
+
+    One instance (`generation_cache`) is shared by all threads of a Zope
+    process. Entries are keyed by `key`, expired entries are dropped on
+    access, the least recently used ones once `maxsize` is exceeded.
+    """
+
+    def __init__(
+        self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL, clock=time.monotonic
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(prompt: str, model_name: str, template: str) -> str:
+        """
+        Cache key of a generation.
+
+        Args:
+            prompt: The user prompt, normalized with `normalize_prompt`
+            model_name: Name of the LLM model generating the form
+            template: The prompt template the user prompt is embedded in
+
+        Returns:
+            SHA-256 hex digest identifying the generation
+        """
+        data = json.dumps([normalize_prompt(prompt), model_name or "", template])
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """Returns the cached value for `key` or None, counting hits and misses"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value) -> None:
+        """Caches `value` for `key`, evicting the least recently used entries"""
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Hit/miss counters and size of the cache"""
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                size=len(self._entries),
+                maxsize=self.maxsize,
+                ttl=self.ttl,
+            )
+
+
+generation_cache = GenerationCache()
+
+
+class ModelRegistry(object):
+    """
+    Process-wide cache of llm models and of the AI settings of each site.
+
+    `llm.get_model` runs the llm plugin discovery, so every model is looked
+    up once per model name and API key and the instance is then shared by
+    all threads. Each entry is a copy of the llm model with the API key set
+    on it (`model.key`) instead of in the process environment, where
+    concurrent requests would overwrite each other's keys. Entries are
+    keyed by a hash of the API key, the key itself is only kept on the
+    model. The settings are cached per site, a Zope instance may serve
+    several Plone sites with their own model and key. `clear` is called
+    when the AI settings are saved.
+    """
+
+    def __init__(self, settings_ttl: float = SETTINGS_TTL, clock=time.monotonic):
+        self.settings_ttl = settings_ttl
+        self.clock = clock
+        self._models = {}
+        self._settings = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model_name: str, api_key: str = None) -> tuple:
+        """Cache key of a model: its name and the SHA-256 of the API key"""
+        digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest() if api_key else ""
+        return model_name, digest
+
+    def get(self, model_name: str, api_key: str = None):
+        """
+        The llm model `model_name` using `api_key`.
+
+        Raises:
+            ImportError: If llm module is not installed
+            llm.UnknownModelError: If no llm plugin provides the model
+        """
+        key = self.key(model_name, api_key)
+        with self._lock:
+            model = self._models.get(key)
+        if model is None:
+            try:
+                import llm
+            except ImportError:
+                raise ImportError(
+                    "The 'llm' module is not installed. Please install it using 'pip install llm'"
+                )
+
+            # plugin discovery runs unlocked, a concurrent lookup of the same
+            # model just loses the race
+            model = copy.copy(llm.get_model(model_name))
+            if api_key:
+                model.key = api_key
+            with self._lock:
+                model = self._models.setdefault(key, model)
+        return model
+
+    def add(self, model_name: str, model, api_key: str = None) -> None:
+        """
+        Serves `model` as `model_name`, e.g. a model not provided by an llm
+        plugin like `testing_llm.OfflineModel`. Needs no llm module.
+        """
+        with self._lock:
+            self._models[self.key(model_name, api_key)] = model
+
+    def settings(self, load, site: str = "") -> tuple:
+        """
+        The AI settings of `site` (e.g. the physical path of the Plone
+        site) returned by `load()`, cached for `settings_ttl` seconds.
+        """
+        with self._lock:
+            cached = self._settings.get(site)
+            if cached is not None and cached[0] > self.clock():
+                return cached[1]
+        settings = load()
+        with self._lock:
+            self._settings[site] = (self.clock() + self.settings_ttl, settings)
+        return settings
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+            self._settings.clear()
+
+    def stats(self) -> dict:
+        """Number of cached models and of sites with cached settings"""
+        with self._lock:
+            return dict(models=len(self._models), settings=len(self._settings))
+
+
+model_registry = ModelRegistry()
+
+
+def settings_modified(event):
+    """Clears `model_registry` when a Forms setting is saved"""
+    record = getattr(event, "record", None)
+    interface = getattr(record, "interfaceName", None)
+    if interface == "zopyx.surveyjs.interfaces.IFormsSettings":
+        model_registry.clear()
+
 
 def strip_markdown_json(text: str) -> str:
     """
@@ -30,8 +316,127 @@ def strip_markdown_json(text: str) -> str:
     return text.strip()
 
 
+def resolve_model_name(model_name: str = None) -> str:
+    """
+    Returns the LLM model to use, falling back to the llm default model.
+
+    Raises:
+        ValueError: If no model is configured or provided
+    """
+    if model_name:
+        return model_name
+    import llm
+
+    try:
+        model_name = llm.get_default_model()
+        if not model_name:
+            raise ValueError(
+                "No AI model configured. Please configure one in Site Setup > Forms or set a default using: llm set-default MODEL_NAME"
+            )
+    except Exception as e:
+        raise ValueError(
+            f"Failed to get AI model. Please configure one in Site Setup > Forms. Error: {e}"
+        )
+    return model_name
+
+
+class Cancelled(Exception):
+    """A candidate generation is no longer needed"""
+
+
+def stream_text(response, on_chunk) -> str:
+    """
+    Reads an llm response chunk by chunk.
+
+    Iterating an llm response yields the text as the model produces it.
+    Every chunk is passed to `on_chunk`, the complete text is returned.
+    `on_chunk` may raise `Cancelled` to stop reading the response.
+    """
+    chunks = []
+    for chunk in response:
+        chunks.append(chunk)
+        on_chunk(chunk)
+    return "".join(chunks)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of `text` for models not reporting their usage"""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def response_usage(response, prompt: str, text: str) -> dict:
+    """
+    Prompt and completion tokens of an llm response.
+
+    Uses the usage reported by the model (`response.usage()`), counts the
+    model doesn't report are estimated from the text length and flagged
+    as `estimated`.
+    """
+    input_tokens = output_tokens = None
+    if callable(getattr(response, "usage", None)):
+        try:
+            usage = response.usage()
+            input_tokens, output_tokens = usage.input, usage.output
+        except Exception:
+            pass
+    estimated = input_tokens is None or output_tokens is None
+    if input_tokens is None:
+        input_tokens = estimate_tokens(prompt)
+    if output_tokens is None:
+        output_tokens = estimate_tokens(text)
+    return dict(
+        input_tokens=input_tokens, output_tokens=output_tokens, estimated=estimated
+    )
+
+
+def prompt_model(
+    prompt: str,
+    model_name: str = None,
+    api_key: str = None,
+    on_chunk=None,
+    action: str = "generate",
+) -> tuple:
+    """
+    Sends `prompt` to an LLM model.
+
+    Args:
+        prompt: The complete prompt
+        model_name: Optional LLM model to use, defaults to the llm default model
+        api_key: Optional API key for the model provider
+        on_chunk: Optional callable receiving the response text as it streams
+        action: Verb used in error messages ("generate", "refine")
+
+    Returns:
+        The response text and its token usage (see `response_usage`)
+
+    Raises:
+        ImportError: If llm module is not installed
+        ValueError: If no model is configured or provided
+        Exception: For other LLM-related errors
+    """
+    model_name = resolve_model_name(model_name)
+
+    try:
+        # the API key is set on the cached model, see `ModelRegistry`
+        model = model_registry.get(model_name, api_key)
+        response = model.prompt(prompt)
+
+        if on_chunk is not None:
+            response_text = stream_text(response, on_chunk)
+        else:
+            # Handle both callable and property versions of response.text
+            response_text = (
+                response.text() if callable(response.text) else response.text
+            )
+        return response_text, response_usage(response, prompt, response_text)
+    except (Cancelled, ImportError):
+        raise
+    except Exception as e:
+        raise Exception(f"Failed to {action} form with model '{model_name}': {str(e)}")
+
+
 def generate_survey_json(
-    question: str, model_name: str = None, api_key: str = None
+    question: str, model_name: str = None, api_key: str = None, on_chunk=None
 ) -> str:
     """
     Generates SurveyJS JSON data based on a given question using the llm module.
@@ -42,6 +447,8 @@ def generate_survey_json(
                    If not provided, uses llm default model.
         api_key: Optional API key for the model provider. If not provided, uses
                 environment variables or llm configured keys.
+        on_chunk: Optional callable receiving the response text chunk by chunk
+                 while the model streams it.
 
     Returns:
         JSON string containing the SurveyJS form definition
@@ -51,68 +458,31 @@ def generate_survey_json(
         ValueError: If no model is configured or provided
         Exception: For other LLM-related errors
     """
-    # Import llm here to provide better error messages
-    try:
-        import llm
-    except ImportError:
-        raise ImportError(
-            "The 'llm' module is not installed. Please install it using 'pip install llm'"
-        )
-
     # The prompt instructs the LLM to generate SurveyJS JSON.
     # It's crucial to guide the LLM to produce valid JSON.
-    prompt = f"""
-    Generate a SurveyJS JSON object for a survey based on the following question:
-    "{question}"
-
-    The JSON should represent a simple survey with one page and relevant question types (e.g., text, checkbox, radiobutton).
-    Ensure the output is valid JSON and only the JSON. Do not include any additional text or markdown formatting outside the JSON object.
-    Reason about fields belonging semantically together like lastname and firstname. These fields should be placed on the same row.
-    Always include a hidden field "uuid" as string with an generated UUID4 as default and a hidden field "created" as str.
-    Always use a dynamic matrix field where you can add, remote and edit rows for a given set of columns.
-    """
-
-    # Determine which model to use
-    if not model_name:
-        # Fall back to llm default model
-        try:
-            model_name = llm.get_default_model()
-            if not model_name:
-                raise ValueError(
-                    "No AI model configured. Please configure one in Site Setup > Forms or set a default using: llm set-default MODEL_NAME"
-                )
-        except Exception as e:
-            raise ValueError(
-                f"Failed to get AI model. Please configure one in Site Setup > Forms. Error: {e}"
-            )
+    prompt = GENERATE_PROMPT.format(question=question)
+    return prompt_model(prompt, model_name, api_key, on_chunk, "generate")[0]
 
-    # Generate the survey JSON
-    try:
-        model = llm.get_model(model_name)
 
-        # Set API key if provided
-        if api_key:
-            # Try to set the key via environment for this request
-            import os
+def compact_json(data) -> str:
+    """`data` as JSON without any whitespace, as sent to the model"""
+    return orjson.dumps(data).decode("utf-8")
 
-            # Determine the env var name based on model provider
-            if "gpt" in model_name.lower() or "openai" in model_name.lower():
-                os.environ["OPENAI_API_KEY"] = api_key
-            elif "claude" in model_name.lower() or "anthropic" in model_name.lower():
-                os.environ["ANTHROPIC_API_KEY"] = api_key
-            # Add more providers as needed
 
-        response = model.prompt(prompt)
-
-        # Handle both callable and property versions of response.text
-        response_text = response.text() if callable(response.text) else response.text
-        return response_text
-    except Exception as e:
-        raise Exception(f"Failed to generate form with model '{model_name}': {str(e)}")
+def refine_prompt(current_json: dict, refinement_prompt: str, mode: str) -> str:
+    """The prompt refining `current_json` in `mode` ("patch" or "full")"""
+    template = PATCH_PROMPT if mode == REFINE_PATCH else REFINE_PROMPT
+    return template.format(
+        form=compact_json(current_json), refinement=refinement_prompt
+    )
 
 
 def refine_survey_json(
-    current_json: dict, refinement_prompt: str, model_name: str = None, api_key: str = None
+    current_json: dict,
+    refinement_prompt: str,
+    model_name: str = None,
+    api_key: str = None,
+    on_chunk=None,
 ) -> str:
     """
     Refines an existing SurveyJS form based on user feedback.
@@ -124,6 +494,8 @@ def refine_survey_json(
                    If not provided, uses llm default model.
         api_key: Optional API key for the model provider. If not provided, uses
                 environment variables or llm configured keys.
+        on_chunk: Optional callable receiving the response text chunk by chunk
+                 while the model streams it.
 
     Returns:
         JSON string containing the refined SurveyJS form definition
@@ -133,70 +505,289 @@ def refine_survey_json(
         ValueError: If no model is configured or provided
         Exception: For other LLM-related errors
     """
-    # Import llm here to provide better error messages
-    try:
-        import llm
-    except ImportError:
-        raise ImportError(
-            "The 'llm' module is not installed. Please install it using 'pip install llm'"
-        )
+    prompt = refine_prompt(current_json, refinement_prompt, REFINE_FULL)
+    return prompt_model(prompt, model_name, api_key, on_chunk, "refine")[0]
 
-    import json
 
-    # Construct refinement prompt that includes context
-    prompt = f"""
-    You are refining an existing SurveyJS form. Here is the current form definition:
+class CandidateStream(object):
+    """
+    Relays the streamed text of one candidate generation at a time.
 
-    {json.dumps(current_json, indent=2)}
+    The first candidate sending a chunk is streamed to `on_chunk`, the text
+    of the others is buffered. If the streamed candidate fails, the stream
+    is reset (`on_chunk(None)`) and continues with another candidate. Once
+    `finished` is set, further chunks cancel their candidate.
+    """
 
-    The user wants to make the following changes:
-    "{refinement_prompt}"
+    def __init__(self, on_chunk=None):
+        self.on_chunk = on_chunk
+        self.finished = threading.Event()
+        self.owner = None
+        self._texts = {}
+        self._lock = threading.Lock()
+
+    def chunk(self, candidate, chunk):
+        if self.finished.is_set():
+            raise Cancelled()
+        with self._lock:
+            self._texts.setdefault(candidate, []).append(chunk)
+            if self.on_chunk is None:
+                return
+            if self.owner is None:
+                self.owner = candidate
+                self.on_chunk("".join(self._texts[candidate]))
+            elif self.owner == candidate:
+                self.on_chunk(chunk)
+
+    def failed(self, candidate):
+        with self._lock:
+            self._texts.pop(candidate, None)
+            if self.owner == candidate and self.on_chunk is not None:
+                self.owner = None
+                self.on_chunk(None)
+                for other, chunks in self._texts.items():
+                    self.owner = other
+                    self.on_chunk("".join(chunks))
+                    break
+
+    def won(self, candidate, text):
+        """Ends the stream with the complete `text` of the winner"""
+        self.finished.set()
+        with self._lock:
+            if self.owner != candidate and self.on_chunk is not None:
+                self.owner = candidate
+                self.on_chunk(None)
+                self.on_chunk(text)
+
+
+def generate_candidate(prompt, model_name, api_key, stream, candidate):
+    """
+    One candidate generation of `generate_form`.
 
-    Please modify the form JSON according to the user's request. Return ONLY the complete updated JSON.
-    Important guidelines:
-    - Maintain all existing fields unless explicitly asked to change or remove them
-    - Preserve the form structure, field names, and IDs where possible
-    - Keep the hidden "uuid" and "created" fields
-    - Ensure the output is valid JSON with no additional text or markdown formatting
-    - Apply the requested changes while maintaining form coherence
-    - If adding new fields, follow the same patterns as existing fields
-    - Use semantic grouping (e.g., related fields on the same row)
+    Returns:
+        The cleaned JSON text and the validated form
+
+    Raises:
+        Cancelled: If another candidate won already
+        orjson.JSONDecodeError, InvalidForm: If the model answered no valid form
     """
+    if stream.finished.is_set():
+        raise Cancelled()
+    survey_json_str = generate_survey_json(
+        prompt,
+        model_name=model_name,
+        api_key=api_key,
+        on_chunk=partial(stream.chunk, candidate),
+    )
+    # Strip any markdown formatting
+    cleaned_json_str = strip_markdown_json(survey_json_str)
+    try:
+        survey_data = orjson.loads(cleaned_json_str)
+        validate_form(survey_data)
+    except (orjson.JSONDecodeError, InvalidForm) as e:
+        e.raw_output = cleaned_json_str or survey_json_str
+        raise
+    return cleaned_json_str, survey_data
+
+
+def generate_form(
+    prompt: str,
+    model_name: str,
+    api_key: str = None,
+    cache_key: str = None,
+    on_chunk=None,
+    candidates: int = GENERATE_CANDIDATES,
+    attempts: int = GENERATE_ATTEMPTS,
+) -> dict:
+    """
+    Generates a form and returns the result as sent to the browser.
 
-    # Determine which model to use
-    if not model_name:
-        # Fall back to llm default model
-        try:
-            model_name = llm.get_default_model()
-            if not model_name:
-                raise ValueError(
-                    "No AI model configured. Please configure one in Site Setup > Forms or set a default using: llm set-default MODEL_NAME"
-                )
-        except Exception as e:
-            raise ValueError(
-                f"Failed to get AI model. Please configure one in Site Setup > Forms. Error: {e}"
-            )
+    Runs as a background job (see `ai_jobs`), `on_chunk` receives the
+    response text as it streams in (see `CandidateStream`). `candidates`
+    generations run concurrently and the first one answering a valid
+    SurveyJS form (see `validate_form`) wins. Invalid answers are retried
+    until `attempts` model calls were made; once a form won, queued
+    candidates are dropped and running ones are cancelled on their next
+    chunk. Valid forms are stored in `generation_cache` under `cache_key`.
+
+    Returns:
+        `{"success": True, "json": form, "attempts": n}` or
+        `{"error": ..., "message": ...}`
+    """
+    stream = CandidateStream(on_chunk)
+    executor = ThreadPoolExecutor(candidates, thread_name_prefix="zopyx.surveyjs-ai")
+    started = 0
+    pending = {}
+    invalid = error = None
+
+    def start():
+        nonlocal started
+        future = executor.submit(
+            generate_candidate, prompt, model_name, api_key, stream, started
+        )
+        pending[future] = started
+        started += 1
+
+    try:
+        while started < min(candidates, attempts):
+            start()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                candidate = pending.pop(future)
+                try:
+                    cleaned_json_str, survey_data = future.result()
+                except Cancelled:
+                    continue
+                except (orjson.JSONDecodeError, InvalidForm) as e:
+                    LOG.info("AI candidate %s invalid: %s", candidate, e)
+                    invalid = e
+                    stream.failed(candidate)
+                    if started < attempts:
+                        start()
+                    continue
+                except Exception as e:
+                    # model or configuration errors are not retried
+                    error = e
+                    stream.failed(candidate)
+                    continue
+                stream.won(candidate, cleaned_json_str)
+                if cache_key is not None:
+                    generation_cache.set(cache_key, cleaned_json_str)
+                return {
+                    "success": True,
+                    "json": survey_data,
+                    "cached": False,
+                    "attempts": started,
+                }
+    finally:
+        stream.finished.set()
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+    if isinstance(error, ValueError):
+        return {"error": "Configuration error", "message": str(error)}
+    if error is not None:
+        return {"error": "Generation failed", "message": str(error)}
+    if isinstance(invalid, InvalidForm):
+        return {
+            "error": "Invalid form generated",
+            "message": f"The AI generated an invalid form: {str(invalid)}",
+            "raw_output": invalid.raw_output,
+            "attempts": started,
+        }
+    return {
+        "error": "Invalid JSON generated",
+        "message": f"The AI generated invalid JSON: {str(invalid)}",
+        "raw_output": invalid.raw_output,
+        "attempts": started,
+    }
+
+
+def patch_form(current_json: dict, text: str):
+    """
+    Applies the JSON patch answered by the model to `current_json`.
+
+    Returns:
+        The patched form and the patch
 
-    # Refine the survey JSON
+    Raises:
+        PatchError: If the answer is no applicable, non-empty JSON patch
+        InvalidForm: If the patched form is no valid SurveyJS form
+    """
     try:
-        model = llm.get_model(model_name)
+        patch = orjson.loads(strip_markdown_json(text))
+    except orjson.JSONDecodeError as e:
+        raise PatchError(f"The AI returned no JSON patch: {e}")
+    if not patch:
+        raise PatchError("The AI returned an empty JSON patch")
+    refined_data = apply_patch(current_json, patch)
+    validate_form(refined_data)
+    return refined_data, patch
+
+
+def refine_form(
+    current_json: dict,
+    refinement_prompt: str,
+    model_name: str,
+    api_key: str = None,
+    on_chunk=None,
+    mode: str = REFINE_PATCH,
+) -> dict:
+    """
+    Refines a form and returns the result as sent to the browser.
 
-        # Set API key if provided
-        if api_key:
-            # Try to set the key via environment for this request
-            import os
+    Runs as a background job (see `ai_jobs`), `on_chunk` receives the
+    response text as it streams in. In "patch" mode the model answers with
+    a JSON patch against the compact form; if that patch can't be parsed or
+    applied, or the patched form fails `validate_form`, the form is refined
+    again in "full" mode, where the model answers with the complete form.
+    `on_chunk(None)` signals that the text streamed so far is discarded.
 
-            # Determine the env var name based on model provider
-            if "gpt" in model_name.lower() or "openai" in model_name.lower():
-                os.environ["OPENAI_API_KEY"] = api_key
-            elif "claude" in model_name.lower() or "anthropic" in model_name.lower():
-                os.environ["ANTHROPIC_API_KEY"] = api_key
-            # Add more providers as needed
+    Returns:
+        `{"success": True, "json": form, "mode": ..., "usage": [...]}` or
+        `{"error": ..., "message": ...}`. `usage` lists the tokens of every
+        model call (see `response_usage`) with its mode.
+    """
+    usage = []
+
+    def ask(mode):
+        text, tokens = prompt_model(
+            refine_prompt(current_json, refinement_prompt, mode),
+            model_name,
+            api_key,
+            on_chunk,
+            "refine",
+        )
+        usage.append(dict(tokens, mode=mode))
+        return text
 
-        response = model.prompt(prompt)
+    if mode == REFINE_PATCH:
+        try:
+            refined_data, patch = patch_form(current_json, ask(REFINE_PATCH))
+            LOG.info("AI refinement patched the form: %s", usage[-1])
+            return {
+                "success": True,
+                "json": refined_data,
+                "mode": REFINE_PATCH,
+                "patch": patch,
+                "usage": usage,
+            }
+        except (PatchError, InvalidForm) as e:
+            LOG.info("AI patch not applicable, refining the full form: %s", e)
+            if on_chunk is not None:
+                on_chunk(None)
+        except ValueError as e:
+            return {"error": "Validation error", "message": str(e), "usage": usage}
+        except Exception as e:
+            return {"error": "Refinement failed", "message": str(e), "usage": usage}
 
-        # Handle both callable and property versions of response.text
-        response_text = response.text() if callable(response.text) else response.text
-        return response_text
+    refined_json_str = cleaned_json_str = None
+    try:
+        refined_json_str = ask(REFINE_FULL)
+        # Strip any markdown formatting
+        cleaned_json_str = strip_markdown_json(refined_json_str)
+        refined_data = orjson.loads(cleaned_json_str)
+        validate_form(refined_data)
+    except orjson.JSONDecodeError as e:
+        return {
+            "error": "Invalid JSON",
+            "message": f"JSON parsing error: {str(e)}",
+            "raw_output": cleaned_json_str or refined_json_str,
+            "usage": usage,
+        }
+    except InvalidForm as e:
+        return {
+            "error": "Invalid form",
+            "message": f"The AI refined the form into an invalid form: {str(e)}",
+            "raw_output": cleaned_json_str,
+            "usage": usage,
+        }
+    except ValueError as e:
+        return {"error": "Validation error", "message": str(e), "usage": usage}
     except Exception as e:
-        raise Exception(f"Failed to refine form with model '{model_name}': {str(e)}")
+        return {"error": "Refinement failed", "message": str(e), "usage": usage}
+
+    LOG.info("AI refinement regenerated the form: %s", usage)
+    return {"success": True, "json": refined_data, "mode": REFINE_FULL, "usage": usage}
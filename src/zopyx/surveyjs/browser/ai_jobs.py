@@ -0,0 +1,325 @@
+"""
+Background jobs for LLM calls.
+
+LLM round-trips take seconds. Running them in the request would pin a
+Zope worker thread for the whole time, so a few editors on the AI page
+could starve respondents of workers. Instead, the AI views submit a job
+to a bounded thread pool and return its id right away; the page polls
+`@@ai-job-status` for the outcome.
+
+Streaming jobs also collect the response text as the model produces it.
+`@@ai-job-events` relays it as Server-Sent Events (`JobQueue.events`)
+so the page can render the form while it is being written. Every events
+request answers right away with the text buffered since the event id the
+browser sends as `Last-Event-ID` and ends the response, the browser
+reconnects after `EVENTS_RETRY` milliseconds. Like polling, no request
+waits for the model.
+
+Jobs must not touch the ZODB: everything they need (prompt, current
+form, settings) is read in the request and passed in.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import logging
+import orjson
+import threading
+import time
+import uuid
+
+
+LOG = logging.getLogger("zopyx.surveyjs")
+
+# Threads running LLM calls per Zope process
+MAX_WORKERS = 4
+
+# Queued and running jobs per Zope process, more are rejected
+MAX_PENDING = 16
+
+# Seconds after which an unfinished job is reported as timed out
+JOB_TIMEOUT = 180
+
+# Seconds finished jobs are kept for polling
+JOB_TTL = 600
+
+# Milliseconds until the browser requests the next events of a job
+EVENTS_RETRY = 1000
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+TIMEOUT = "timeout"
+
+
+class QueueFull(Exception):
+    """Too many pending jobs"""
+
+
+class Job(object):
+    """An LLM call running in the background"""
+
+    def __init__(self, owner, created):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.status = QUEUED
+        self.result = None
+        self.created = created
+        self.started = None
+        self.first_chunk = None
+        self.finished = None
+        self.chunks = []
+        self.resets = 0
+
+    @property
+    def pending(self):
+        return self.status in (QUEUED, RUNNING)
+
+    def timings(self):
+        """
+        Seconds spent queued, until the first chunk (time to first byte)
+        and generating in total, None for phases not reached
+        """
+
+        def since(start, end):
+            if start is None or end is None:
+                return None
+            return round(end - start, 3)
+
+        return dict(
+            queued=since(self.created, self.started),
+            ttfb=since(self.started, self.first_chunk),
+            total=since(self.started, self.finished),
+        )
+
+    def info(self):
+        """Status of the job, with the result fields once it finished"""
+        info = dict(job=self.id, status=self.status)
+        if self.result is not None:
+            info.update(self.result)
+            info["timings"] = self.timings()
+        return info
+
+
+class JobQueue(object):
+    """
+    Bounded pool of threads running jobs with timeouts.
+
+    `submit` raises `QueueFull` if `max_pending` jobs are queued or running.
+    A job still running after `timeout` seconds is reported as timed out
+    and its result discarded; the LLM call itself can't be interrupted and
+    keeps its thread until it returns.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = MAX_WORKERS,
+        max_pending: int = MAX_PENDING,
+        timeout: float = JOB_TIMEOUT,
+        ttl: float = JOB_TTL,
+        clock=time.monotonic,
+    ):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.ttl = ttl
+        self.clock = clock
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # notified whenever a job streams a chunk or finishes
+        self._changed = threading.Condition(self._lock)
+        self._executor = None
+
+    def _expire(self):
+        now = self.clock()
+        for job in list(self._jobs.values()):
+            if job.pending and now - job.created >= self.timeout:
+                job.status = TIMEOUT
+                job.result = dict(
+                    error="Timeout",
+                    message=f"The AI model did not answer within {self.timeout:.0f}s",
+                )
+                job.finished = now
+                self._changed.notify_all()
+            elif not job.pending and now - job.finished >= self.ttl:
+                del self._jobs[job.id]
+
+    def submit(self, func, owner, stream: bool = False) -> Job:
+        """
+        Runs `func` in the background.
+
+        Args:
+            func: Callable returning the result dict of the job
+            owner: Id of the user allowed to read the job
+            stream: Call `func` with an `on_chunk` callable collecting the
+                    streamed response text for `events`
+
+        Returns:
+            The queued `Job`
+
+        Raises:
+            QueueFull: If too many jobs are pending
+        """
+        with self._lock:
+            self._expire()
+            if sum(job.pending for job in self._jobs.values()) >= self.max_pending:
+                raise QueueFull("Too many AI requests, please try again later")
+            job = Job(owner, self.clock())
+            self._jobs[job.id] = job
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="zopyx.surveyjs-ai"
+                )
+            if stream:
+                func = partial(func, on_chunk=partial(self._append, job))
+            self._executor.submit(self._run, job, func)
+        return job
+
+    def _append(self, job, chunk):
+        """Collects a chunk of streamed text, None discards the text so far"""
+        with self._lock:
+            if job.status != RUNNING:
+                return
+            if chunk is None:
+                job.chunks = []
+                job.resets += 1
+            else:
+                if job.first_chunk is None:
+                    job.first_chunk = self.clock()
+                job.chunks.append(chunk)
+            self._changed.notify_all()
+
+    def _run(self, job, func):
+        with self._lock:
+            if job.status != QUEUED:
+                return
+            job.status = RUNNING
+            job.started = self.clock()
+        try:
+            result, status = func(), DONE
+        except Exception as e:
+            LOG.exception("AI job %s failed", job.id)
+            result, status = dict(error="Generation failed", message=str(e)), FAILED
+        if "error" in result:
+            status = FAILED
+        timings = None
+        with self._lock:
+            # a timed out job keeps its timeout
+            if job.status == RUNNING:
+                job.status = status
+                job.result = result
+                job.finished = self.clock()
+                self._changed.notify_all()
+                timings = job.timings()
+        if timings is not None and status == DONE:
+            LOG.info(
+                "AI job %s done: queued %ss, first chunk after %ss, total %ss",
+                job.id,
+                timings["queued"],
+                timings["ttfb"],
+                timings["total"],
+            )
+
+    def get(self, job_id, owner):
+        """The `info` of a job of `owner` or None"""
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            if job is None or job.owner != owner:
+                return None
+            return job.info()
+
+    def events(self, job_id, owner, last_id: str = ""):
+        """
+        The progress of a job of `owner` after the event `last_id`.
+
+        Returns the id of the last event and a list of `(event, data)`
+        pairs, None for unknown jobs. `("reset", {})` tells that the text
+        so far was discarded, `("chunk", {"text": ...})` carries the
+        response text streamed since `last_id` and the final event is named
+        after the status of the finished job, with its `info` (result and
+        timings) as data. Without progress `("ping", {})` is returned.
+        Never waits for the job.
+        """
+        resets, offset = parse_event_id(last_id)
+        events = []
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            if job is None or job.owner != owner:
+                return None
+            if resets != job.resets or offset > len(job.chunks):
+                events.append(("reset", {}))
+                offset = 0
+            text = "".join(job.chunks[offset:])
+            event_id = f"{job.resets}-{len(job.chunks)}"
+            info = None if job.pending else job.info()
+        if text:
+            events.append(("chunk", dict(text=text)))
+        if info is not None:
+            events.append((info["status"], info))
+        if not events:
+            events.append(("ping", {}))
+        return event_id, events
+
+    def stats(self) -> dict:
+        """Number of known jobs by status"""
+        with self._lock:
+            self._expire()
+            counts = dict.fromkeys((QUEUED, RUNNING, DONE, FAILED, TIMEOUT), 0)
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def parse_event_id(event_id: str):
+    """The `(resets, offset)` of a job event id, `(0, 0)` if it is invalid"""
+    try:
+        resets, offset = (int(part) for part in event_id.split("-"))
+    except (AttributeError, ValueError):
+        return 0, 0
+    if resets < 0 or offset < 0:
+        return 0, 0
+    return resets, offset
+
+
+def format_event(event: str, data, event_id: str = None) -> bytes:
+    """A Server-Sent Event named `event` with `data` as JSON"""
+    lines = b"event: %s\ndata: %s\n" % (event.encode("ascii"), orjson.dumps(data))
+    if event_id is not None:
+        lines += b"id: %s\n" % event_id.encode("ascii")
+    return lines + b"\n"
+
+
+def format_events(events, event_id: str, retry: int = EVENTS_RETRY) -> bytes:
+    """
+    The body of an events response, the browser reconnects after `retry`
+    milliseconds sending `event_id` (the id of the last event) as
+    `Last-Event-ID`
+    """
+    body = [b"retry: %d\n" % retry]
+    for index, (event, data) in enumerate(events, 1):
+        last = index == len(events)
+        body.append(format_event(event, data, event_id if last else None))
+    return b"".join(body)
+
+
+_queue = None
+_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """The AI job queue of this process"""
+    global _queue
+    with _lock:
+        if _queue is None:
+            _queue = JobQueue()
+    return _queue
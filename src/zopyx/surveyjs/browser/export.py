@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""Streaming export helpers for the download views."""
+
+from ..forms import choice_value
+from ..forms import form_elements
+from ..forms import walk_elements
+from itertools import islice
+from ZPublisher.Iterators import filestream_iterator
+
+import codecs
+import csv
+import gzip
+import orjson
+import os
+import tempfile
+
+
+# Number of records serialized per write
+BATCH_SIZE = 500
+
+# Spreadsheet applications evaluate cells starting with these as formulas
+FORMULA_PREFIXES = ("=", "+", "-", "@")
+
+
+def iter_batches(iterable, batch_size=BATCH_SIZE):
+    """Split an iterable into lists of at most `batch_size` items"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def json_chunks(records, batch_size=BATCH_SIZE, on_batch=None):
+    """Serialize records as a JSON array, one chunk per batch"""
+    yield b"[\n"
+    first = True
+    for batch in iter_batches(records, batch_size):
+        chunk = b",\n".join(
+            orjson.dumps(record, option=orjson.OPT_INDENT_2) for record in batch
+        )
+        yield chunk if first else b",\n" + chunk
+        first = False
+        if on_batch is not None:
+            on_batch()
+    yield b"\n]\n"
+
+
+def ndjson_chunks(records, batch_size=BATCH_SIZE, on_batch=None):
+    """Serialize records as newline delimited JSON, one chunk per batch"""
+    for batch in iter_batches(records, batch_size):
+        yield b"".join(orjson.dumps(record) + b"\n" for record in batch)
+        if on_batch is not None:
+            on_batch()
+
+
+def spool_file(fill):
+    """Let `fill(fp)` write an export into an anonymous temporary file.
+
+    Returns a `filestream_iterator` over the file and its size. The
+    publisher streams the file to the client, so the export never has to
+    be held in memory as a whole.
+    """
+    fd, filename = tempfile.mkstemp(prefix="zopyx.surveyjs-", suffix=".export")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fill(fp)
+        size = os.path.getsize(filename)
+        iterator = filestream_iterator(filename, "rb")
+    finally:
+        # the open iterator keeps the data readable
+        os.unlink(filename)
+    return iterator, size
+
+
+def spool(chunks, compress=False):
+    """Write chunks to a temporary file, see `spool_file`"""
+
+    def fill(fp):
+        if compress:
+            fp = gzip.GzipFile(fileobj=fp, mode="wb")
+        for chunk in chunks:
+            fp.write(chunk)
+        if compress:
+            fp.close()
+
+    return spool_file(fill)
+
+
+def _get(*path):
+    def getter(result):
+        for key in path:
+            if not isinstance(result, dict):
+                return None
+            result = result.get(key)
+        return result
+
+    return getter
+
+
+def _has_choice(name, value):
+    def getter(result):
+        answer = result.get(name)
+        return 1 if isinstance(answer, list) and value in answer else None
+
+    return getter
+
+
+def _element_columns(element, prefix=""):
+    name = element["name"]
+    header = prefix + name
+    element_type = element.get("type")
+
+    if element_type in ("checkbox", "tagbox") and element.get("choices"):
+        for choice in element["choices"]:
+            value = choice_value(choice)
+            yield f"{header}.{value}", _has_choice(name, value)
+    elif element_type == "matrix" and element.get("rows"):
+        for row in element["rows"]:
+            row = choice_value(row)
+            yield f"{header}.{row}", _get(name, row)
+    elif element_type == "matrixdropdown" and element.get("rows"):
+        for row in element["rows"]:
+            row = choice_value(row)
+            for column in element.get("columns") or ():
+                yield f"{header}.{row}.{column['name']}", _get(name, row, column["name"])
+    elif element_type == "multipletext" and element.get("items"):
+        for item in element["items"]:
+            yield f"{header}.{item['name']}", _get(name, item["name"])
+    else:
+        yield header, _get(name)
+
+    if element.get("hasOther") or element.get("showOtherItem"):
+        yield f"{header}-Comment", _get(f"{name}-Comment")
+
+
+def form_columns(form_json):
+    """Derive the export columns of a form definition.
+
+    Returns `(columns, dynamic)`. `columns` is a list of `(header, getter)`
+    pairs with one cell per submission; checkbox choices, matrix rows and
+    multiple text items get a column each. `dynamic` is a list of
+    `(header, name, getter)` for the columns of dynamic matrices and
+    dynamic panels. Their getters apply to a single row of the question
+    `name` and every row becomes a child row of the submission.
+    """
+    columns = []
+    dynamic = []
+    for element in form_elements(form_json):
+        name = element["name"]
+        if element.get("type") == "matrixdynamic":
+            for column in element.get("columns") or ():
+                dynamic.append((f"{name}.{column['name']}", name, _get(column["name"])))
+        elif element.get("type") == "paneldynamic":
+            for child in walk_elements(element.get("templateElements")):
+                for header, getter in _element_columns(child, prefix=name + "."):
+                    dynamic.append((header, name, getter))
+        else:
+            columns.extend(_element_columns(element))
+    return columns, dynamic
+
+
+def cell_value(value):
+    """Convert an answer into a flat cell value.
+
+    Text that a spreadsheet would take for a formula is prefixed with `'`.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, list):
+        value = "; ".join(
+            str(v.get("name", "")) if isinstance(v, dict) else str(v) for v in value
+        )
+    elif not isinstance(value, str):
+        value = orjson.dumps(value).decode("utf-8")
+    if value.startswith(FORMULA_PREFIXES):
+        value = "'" + value
+    return value
+
+
+def table_rows(records, columns, dynamic):
+    """Flatten result records into table rows.
+
+    The first row is the header. Every record yields one row; dynamic
+    matrices and panels with more than one row add child rows that only
+    repeat the `poll_id`.
+    """
+    yield (
+        ["poll_id", "created", "user"]
+        + [header for header, _ in columns]
+        + [header for header, _, _ in dynamic]
+    )
+    dynamic_names = {name for _, name, _ in dynamic}
+    blank = [""] * (2 + len(columns))
+    for record in records:
+        result = record.get("result") or {}
+        rows = {}
+        for name in dynamic_names:
+            value = result.get(name)
+            rows[name] = value if isinstance(value, list) else []
+        count = max([len(v) for v in rows.values()] or [0])
+
+        for index in range(max(count, 1)):
+            if index == 0:
+                row = [
+                    record["poll_id"],
+                    record["created"].isoformat(),
+                    cell_value(record.get("user")),
+                ] + [cell_value(getter(result)) for _, getter in columns]
+            else:
+                row = [record["poll_id"]] + blank
+            for _, name, getter in dynamic:
+                items = rows[name]
+                item = items[index] if index < len(items) else None
+                row.append(cell_value(getter(item) if isinstance(item, dict) else None))
+            yield row
+
+
+class _Echo:
+    """File-like object returning what is written to it"""
+
+    def write(self, value):
+        return value
+
+
+def csv_chunks(rows, batch_size=BATCH_SIZE, on_batch=None):
+    """Serialize table rows as UTF-8 CSV, one chunk per batch"""
+    writer = csv.writer(_Echo())
+    # BOM for spreadsheet applications
+    yield codecs.BOM_UTF8
+    for batch in iter_batches(rows, batch_size):
+        yield "".join(writer.writerow(row) for row in batch).encode("utf-8")
+        if on_batch is not None:
+            on_batch()
+
+
+def write_xlsx(rows, fp, on_batch=None, batch_size=BATCH_SIZE):
+    """Write table rows into an XLSX workbook.
+
+    Uses the write-only mode of `openpyxl`, which streams rows to disk.
+    Control characters XLSX can't store are dropped.
+    """
+    try:
+        from openpyxl import Workbook
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    except ImportError:
+        raise ImportError(
+            "The 'openpyxl' module is not installed. Please install it using 'pip install openpyxl'"
+        )
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Results")
+    for batch in iter_batches(rows, batch_size):
+        for row in batch:
+            sheet.append(
+                [
+                    ILLEGAL_CHARACTERS_RE.sub("", v) if isinstance(v, str) else v
+                    for v in row
+                ]
+            )
+        if on_batch is not None:
+            on_batch()
+    workbook.save(fp)
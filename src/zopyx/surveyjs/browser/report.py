@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Portal-wide report of the submissions of all surveys."""
+
+from ..reports import surveys_report
+from ..reports import TOP_SURVEYS
+from ..reports import WINDOWS
+from Products.Five import BrowserView
+from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
+
+import orjson
+import plone.api
+
+
+# Upper bound of the `top` request parameter
+MAX_TOP = 100
+
+
+class SurveysReport(BrowserView):
+    """`@@surveys-report` (HTML) and `@@surveys-report-json` of a site.
+
+    The report is computed from catalog metadata, see `reports`.
+    """
+
+    template = ViewPageTemplateFile("surveys_report.pt")
+    windows = [name for name, _ in WINDOWS]
+
+    def report(self):
+        try:
+            top = int(self.request.form.get("top", TOP_SURVEYS))
+        except ValueError:
+            top = TOP_SURVEYS
+        top = max(1, min(top, MAX_TOP))
+        catalog = plone.api.portal.get_tool("portal_catalog")
+        return surveys_report(catalog(portal_type="Survey"), top=top)
+
+    def __call__(self):
+        self.data = self.report()
+        return self.template()
+
+    def json(self):
+        self.request.response.setHeader("content-type", "application/json")
+        self.request.response.setHeader("cache-control", "no-store")
+        return orjson.dumps(self.report())
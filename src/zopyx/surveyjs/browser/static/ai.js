@@ -7,6 +7,8 @@ document.addEventListener("DOMContentLoaded", function() {
   const refineBtnText = document.getElementById("refineBtnText");
   const refineBtnSpinnerText = document.getElementById("refineBtnSpinnerText");
   const startOverBtn = document.getElementById("startOverBtn");
+  const regenerateOption = document.getElementById("regenerateOption");
+  const regenerateCheckbox = document.getElementById("regenerateCheckbox");
 
   const formPanelTitle = document.getElementById("formPanelTitle");
   const formInputLabel = document.getElementById("formInputLabel");
@@ -15,6 +17,10 @@ document.addEventListener("DOMContentLoaded", function() {
   const currentVersionInfo = document.getElementById("currentVersionInfo");
   const formActionButtons = document.getElementById("formActionButtons");
 
+  const streamContainer = document.getElementById("streamContainer");
+  const streamStatus = document.getElementById("streamStatus");
+  const streamOutput = document.getElementById("streamOutput");
+
   const errorContainer = document.getElementById("errorContainer");
   const errorMessage = document.getElementById("errorMessage");
 
@@ -95,6 +101,180 @@ document.addEventListener("DOMContentLoaded", function() {
     return str.substring(0, maxLength) + '...';
   }
 
+  // Poll interval and limit for background AI jobs (ms)
+  const POLL_INTERVAL = 1500;
+  const POLL_TIMEOUT = 300000;
+
+  // Resolve with the result of a background AI job. The response text is
+  // shown as it streams in where the browser supports Server-Sent Events,
+  // otherwise the job status is polled. Both answer right away, no request
+  // waits for the model. Cached generations are returned right away
+  // without a job.
+  function waitForJob(data) {
+    if (!data.job) {
+      return Promise.resolve(data);
+    }
+    if (data.events_url && window.EventSource) {
+      return streamJob(data);
+    }
+    return pollJob(data);
+  }
+
+  // Resolve with the result of a background AI job, polling its status
+  function pollJob(data) {
+    const started = Date.now();
+    return new Promise((resolve, reject) => {
+      function poll() {
+        fetch(data.status_url, { credentials: 'same-origin', cache: 'no-store' })
+          .then(response => response.json().then(job => ({ ok: response.ok, job })))
+          .then(({ ok, job }) => {
+            if (!ok || job.status === "failed" || job.status === "timeout") {
+              reject(new Error(job.message || "AI request failed"));
+            } else if (job.status === "done") {
+              resolve(job);
+            } else if (Date.now() - started > POLL_TIMEOUT) {
+              reject(new Error("The AI request took too long. Please try again."));
+            } else {
+              setTimeout(poll, POLL_INTERVAL);
+            }
+          })
+          .catch(reject);
+      }
+      setTimeout(poll, POLL_INTERVAL);
+    });
+  }
+
+  // Resolve with the result of a background AI job, rendering its response
+  // text from the event stream. The server ends every events response and
+  // the browser reconnects with the id of the last event (Last-Event-ID).
+  // Falls back to polling if the stream breaks.
+  function streamJob(data) {
+    return new Promise((resolve, reject) => {
+      const source = new EventSource(data.events_url, { withCredentials: true });
+      let text = "";
+      showStream(text);
+
+      // the server discarded the text so far, e.g. to refine the full form
+      source.addEventListener("reset", () => {
+        text = "";
+        showStream(text);
+      });
+      source.addEventListener("chunk", event => {
+        text += JSON.parse(event.data).text;
+        showStream(text);
+      });
+      source.addEventListener("done", event => {
+        source.close();
+        const job = JSON.parse(event.data);
+        hideStream();
+        if (job.timings) {
+          console.log(
+            "AI job " + job.job + ": first chunk after " + job.timings.ttfb +
+            "s, total " + job.timings.total + "s"
+          );
+        }
+        resolve(job);
+      });
+      ["failed", "timeout"].forEach(name => {
+        source.addEventListener(name, event => {
+          source.close();
+          hideStream();
+          reject(new Error(JSON.parse(event.data).message || "AI request failed"));
+        });
+      });
+      source.onerror = () => {
+        if (source.readyState === EventSource.CONNECTING) {
+          // reconnecting for the next events
+          return;
+        }
+        source.close();
+        hideStream();
+        pollJob(data).then(resolve, reject);
+      };
+    });
+  }
+
+  // Best-effort parse of incomplete JSON: cut it behind the last complete
+  // value and close the brackets still open there. Returns null if that
+  // does not parse.
+  function parsePartialJson(text) {
+    text = text.replace(/^\s*```(json)?/, "");
+    const stack = [];
+    let inString = false;
+    let escaped = false;
+    let cut = 0;
+    let closers = "";
+    for (let i = 0; i < text.length; i++) {
+      const c = text[i];
+      if (inString) {
+        if (escaped) {
+          escaped = false;
+        } else if (c === "\\") {
+          escaped = true;
+        } else if (c === '"') {
+          inString = false;
+        }
+        continue;
+      }
+      if (c === '"') {
+        inString = true;
+      } else if (c === "{" || c === "[") {
+        stack.push(c === "{" ? "}" : "]");
+      } else if (c === "}" || c === "]") {
+        stack.pop();
+        cut = i + 1;
+        closers = stack.slice().reverse().join("");
+      } else if (c === ",") {
+        cut = i;
+        closers = stack.slice().reverse().join("");
+      }
+    }
+    if (!cut) {
+      return null;
+    }
+    try {
+      return JSON.parse(text.slice(0, cut) + closers);
+    } catch (e) {
+      return null;
+    }
+  }
+
+  // Names of the questions of a (partial) SurveyJS form
+  function questionNames(form) {
+    const names = [];
+    function collect(elements) {
+      (elements || []).forEach(element => {
+        if (element && typeof element === "object") {
+          if (element.name) {
+            names.push(element.title || element.name);
+          }
+          collect(element.elements);
+        }
+      });
+    }
+    ((form && form.pages) || []).forEach(page => collect(page && page.elements));
+    return names;
+  }
+
+  function showStream(text) {
+    if (!streamContainer) {
+      return;
+    }
+    streamContainer.style.display = "block";
+    streamOutput.textContent = text;
+    streamOutput.scrollTop = streamOutput.scrollHeight;
+    const names = questionNames(parsePartialJson(text));
+    streamStatus.textContent = text
+      ? "Writing form... " + (names.length ? names.length + " questions so far: " + names.join(", ") : "")
+      : "Waiting for the AI model...";
+  }
+
+  function hideStream() {
+    if (streamContainer) {
+      streamContainer.style.display = "none";
+    }
+  }
+
   // Refinement form submission handler
   refinementForm.addEventListener("submit", function(e) {
     e.preventDefault();
@@ -117,6 +297,10 @@ document.addEventListener("DOMContentLoaded", function() {
       const formData = new FormData();
       formData.append("prompt", prompt);
       formData.append("_authenticator", CSRF_TOKEN);
+      // Bypass the server-side generation cache
+      if (regenerateCheckbox && regenerateCheckbox.checked) {
+        formData.append("regenerate", "1");
+      }
 
       fetch(ACTUAL_URL + "/@@generate-ai-form", {
         method: "POST",
@@ -131,6 +315,7 @@ document.addEventListener("DOMContentLoaded", function() {
         }
         return response.json();
       })
+      .then(waitForJob)
       .then(data => {
         if (data.success) {
           // Add to history
@@ -174,6 +359,7 @@ document.addEventListener("DOMContentLoaded", function() {
         }
         return response.json();
       })
+      .then(waitForJob)
       .then(data => {
         if (data.success) {
           // Add to history
@@ -427,6 +613,11 @@ document.addEventListener("DOMContentLoaded", function() {
     if (startOverBtn) {
       startOverBtn.style.display = "inline-block";
     }
+
+    // The generation cache only applies to initial generations
+    if (regenerateOption) {
+      regenerateOption.style.display = "none";
+    }
   }
 
   function resetUIToInitial() {
@@ -472,6 +663,10 @@ document.addEventListener("DOMContentLoaded", function() {
     if (startOverBtn) {
       startOverBtn.style.display = "none";
     }
+
+    if (regenerateOption) {
+      regenerateOption.style.display = "";
+    }
   }
 
   function updateVersionIndicator() {
@@ -79,7 +79,16 @@ document.addEventListener("DOMContentLoaded", function () {
             if (Array.isArray(value) && value.length > 0) {
                 // Check if it's a file upload result
                 const item = value[0];
-                if (typeof item === 'object' && item !== null && 'name' in item && 'content' in item) {
+                if (typeof item === 'object' && item !== null && 'name' in item && 'attachment' in item) {
+                    // Uploaded files stored as attachments
+                    html += value.map(file => {
+                        const url = `download-attachment?id=${encodeURIComponent(file.attachment)}`;
+                        if (file.type && file.type.includes('image')) {
+                            return `<div class="image-preview"><a href="${url}"><img src="${url}" alt="${escapeHtml(file.name)}" loading="lazy" /></a></div>`;
+                        }
+                        return `Attached file: <a href="${url}">${escapeHtml(file.name)}</a>`;
+                    }).join('<br>');
+                } else if (typeof item === 'object' && item !== null && 'name' in item && 'content' in item) {
                     if (item.type && item.type.includes('image')) {
                         // Display image preview
                         html += `<div class="image-preview"><img src="${item.content}" alt="${escapeHtml(item.name)}" /></div>`;
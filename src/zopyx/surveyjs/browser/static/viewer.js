@@ -1,5 +1,6 @@
 document.addEventListener("DOMContentLoaded", function () {
-  const url = ACTUAL_URL + "/get-form-json";
+  // Versioned URL of the current form, cacheable by browsers and proxies
+  const url = typeof FORM_JSON_URL !== "undefined" ? FORM_JSON_URL : ACTUAL_URL + "/get-form-json";
 
   // Load the survey JSON configuration
   fetch(url, {
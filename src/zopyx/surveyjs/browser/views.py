@@ -1,53 +1,134 @@
-from BTrees.OOBTree import OOBTree
 from datetime import datetime, timezone
+from functools import partial
+from itertools import islice
+from plone.protect import CheckAuthenticator
 from Products.Five import BrowserView
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
-from zope.annotation.interfaces import IAnnotations
+from zExceptions import MethodNotAllowed
+from zope.component import queryAdapter
+from ZPublisher.Iterators import filestream_iterator
 import plone.api
 
 from .. import _
+from ..archives import seal_results
+from ..attachments import clear_attachments
+from ..attachments import content_disposition
+from ..attachments import get_attachments
+from ..attachments import media_type
+from ..attachments import parse_range
+from ..attachments import range_iterator
+from ..caching import FORM_CACHE_CONTROL
+from ..caching import http_date
+from ..caching import is_not_modified
+from ..caching import purge
+from ..caching import VERSIONED_FORM_CACHE_CONTROL
+from ..catalog import SUBMISSION_INDEXES
+from .export import csv_chunks
+from .export import form_columns
+from .export import json_chunks
+from .export import ndjson_chunks
+from .export import spool
+from .export import spool_file
+from .export import table_rows
+from .export import write_xlsx
+from ..interfaces import IFormsSettings
+from ..interfaces import IResultStorage
+from ..stats import clear_stats
+from ..stats import get_stats
+from ..storage import clear_results
+from ..storage import decode_cursor
+from ..storage import DEFAULT_RESULT_STORAGE
+from ..storage import encode_cursor
+from ..storage import FORM_VERSIONS_KEY  # noqa: F401
+from ..storage import get_current_form_json
+from ..storage import get_form_store
+from ..storage import get_form_versions
+from ..storage import get_results
+from ..storage import move_results
+from ..storage import normalize_user
+from ..storage import position
+from ..storage import RESULTS_KEY  # noqa: F401
+from ..submissions import add_submission
+from ..submissions import get_spool
 
 import orjson
+import transaction
 import uuid
 
 
-RESULTS_KEY = "zopyx.surveyjs.results"
-FORM_VERSIONS_KEY = "zopyx.surveyjs.form_versions"
+# Page sizes of the results listings
+DEFAULT_PAGESIZE = 10
+MAX_PAGESIZE = 100
 
-
-def ensure_timezone_aware(dt):
-    """Convert naive datetime to UTC-aware datetime"""
-    if dt.tzinfo is None or dt.tzinfo.utcoffset(dt) is None:
-        # Naive datetime - assume it's UTC
-        return dt.replace(tzinfo=timezone.utc)
-    return dt
+# Number of page links shown around the current page
+WINDOW = 2
 
 
 class Views(BrowserView):
+    def _add_version(self, data):
+        """Store a new form version and purge cached copies of the form.
+
+        Saving the current form again is a no-op returning the current
+        version.
+        """
+        versions = get_form_versions(self.context)
+        current_id = versions.current_id
+        version = versions.add(data, get_form_store())
+        if version["id"] != current_id:
+            purge(self.context)
+            self.context.reindexObject(idxs=["survey_form_version"])
+        return version
+
+    @property
+    def form_json_url(self):
+        """URL of the current form JSON, unique for every version"""
+        url = self.context.absolute_url() + "/@@get-form-json"
+        current_id = get_form_versions(self.context).current_id
+        return f"{url}?v={current_id}" if current_id else url
+
     def get_form_json(self):
-        """JSON for SurveyJS renderer"""
+        """JSON for SurveyJS renderer.
+
+        Responses carry the current version id as strong ETag and its date
+        as Last-Modified, conditional requests are answered with 304.
+        Requests for a version URL (see `form_json_url`) are cacheable
+        for good.
+        """
+        response = self.request.response
+        current = get_form_versions(self.context).current
+        etag = f'"{current["id"]}"' if current is not None else '"empty"'
+        last_modified = current["created"] if current is not None else None
+
+        if current is not None and self.request.form.get("v") == current["id"]:
+            cache_control = plone.api.portal.get_registry_record(
+                "form_versioned_cache_control",
+                interface=IFormsSettings,
+                default=None,
+            )
+            cache_control = cache_control or VERSIONED_FORM_CACHE_CONTROL
+        else:
+            cache_control = plone.api.portal.get_registry_record(
+                "form_cache_control", interface=IFormsSettings, default=None
+            )
+            cache_control = cache_control or FORM_CACHE_CONTROL
 
-        annos = IAnnotations(self.context)
-        if FORM_VERSIONS_KEY not in annos:
-            return {}
+        response.setHeader("ETag", etag)
+        response.setHeader("Cache-Control", cache_control)
+        if last_modified is not None:
+            response.setHeader("Last-Modified", http_date(last_modified))
 
-        form_versions = [d for d in annos[FORM_VERSIONS_KEY].values()]
-        form_versions = sorted(
-            form_versions, key=lambda x: ensure_timezone_aware(x["created"])
-        )
+        if is_not_modified(self.request, etag, last_modified):
+            response.setStatus(304)
+            return ""
 
-        form_data = {}
-        if form_versions:
-            form_data = form_versions[-1]["form_json"]
+        form_data = current["form_json"] if current is not None else {}
 
-        self.request.response.setHeader("content-type", "application/json")
-        self.request.response.write(orjson.dumps(form_data))
+        response.setHeader("content-type", "application/json")
+        response.write(orjson.dumps(form_data))
 
     def save_form_json(self):
         json_form = orjson.loads(self.request.form["surveyText"])
 
-        annos = IAnnotations(self.context)
-
         data = dict(
             id=str(uuid.uuid4()),
             created=datetime.now(timezone.utc),
@@ -55,7 +136,7 @@ class Views(BrowserView):
             form_json=json_form,
         )
 
-        annos[FORM_VERSIONS_KEY][data["id"]] = data
+        self._add_version(data)
 
         result = dict(isSuccess=True)
         self.request.response.setStatus(200)
@@ -65,8 +146,6 @@ class Views(BrowserView):
     def save_poll(self):
         poll_result = orjson.loads(self.request.form["pollResult"])
 
-        annos = IAnnotations(self.context)
-
         data = dict(
             poll_id=str(uuid.uuid1()),
             created=datetime.now(timezone.utc),
@@ -74,7 +153,14 @@ class Views(BrowserView):
             result=poll_result,
         )
 
-        annos[RESULTS_KEY][data["poll_id"]] = data
+        spool_submissions = plone.api.portal.get_registry_record(
+            "spool_submissions", interface=IFormsSettings, default=False
+        )
+        if spool_submissions:
+            path = "/".join(self.context.getPhysicalPath())
+            get_spool().append(path, data)
+        else:
+            add_submission(self.context, data)
 
         result = dict(isSuccess=True)
         self.request.response.setStatus(200)
@@ -82,21 +168,59 @@ class Views(BrowserView):
         self.request.response.write(orjson.dumps(result))
 
     def clear_results(self):
-        annos = IAnnotations(self.context)
-        annos[RESULTS_KEY] = OOBTree()
+        clear_results(self.context)
+        clear_stats(self.context)
+        clear_attachments(self.context)
+        self.context.reindexObject(idxs=list(SUBMISSION_INDEXES))
 
         plone.api.portal.show_message(_("Results cleared"))
         self.request.response.redirect(self.context.absolute_url() + "/view")
 
-    def get_polls_json(self):
-        """get polls"""
+    def _check_post(self):
+        """Views committing in between batches run before plone.protect's
+        automatic CSRF check, they need a POST with a valid authenticator"""
+        if self.request.get("REQUEST_METHOD", "GET").upper() != "POST":
+            raise MethodNotAllowed("POST required")
+        CheckAuthenticator(self.request)
+
+    def move_results(self):
+        """Move the results into another storage backend (`storage` parameter),
+        committing every batch"""
+        self._check_post()
+        name = self.request.form.get("storage", DEFAULT_RESULT_STORAGE)
+        if queryAdapter(self.context, IResultStorage, name=name) is None:
+            plone.api.portal.show_message(
+                _("Unknown result storage ${name}", mapping={"name": name}),
+                type="error",
+            )
+            return self.request.response.redirect(
+                self.context.absolute_url() + "/results"
+            )
 
-        annos = IAnnotations(self.context)
+        try:
+            moved = move_results(self.context, name, on_batch=self._commit)
+        except ValueError as e:
+            plone.api.portal.show_message(str(e), type="error")
+        else:
+            plone.api.portal.show_message(
+                _("${count} results moved", mapping={"count": moved})
+            )
+        self.request.response.redirect(self.context.absolute_url() + "/results")
 
-        results = list(annos[RESULTS_KEY].values())
-        results = sorted(
-            results, key=lambda x: ensure_timezone_aware(x["created"]), reverse=True
+    def seal_results(self):
+        """Move the results of all closed months into archives, committing
+        every month"""
+        self._check_post()
+        sealed = seal_results(self.context, on_batch=self._commit)
+        plone.api.portal.show_message(
+            _("${count} results archived", mapping={"count": sealed})
         )
+        self.request.response.redirect(self.context.absolute_url() + "/results")
+
+    def get_polls_json(self):
+        """get polls"""
+
+        results = list(get_results(self.context).values())
 
         self.request.response.setHeader("content-type", "application/json")
         self.request.response.write(orjson.dumps(results))
@@ -104,34 +228,22 @@ class Views(BrowserView):
     def get_polls_json2(self):
         """get polls"""
 
-        annos = IAnnotations(self.context)
+        results = [d["result"] for d in get_results(self.context).values()]
 
-        # Initialize if doesn't exist
-        if RESULTS_KEY not in annos:
-            annos[RESULTS_KEY] = OOBTree()
+        self.request.response.setHeader("content-type", "application/json")
+        self.request.response.write(orjson.dumps(results))
 
-        results = list(annos[RESULTS_KEY].values())
-        results = [d["result"] for d in results]
+    def survey_stats(self):
+        """Per-question aggregates of all results for dashboards"""
+        form_json = get_current_form_json(self.context)
+        stats = get_stats(self.context).summary(form_json)
 
         self.request.response.setHeader("content-type", "application/json")
-        self.request.response.write(orjson.dumps(results))
+        self.request.response.write(orjson.dumps(stats))
 
     def download_form_json(self):
         """Download current form JSON as attachment"""
-        annos = IAnnotations(self.context)
-
-        # Initialize if doesn't exist
-        if FORM_VERSIONS_KEY not in annos:
-            annos[FORM_VERSIONS_KEY] = OOBTree()
-
-        form_versions = [d for d in annos[FORM_VERSIONS_KEY].values()]
-        form_versions = sorted(
-            form_versions, key=lambda x: ensure_timezone_aware(x["created"])
-        )
-
-        form_data = {}
-        if form_versions:
-            form_data = form_versions[-1]["form_json"]
+        form_data = get_current_form_json(self.context)
 
         # Prepare download with attachment header
         filename = f"survey-form-{self.context.getId()}.json"
@@ -144,51 +256,99 @@ class Views(BrowserView):
         self.request.response.write(json_content)
 
     def download_polls_json(self):
-        """Download poll results JSON as attachment"""
-        annos = IAnnotations(self.context)
+        """Download poll results as attachment.
 
-        # Initialize if doesn't exist
-        if RESULTS_KEY not in annos:
-            annos[RESULTS_KEY] = OOBTree()
+        The results are streamed in batches as a JSON array (default) or as
+        NDJSON (`format=ndjson`), optionally gzip compressed (`gzip=1`).
+        """
+        export_format = self.request.form.get("format", "json")
+        compress = self.request.form.get("gzip") in ("1", "true", "on")
 
-        results = list(annos[RESULTS_KEY].values())
-        results = sorted(
-            results, key=lambda x: ensure_timezone_aware(x["created"]), reverse=True
-        )
+        if export_format == "ndjson":
+            chunks = ndjson_chunks
+            content_type = "application/x-ndjson"
+        else:
+            export_format = "json"
+            chunks = json_chunks
+            content_type = "application/json"
 
-        # Prepare download with attachment header
-        filename = f"survey-data-{self.context.getId()}.json"
-        json_content = orjson.dumps(results, option=orjson.OPT_INDENT_2)
+        records = get_results(self.context).values()
+        iterator, size = spool(
+            chunks(records, on_batch=self._cache_gc), compress=compress
+        )
 
-        self.request.response.setHeader("Content-Type", "application/json")
+        filename = f"survey-data-{self.context.getId()}.{export_format}"
+        if compress:
+            filename += ".gz"
+            content_type = "application/gzip"
+
+        return self._download(iterator, size, content_type, filename)
+
+    def _cache_gc(self):
+        """Keep the ZODB cache bounded while exports walk all records"""
+        jar = getattr(self.context, "_p_jar", None)
+        if jar is not None:
+            jar.cacheGC()
+
+    def _commit(self):
+        """Commit a batch of a long running change, see `_cache_gc`"""
+        transaction.commit()
+        self._cache_gc()
+
+    def _result_table(self):
+        """Result rows flattened by the columns of the current form"""
+        columns, dynamic = form_columns(get_current_form_json(self.context))
+        records = get_results(self.context).values(reverse=False)
+        return table_rows(records, columns, dynamic)
+
+    def _download(self, iterator, size, content_type, filename):
+        self.request.response.setHeader("Content-Type", content_type)
+        self.request.response.setHeader("Content-Length", str(size))
         self.request.response.setHeader(
             "Content-Disposition", f'attachment; filename="{filename}"'
         )
-        self.request.response.write(json_content)
+        return iterator
+
+    def download_polls_csv(self):
+        """Download poll results as CSV with one column per answer"""
+        rows = self._result_table()
+        iterator, size = spool(csv_chunks(rows, on_batch=self._cache_gc))
+        return self._download(
+            iterator,
+            size,
+            "text/csv; charset=utf-8",
+            f"survey-data-{self.context.getId()}.csv",
+        )
+
+    def download_polls_xlsx(self):
+        """Download poll results as XLSX with one column per answer"""
+        try:
+            rows = self._result_table()
+            iterator, size = spool_file(
+                lambda fp: write_xlsx(rows, fp, on_batch=self._cache_gc)
+            )
+        except ImportError as e:
+            plone.api.portal.show_message(str(e), type="error")
+            return self.request.response.redirect(
+                self.context.absolute_url() + "/@@results"
+            )
+
+        return self._download(
+            iterator,
+            size,
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            f"survey-data-{self.context.getId()}.xlsx",
+        )
 
     @property
     def versions(self):
         """Get all form versions sorted by date (newest first)"""
-        annos = IAnnotations(self.context)
-
-        # Initialize if doesn't exist
-        if FORM_VERSIONS_KEY not in annos:
-            annos[FORM_VERSIONS_KEY] = OOBTree()
-
-        # Get all versions
-        form_versions = list(annos[FORM_VERSIONS_KEY].values())
-
-        # Sort by created date, newest first
-        return sorted(
-            form_versions,
-            key=lambda x: ensure_timezone_aware(x["created"]),
-            reverse=True,
-        )
+        return get_form_versions(self.context).values()
 
     @property
     def has_versions(self):
         """Check if any versions exist"""
-        return len(self.versions) > 0
+        return len(get_form_versions(self.context)) > 0
 
     def download_version(self):
         """Download a specific version as JSON file"""
@@ -200,10 +360,7 @@ class Views(BrowserView):
                 self.context.absolute_url() + "/@@form-versions"
             )
 
-        annos = IAnnotations(self.context)
-        form_versions = annos.get(FORM_VERSIONS_KEY, {})
-
-        version_data = form_versions.get(version_id)
+        version_data = get_form_versions(self.context).get(version_id)
         if not version_data:
             plone.api.portal.show_message(_("Version not found"), type="error")
             return self.request.response.redirect(
@@ -232,8 +389,7 @@ class Views(BrowserView):
                 self.context.absolute_url() + "/@@form-versions"
             )
 
-        annos = IAnnotations(self.context)
-        form_versions = annos.get(FORM_VERSIONS_KEY, {})
+        form_versions = get_form_versions(self.context)
 
         old_version = form_versions.get(version_id)
         if not old_version:
@@ -250,12 +406,15 @@ class Views(BrowserView):
             form_json=old_version["form_json"],
         )
 
-        annos[FORM_VERSIONS_KEY][new_version["id"]] = new_version
+        version = self._add_version(new_version)
 
-        plone.api.portal.show_message(
-            _("Version restored successfully. A new version has been created."),
-            type="info",
-        )
+        if version["id"] == new_version["id"]:
+            message = _(
+                "Version restored successfully. A new version has been created."
+            )
+        else:
+            message = _("This version is already the current version.")
+        plone.api.portal.show_message(message, type="info")
         return self.request.response.redirect(
             self.context.absolute_url() + "/@@form-versions"
         )
@@ -296,10 +455,6 @@ class Views(BrowserView):
             )
 
         # Save as new version
-        annos = IAnnotations(self.context)
-        if FORM_VERSIONS_KEY not in annos:
-            annos[FORM_VERSIONS_KEY] = OOBTree()
-
         new_version = dict(
             id=str(uuid.uuid4()),
             created=datetime.now(timezone.utc),
@@ -307,7 +462,7 @@ class Views(BrowserView):
             form_json=json_data,
         )
 
-        annos[FORM_VERSIONS_KEY][new_version["id"]] = new_version
+        self._add_version(new_version)
 
         plone.api.portal.show_message(
             _("JSON uploaded successfully as new version"), type="info"
@@ -320,10 +475,7 @@ class Views(BrowserView):
         """Return JSON for a specific version for viewing"""
         version_id = self.request.form.get("version_id")
 
-        annos = IAnnotations(self.context)
-        form_versions = annos.get(FORM_VERSIONS_KEY, {})
-
-        version_data = form_versions.get(version_id)
+        version_data = get_form_versions(self.context).get(version_id)
         if not version_data:
             result = {"error": "Version not found"}
         else:
@@ -335,52 +487,172 @@ class Views(BrowserView):
     @property
     def results(self):
         """Get all poll results sorted by creation date (newest first)"""
-        annos = IAnnotations(self.context)
-
-        # Initialize if doesn't exist
-        if RESULTS_KEY not in annos:
-            annos[RESULTS_KEY] = OOBTree()
-
-        # Get all results
-        results = list(annos[RESULTS_KEY].values())
-
-        # Sort by created date, newest first
-        return sorted(
-            results, key=lambda x: ensure_timezone_aware(x["created"]), reverse=True
+        return list(get_results(self.context).values())
+
+    def _results_page(self, users=None):
+        """One page of results using keyset pagination.
+
+        Request parameters: `cursor` (opaque position returned as `next` or
+        `prev` of another page), `direction` (`next` or `prev`), `pagesize`,
+        `order` (`newest` or `oldest`) and `q` (user search, matching user
+        ids by prefix or with `match=exact` exactly). `users` restricts the
+        page to the given normalized user ids instead.
+        """
+        form = self.request.form
+        q = normalize_user(form.get("q"))
+        cursor = form.get("cursor") or None
+        backwards = cursor is not None and form.get("direction") == "prev"
+        reverse = form.get("order", "newest") != "oldest"
+        try:
+            pagesize = int(form.get("pagesize", DEFAULT_PAGESIZE))
+        except ValueError:
+            raise ValueError("Invalid page size")
+        pagesize = max(1, min(pagesize, MAX_PAGESIZE))
+        after = decode_cursor(cursor) if cursor else None
+
+        results = get_results(self.context)
+        if users is None and q:
+            users = [q] if form.get("match") == "exact" else results.users(q)
+        records = results.values(
+            reverse=reverse != backwards, after=after, users=users
         )
 
-    def get_paginated_results(self):
-        """Return paginated results"""
-        q = self.request.form.get("q", "").lower()
-        b_start = int(self.request.form.get("b_start", 0))
-        pagesize = 10
-
-        all_results = self.results
-        if q:
-            all_results = [r for r in all_results if q in r.get("user", "").lower()]
-
-        total = len(all_results)
-        numpages = total // pagesize
-        if total % pagesize > 0:
-            numpages += 1
-        page = b_start // pagesize + 1
+        # fetch one record more to know if there is another page
+        items = list(islice(records, pagesize + 1))
+        more = len(items) > pagesize
+        items = items[:pagesize]
+        if backwards:
+            items.reverse()
+            has_next, has_prev = True, more
+        else:
+            has_next, has_prev = more, after is not None
+
         return dict(
-            items=all_results[b_start : b_start + pagesize],
-            total=total,
-            numpages=numpages,
-            page=page,
+            items=items,
+            next=encode_cursor(position(items[-1])) if items and has_next else None,
+            prev=encode_cursor(position(items[0])) if items and has_prev else None,
             pagesize=pagesize,
+            order="newest" if reverse else "oldest",
             q=q,
+            users=users,
+        )
+
+    def _window_cursors(self, anchor, pagesize, pages, reverse, users=None):
+        """Cursors of the `pages` pages behind the page ending at `anchor`.
+
+        Only walks the indexes, no records are loaded.
+        """
+        cursors = []
+        positions = get_results(self.context).positions(
+            reverse, after=anchor, users=users
         )
+        for page in range(pages):
+            anchor = next(islice(positions, pagesize - 1, None), None)
+            if anchor is None:
+                break
+            cursors.append(encode_cursor(anchor))
+        return cursors
+
+    def get_results_page(self):
+        """JSON page of results with keyset pagination.
+
+        Every page costs the same, regardless of its distance from the
+        first one. `total=1` adds the number of stored results.
+        """
+        try:
+            page = self._results_page()
+        except ValueError as e:
+            self.request.response.setStatus(400)
+            self.request.response.setHeader("content-type", "application/json")
+            self.request.response.write(
+                orjson.dumps({"error": "Bad request", "message": str(e)})
+            )
+            return
+
+        users = page.pop("users")
+        if self.request.form.get("total") in ("1", "true") and users is None:
+            page["total"] = len(get_results(self.context))
+
+        self.request.response.setHeader("content-type", "application/json")
+        self.request.response.write(orjson.dumps(page))
+
+    def my_submissions(self):
+        """JSON page of the submissions of the current user, newest first"""
+        if plone.api.user.is_anonymous():
+            self.request.response.setStatus(401)
+            self.request.response.setHeader("content-type", "application/json")
+            self.request.response.write(
+                orjson.dumps({"error": "Unauthorized", "message": "Login required"})
+            )
+            return
+
+        user_id = plone.api.user.get_current().getId()
+        try:
+            page = self._results_page(users=[normalize_user(user_id)])
+        except ValueError as e:
+            self.request.response.setStatus(400)
+            self.request.response.setHeader("content-type", "application/json")
+            self.request.response.write(
+                orjson.dumps({"error": "Bad request", "message": str(e)})
+            )
+            return
+        del page["users"], page["q"]
+
+        self.request.response.setHeader("content-type", "application/json")
+        self.request.response.write(orjson.dumps(page))
+
+    def get_paginated_results(self):
+        """Return paginated results with a window of nearby pages"""
+        try:
+            page = self._results_page()
+        except ValueError:
+            self.request.form.pop("cursor", None)
+            self.request.form.pop("pagesize", None)
+            page = self._results_page()
+
+        try:
+            number = max(1, int(self.request.form.get("page", 1)))
+        except ValueError:
+            number = 1
+        if not page["prev"]:
+            number = 1
+
+        reverse = page["order"] == "newest"
+        pagesize = page["pagesize"]
+        users = page["users"]
+        window = []
+        if page["items"]:
+            first = position(page["items"][0])
+            last = position(page["items"][-1])
+            before = []
+            if page["prev"] and number > 1:
+                before = [page["prev"]]
+                before += self._window_cursors(
+                    first, pagesize, min(WINDOW, number - 1) - 1, not reverse, users
+                )
+            for offset, cursor in enumerate(before, 1):
+                link = dict(page=number - offset, cursor=cursor, direction="prev")
+                window.insert(0, link)
+            window.append(dict(page=number, cursor=None, direction=None))
+            if page["next"]:
+                after = [page["next"]]
+                after += self._window_cursors(
+                    last, pagesize, WINDOW - 1, reverse, users
+                )
+                for offset, cursor in enumerate(after, 1):
+                    link = dict(page=number + offset, cursor=cursor, direction="next")
+                    window.append(link)
+
+        total = len(get_results(self.context))
+        numpages = total // pagesize + (1 if total % pagesize else 0)
+        page.update(total=total, numpages=numpages, page=number, window=window)
+        return page
 
     def view_result_json(self):
         """Return JSON for a specific poll result for viewing"""
         poll_id = self.request.form.get("poll_id")
 
-        annos = IAnnotations(self.context)
-        results = annos.get(RESULTS_KEY, {})
-
-        result_data = results.get(poll_id)
+        result_data = get_results(self.context).get(poll_id)
         if not result_data:
             result = {"error": "Poll result not found"}
         else:
@@ -389,6 +661,47 @@ class Views(BrowserView):
         self.request.response.setHeader("content-type", "application/json")
         self.request.response.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
 
+    def download_attachment(self):
+        """Stream a file uploaded with a poll result, honoring `Range`.
+
+        Respondents choose the files, so only raster images are served
+        inline and browsers must not sniff the content type.
+        """
+        attachment = get_attachments(self.context).get(self.request.form.get("id"))
+        response = self.request.response
+        if attachment is None:
+            response.setStatus(404)
+            return "Attachment not found"
+
+        filename = attachment.blob.committed()
+        size = attachment.size
+        content_type = media_type(attachment.content_type)
+        response.setHeader("Content-Type", content_type)
+        response.setHeader("X-Content-Type-Options", "nosniff")
+        response.setHeader("Accept-Ranges", "bytes")
+        response.setHeader(
+            "Content-Disposition",
+            content_disposition(content_type, attachment.filename),
+        )
+        # attachments never change, their ids are unique
+        response.setHeader("Cache-Control", "private, max-age=31536000, immutable")
+
+        try:
+            byte_range = parse_range(self.request.getHeader("Range"), size)
+        except ValueError:
+            response.setStatus(416)
+            response.setHeader("Content-Range", f"bytes */{size}")
+            return ""
+        if byte_range is None:
+            response.setHeader("Content-Length", str(size))
+            return filestream_iterator(filename, "rb")
+
+        start, end = byte_range
+        response.setStatus(206)
+        response.setHeader("Content-Range", f"bytes {start}-{end}/{size}")
+        response.setHeader("Content-Length", str(end - start + 1))
+        return range_iterator(filename, start, end)
+
     @property
     def plone_api(self):
         return plone.api
@@ -400,11 +713,18 @@ class Views(BrowserView):
 
 
     def generate_ai_form(self):
-        """Generate a SurveyJS form using AI based on user prompt"""
+        """Generate a SurveyJS form using AI based on user prompt.
+
+        Cached forms are returned right away, otherwise the generation runs
+        as a background job (see `ai_jobs`) and its id is returned, the
+        response text streams from `@@ai-job-events`.
+        """
 
         # Import AI generation functions
         try:
-            from .ai_generator import generate_survey_json, strip_markdown_json
+            from .ai_generator import generate_form
+            from .ai_generator import GENERATE_PROMPT, generation_cache
+            from .ai_generator import resolve_model_name
         except ImportError as e:
             error_result = {"error": "LLM module not available", "message": str(e)}
             self.request.response.setStatus(500)
@@ -426,65 +746,134 @@ class Views(BrowserView):
             return
 
         try:
-            # Get AI settings from registry
-            from plone.registry.interfaces import IRegistry
-            from zope.component import getUtility
-            from ..interfaces import IFormsSettings
-
-            registry = getUtility(IRegistry)
-            settings = registry.forInterface(IFormsSettings, check=False)
-
-            # Get configured model and API key
-            model_name = getattr(settings, "ai_model", None)
-            api_key = getattr(settings, "ai_api_key", None)
-
-            # Strip whitespace from settings
-            if model_name:
-                model_name = model_name.strip()
-            if api_key:
-                api_key = api_key.strip()
-
-            # Generate the survey JSON using LLM with configured settings
-            survey_json_str = generate_survey_json(
-                prompt, model_name=model_name or None, api_key=api_key or None
-            )
+            model_name, api_key = self._ai_settings()
+            model_name = resolve_model_name(model_name)
 
-            # Strip any markdown formatting
-            cleaned_json_str = strip_markdown_json(survey_json_str)
-
-            # Validate JSON
-            survey_data = orjson.loads(cleaned_json_str)
-
-            # Return success with generated JSON
-            result = {"success": True, "json": survey_data}
+        except Exception as e:
+            error_result = {"error": "Configuration error", "message": str(e)}
+            self.request.response.setStatus(500)
+            self.request.response.setHeader("content-type", "application/json")
+            self.request.response.write(orjson.dumps(error_result))
+            return
 
+        # Identical prompts for the same model are answered from the cache
+        # unless a new generation is requested explicitly
+        key = generation_cache.key(prompt, model_name, GENERATE_PROMPT)
+        regenerate = self.request.form.get("regenerate") in ("1", "true", "on")
+        cached = None if regenerate else generation_cache.get(key)
+        if cached is not None:
+            result = {"success": True, "json": orjson.loads(cached), "cached": True}
             self.request.response.setStatus(200)
             self.request.response.setHeader("content-type", "application/json")
             self.request.response.write(orjson.dumps(result))
+            return
 
-        except orjson.JSONDecodeError as e:
-            error_result = {
-                "error": "Invalid JSON generated",
-                "message": f"The AI generated invalid JSON: {str(e)}",
-                "raw_output": cleaned_json_str
-                if "cleaned_json_str" in locals()
-                else survey_json_str,
-            }
-            self.request.response.setStatus(500)
-            self.request.response.setHeader("content-type", "application/json")
-            self.request.response.write(orjson.dumps(error_result))
+        self._submit_ai_job(partial(generate_form, prompt, model_name, api_key, key))
 
-        except ValueError as e:
-            error_result = {"error": "Configuration error", "message": str(e)}
-            self.request.response.setStatus(500)
+    def _ai_settings(self):
+        """Configured AI model and API key (or None), cached per site"""
+        from .ai_generator import model_registry
+
+        def load():
+            settings = []
+            for name in ("ai_model", "ai_api_key"):
+                value = plone.api.portal.get_registry_record(
+                    name, interface=IFormsSettings, default=None
+                )
+                # Strip whitespace from settings
+                settings.append((value or "").strip() or None)
+            return tuple(settings)
+
+        site = "/".join(plone.api.portal.get().getPhysicalPath())
+        return model_registry.settings(load, site)
+
+    def _submit_ai_job(self, func):
+        """Run `func` as a streaming background job and return its id with
+        the URLs of its status and its event stream (HTTP 202)"""
+        from .ai_jobs import get_job_queue
+        from .ai_jobs import QueueFull
+
+        try:
+            job = get_job_queue().submit(func, self._ai_job_owner(), stream=True)
+        except QueueFull as e:
+            error_result = {"error": "Too many requests", "message": str(e)}
+            self.request.response.setStatus(503)
+            self.request.response.setHeader("retry-after", "10")
             self.request.response.setHeader("content-type", "application/json")
             self.request.response.write(orjson.dumps(error_result))
+            return
 
-        except Exception as e:
-            error_result = {"error": "Generation failed", "message": str(e)}
-            self.request.response.setStatus(500)
+        url = self.context.absolute_url()
+        result = job.info()
+        result["status_url"] = f"{url}/@@ai-job-status?job={job.id}"
+        result["events_url"] = f"{url}/@@ai-job-events?job={job.id}"
+        self.request.response.setStatus(202)
+        self.request.response.setHeader("content-type", "application/json")
+        self.request.response.write(orjson.dumps(result))
+
+    def _ai_job_owner(self):
+        return plone.api.user.get_current().getId()
+
+    def ai_job_status(self):
+        """JSON status of an AI job, with its result once it is finished"""
+        from .ai_jobs import get_job_queue
+
+        info = get_job_queue().get(
+            self.request.form.get("job", ""), self._ai_job_owner()
+        )
+        if info is None:
+            info = {
+                "error": "Unknown job",
+                "message": "The job expired or never existed",
+            }
+            self.request.response.setStatus(404)
+        self.request.response.setHeader("content-type", "application/json")
+        self.request.response.setHeader("cache-control", "no-store")
+        self.request.response.write(orjson.dumps(info))
+
+    def ai_job_events(self):
+        """Server-Sent Events relaying the response text of an AI job since
+        the `Last-Event-ID` the browser sends, ending with the result (see
+        `JobQueue.events`). Answers right away, the browser reconnects for
+        the next events."""
+        from .ai_jobs import format_events
+        from .ai_jobs import get_job_queue
+
+        progress = get_job_queue().events(
+            self.request.form.get("job", ""),
+            self._ai_job_owner(),
+            self.request.getHeader("Last-Event-ID", ""),
+        )
+        if progress is None:
+            info = {
+                "error": "Unknown job",
+                "message": "The job expired or never existed",
+            }
+            self.request.response.setStatus(404)
             self.request.response.setHeader("content-type", "application/json")
-            self.request.response.write(orjson.dumps(error_result))
+            self.request.response.write(orjson.dumps(info))
+            return
+
+        self.request.response.setHeader("content-type", "text/event-stream")
+        self.request.response.setHeader("cache-control", "no-store")
+        event_id, events = progress
+        self.request.response.write(format_events(events, event_id))
+
+    def ai_cache_stats(self):
+        """JSON hit/miss counters of the AI generation cache, the number of
+        AI jobs by status and of cached models"""
+        from .ai_generator import generation_cache
+        from .ai_generator import model_registry
+        from .ai_jobs import get_job_queue
+
+        stats = dict(
+            generation_cache.stats(),
+            jobs=get_job_queue().stats(),
+            models=model_registry.stats(),
+        )
+        self.request.response.setHeader("content-type", "application/json")
+        self.request.response.setHeader("cache-control", "no-store")
+        return orjson.dumps(stats)
 
     def save_ai_form(self):
         """Save AI-generated form as a new version"""
@@ -504,10 +893,6 @@ class Views(BrowserView):
                 raise ValueError("Form JSON must be an object")
 
             # Save as version (reuse existing pattern from save_form_json)
-            annos = IAnnotations(self.context)
-            if FORM_VERSIONS_KEY not in annos:
-                annos[FORM_VERSIONS_KEY] = OOBTree()
-
             data = dict(
                 id=str(uuid.uuid4()),
                 created=datetime.now(timezone.utc),
@@ -515,10 +900,12 @@ class Views(BrowserView):
                 form_json=json_form,
             )
 
-            annos[FORM_VERSIONS_KEY][data["id"]] = data
+            version = self._add_version(data)
 
             result = dict(
-                success=True, message="Form saved successfully", version_id=data["id"]
+                success=True,
+                message="Form saved successfully",
+                version_id=version["id"],
             )
 
             self.request.response.setStatus(200)
@@ -538,11 +925,18 @@ class Views(BrowserView):
             self.request.response.write(orjson.dumps(error_result))
 
     def refine_ai_form(self):
-        """Refine an existing SurveyJS form based on user feedback"""
+        """Refine an existing SurveyJS form based on user feedback.
+
+        The refinement runs as a background job (see `ai_jobs`), its id is
+        returned. `mode` selects between asking for a JSON patch ("patch",
+        the default) and for the complete form ("full").
+        """
 
         # Import AI generation functions
         try:
-            from .ai_generator import refine_survey_json, strip_markdown_json
+            from .ai_generator import refine_form
+            from .ai_generator import REFINE_MODES
+            from .ai_generator import REFINE_PATCH
         except ImportError as e:
             error_result = {"error": "LLM module not available", "message": str(e)}
             self.request.response.setStatus(500)
@@ -574,6 +968,17 @@ class Views(BrowserView):
             self.request.response.write(orjson.dumps(error_result))
             return
 
+        mode = self.request.form.get("mode", "").strip() or REFINE_PATCH
+        if mode not in REFINE_MODES:
+            error_result = {
+                "error": "Invalid mode",
+                "message": f"The refinement mode must be one of {', '.join(REFINE_MODES)}",
+            }
+            self.request.response.setStatus(400)
+            self.request.response.setHeader("content-type", "application/json")
+            self.request.response.write(orjson.dumps(error_result))
+            return
+
         try:
             # Parse current JSON
             current_json = orjson.loads(current_json_str)
@@ -582,74 +987,36 @@ class Views(BrowserView):
             if not isinstance(current_json, dict):
                 raise ValueError("Current form JSON must be an object")
 
-            # Get AI settings from registry
-            from plone.registry.interfaces import IRegistry
-            from zope.component import getUtility
-            from ..interfaces import IFormsSettings
-
-            registry = getUtility(IRegistry)
-            settings = registry.forInterface(IFormsSettings, check=False)
-
-            # Get configured model and API key
-            model_name = getattr(settings, "ai_model", None)
-            api_key = getattr(settings, "ai_api_key", None)
-
-            # Strip whitespace from settings
-            if model_name:
-                model_name = model_name.strip()
-            if api_key:
-                api_key = api_key.strip()
-
-            # Generate the refined survey JSON using LLM with configured settings
-            refined_json_str = refine_survey_json(
-                current_json,
-                refinement_prompt,
-                model_name=model_name or None,
-                api_key=api_key or None,
-            )
-
-            # Strip any markdown formatting
-            cleaned_json_str = strip_markdown_json(refined_json_str)
-
-            # Validate JSON
-            refined_data = orjson.loads(cleaned_json_str)
-
-            # Validate it's still a dict
-            if not isinstance(refined_data, dict):
-                raise ValueError("Refined form must be a JSON object")
-
-            # Return success with refined JSON
-            result = {"success": True, "json": refined_data}
-
-            self.request.response.setStatus(200)
-            self.request.response.setHeader("content-type", "application/json")
-            self.request.response.write(orjson.dumps(result))
+            model_name, api_key = self._ai_settings()
 
         except orjson.JSONDecodeError as e:
             error_result = {
                 "error": "Invalid JSON",
                 "message": f"JSON parsing error: {str(e)}",
-                "raw_output": cleaned_json_str
-                if "cleaned_json_str" in locals()
-                else refined_json_str
-                if "refined_json_str" in locals()
-                else current_json_str,
+                "raw_output": current_json_str,
             }
-            self.request.response.setStatus(500)
+            self.request.response.setStatus(400)
             self.request.response.setHeader("content-type", "application/json")
             self.request.response.write(orjson.dumps(error_result))
+            return
 
         except ValueError as e:
             error_result = {"error": "Validation error", "message": str(e)}
             self.request.response.setStatus(400)
             self.request.response.setHeader("content-type", "application/json")
             self.request.response.write(orjson.dumps(error_result))
+            return
 
-        except Exception as e:
-            error_result = {"error": "Refinement failed", "message": str(e)}
-            self.request.response.setStatus(500)
-            self.request.response.setHeader("content-type", "application/json")
-            self.request.response.write(orjson.dumps(error_result))
+        self._submit_ai_job(
+            partial(
+                refine_form,
+                current_json,
+                refinement_prompt,
+                model_name,
+                api_key,
+                mode=mode,
+            )
+        )
 
 
 class EmbedViewer(Views):
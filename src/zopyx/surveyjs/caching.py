@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""HTTP caching support for survey form definitions."""
+
+from .storage import ensure_timezone_aware
+from email.utils import format_datetime
+from email.utils import parsedate_to_datetime
+from z3c.caching.interfaces import IPurgePaths
+from z3c.caching.purge import Purge
+from zope.event import notify
+from zope.interface import implementer
+
+
+# Cache-Control defaults, see IFormsSettings
+FORM_CACHE_CONTROL = "public, max-age=0, must-revalidate"
+VERSIONED_FORM_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Views serving the current form definition of a survey or embedding the
+# URL of its current version
+FORM_VIEWS = (
+    "get-form-json",
+    "@@get-form-json",
+    "viewer",
+    "@@viewer",
+    "viewer-embed",
+    "@@viewer-embed",
+)
+
+
+def http_date(dt):
+    """RFC 7231 date of a datetime"""
+    return format_datetime(ensure_timezone_aware(dt), usegmt=True)
+
+
+def is_not_modified(request, etag, last_modified=None):
+    """Check the conditional request headers against a resource.
+
+    `If-None-Match` takes precedence over `If-Modified-Since` (RFC 7232).
+    """
+    if_none_match = request.getHeader("If-None-Match")
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # weak comparison as required for If-None-Match
+        tags = [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.getHeader("If-Modified-Since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            return False
+        last_modified = ensure_timezone_aware(last_modified).replace(microsecond=0)
+        return last_modified <= since
+    return False
+
+
+def purge(context):
+    """Queue cache purges for the form views of a survey"""
+    notify(Purge(context))
+
+
+@implementer(IPurgePaths)
+class SurveyPurgePaths(object):
+    """Paths of the form views of a survey to purge from caching proxies"""
+
+    def __init__(self, context):
+        self.context = context
+
+    def getRelativePaths(self):
+        prefix = "/" + self.context.virtual_url_path()
+        return [f"{prefix}/{name}" for name in FORM_VIEWS]
+
+    def getAbsolutePaths(self):
+        return []
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Debounced catalog updates for survey submissions.
+
+The catalog keeps the number of responses and the time of the last
+submission of every survey (see `indexers`), so listings are answered
+from brains. Reindexing a survey with every submission would write the
+catalog in every `save_poll` transaction and turn concurrent submissions
+into conflicts. Instead, `queue_reindex` collects the surveys that got
+submissions and a timer reindexes them in one batch `REINDEX_DELAY`
+seconds after the first one, in a transaction of its own.
+
+The queue lives in memory: after a crash the metadata of the affected
+surveys catches up with their next submission.
+"""
+
+from ZODB.POSException import ConflictError
+
+import logging
+import threading
+import transaction
+
+
+LOG = logging.getLogger("zopyx.surveyjs")
+
+# Indexes depending on the submissions of a survey. Reindexing them also
+# refreshes the metadata columns, including `survey_activity`.
+SUBMISSION_INDEXES = ("survey_responses", "survey_last_submission")
+
+# All indexes and metadata columns of surveys, see `indexers`
+SURVEY_INDEXES = SUBMISSION_INDEXES + ("survey_form_version",)
+
+# Seconds to collect submissions before their surveys are reindexed
+REINDEX_DELAY = 10.0
+
+# Attempts to commit a batch before giving up
+RETRIES = 5
+
+
+class ReindexQueue(object):
+    """Surveys waiting to be reindexed, by physical path"""
+
+    def __init__(self, open_root, delay=REINDEX_DELAY):
+        self.open_root = open_root
+        self.delay = delay
+        self._paths = set()
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._paths)
+
+    def add(self, path):
+        """Queue a survey, starting the timer if none is running"""
+        with self._lock:
+            self._paths.add(path)
+            if self._timer is None and self.delay is not None:
+                self._timer = threading.Timer(self.delay, self._run)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _run(self):
+        try:
+            self.flush()
+        except Exception:
+            LOG.exception("Reindexing surveys failed")
+
+    def flush(self):
+        """Reindex all queued surveys, returns their number"""
+        with self._lock:
+            paths = sorted(self._paths)
+            self._paths.clear()
+            self._timer = None
+        if not paths:
+            return 0
+        for attempt in range(RETRIES):
+            transaction.begin()
+            try:
+                with self.open_root() as root:
+                    for path in paths:
+                        survey = root.unrestrictedTraverse(path, None)
+                        if survey is not None:
+                            survey.reindexObject(idxs=list(SUBMISSION_INDEXES))
+                    transaction.commit()
+                    return len(paths)
+            except ConflictError:
+                transaction.abort()
+                LOG.info("Conflict reindexing surveys, retrying")
+            except Exception:
+                transaction.abort()
+                raise
+        raise ConflictError("Too many conflicts reindexing surveys")
+
+
+def _queue_after_commit(success, queue, path):
+    if success:
+        queue.add(path)
+
+
+def queue_reindex(context, queue):
+    """Queue a survey for reindexing once the current transaction commits"""
+    path = "/".join(context.getPhysicalPath())
+    transaction.get().addAfterCommitHook(_queue_after_commit, args=(queue, path))
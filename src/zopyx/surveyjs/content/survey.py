@@ -10,13 +10,12 @@ from zope.interface import implementer
 # from z3c.form.browser.radio import RadioFieldWidget
 from z3c.form.browser.checkbox import CheckBoxFieldWidget
 from zope import schema
-from BTrees.OOBTree import OOBTree
 from zope.schema.vocabulary import SimpleVocabulary, SimpleTerm
 from zopyx.surveyjs import _
 from plone.autoform import directives as form
 from zope.annotation.interfaces import IAnnotations
 
-from ..browser.views import FORM_VERSIONS_KEY, RESULTS_KEY
+from ..storage import FORM_VERSIONS_KEY, RESULTS_KEY, FormVersions, ResultContainer
 
 survey_actions_vocabulary = SimpleVocabulary(
     [
@@ -66,5 +65,5 @@ class Survey(Item):
 
     def __init__(self):
         annos = IAnnotations(self)
-        annos[FORM_VERSIONS_KEY] = OOBTree()
-        annos[RESULTS_KEY] = OOBTree()
+        annos[FORM_VERSIONS_KEY] = FormVersions()
+        annos[RESULTS_KEY] = ResultContainer()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Helpers for SurveyJS form definitions."""
+
+from collections import Counter
+
+
+# SurveyJS elements that never carry a value
+NO_VALUE_TYPES = ("html", "image", "expression")
+
+
+def choice_value(choice):
+    """Value of a choice, row or column given as string or object"""
+    return choice.get("value") if isinstance(choice, dict) else choice
+
+
+def walk_elements(elements):
+    """Iterate over value carrying elements, descending into panels"""
+    for element in elements or ():
+        element_type = element.get("type")
+        if element_type == "panel":
+            yield from walk_elements(element.get("elements"))
+        elif element_type not in NO_VALUE_TYPES and element.get("name"):
+            yield element
+
+
+def form_elements(form_json):
+    """Iterate over all value carrying elements of a SurveyJS form"""
+    for page in form_json.get("pages") or [form_json]:
+        yield from walk_elements(page.get("elements") or page.get("questions"))
+
+
+class InvalidForm(ValueError):
+    """A form definition SurveyJS can't render"""
+
+
+def _check_elements(elements, where):
+    if not isinstance(elements, list):
+        raise InvalidForm(f"The elements of {where} are no list")
+    for index, element in enumerate(elements, 1):
+        if not isinstance(element, dict) or not element.get("type"):
+            raise InvalidForm(f"Element {index} of {where} has no type")
+        element_type = element["type"]
+        if element_type == "panel":
+            panel = f"panel {element.get('name')}"
+            _check_elements(element.get("elements") or [], panel)
+        elif element_type not in NO_VALUE_TYPES and not (
+            element.get("name") and isinstance(element["name"], str)
+        ):
+            raise InvalidForm(
+                f"Element {index} ({element_type}) of {where} has no name"
+            )
+        if "templateElements" in element:
+            _check_elements(element["templateElements"], f"panel {element['name']}")
+
+
+def validate_form(form_json):
+    """Check the structure of a SurveyJS form.
+
+    The form must be an object with a non-empty list of pages (or the
+    elements of a single page), every element needs a type and value
+    carrying elements a unique name. Raises `InvalidForm` otherwise.
+    """
+    if not isinstance(form_json, dict):
+        raise InvalidForm("The form is no JSON object")
+    pages = form_json.get("pages")
+    if pages is None:
+        pages = [form_json]
+    elif not isinstance(pages, list) or not pages:
+        raise InvalidForm("The pages of the form are no non-empty list")
+    for index, page in enumerate(pages, 1):
+        if not isinstance(page, dict):
+            raise InvalidForm(f"Page {index} is no JSON object")
+        elements = page.get("elements", page.get("questions"))
+        if elements is None:
+            elements = []
+        _check_elements(elements, f"page {index}")
+
+    names = Counter(element["name"] for element in form_elements(form_json))
+    if not names:
+        raise InvalidForm("The form has no questions")
+    duplicates = sorted(name for name, count in names.items() if count > 1)
+    if duplicates:
+        raise InvalidForm(f"Duplicate question names: {', '.join(duplicates)}")
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Catalog indexers of surveys.
+
+The submission indexes are refreshed in batches after submissions, see
+`catalog.ReindexQueue`, the form version index whenever a new version
+becomes current.
+"""
+
+from .content.survey import ISurvey
+from .stats import ACTIVITY_HOURS
+from .stats import hour_key
+from .stats import STATS_KEY
+from .storage import EPOCH
+from .storage import get_form_versions
+from .storage import get_results
+from .storage import SLOTS
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from plone.indexer import indexer
+from zope.annotation.interfaces import IAnnotations
+
+
+@indexer(ISurvey)
+def survey_responses(obj):
+    """Number of stored responses"""
+    return len(get_results(obj))
+
+
+@indexer(ISurvey)
+def survey_last_submission(obj):
+    """Submission time of the newest response"""
+    pos = next(iter(get_results(obj).positions()), None)
+    if pos is None:
+        raise AttributeError("survey_last_submission")
+    return EPOCH + timedelta(microseconds=pos // SLOTS)
+
+
+@indexer(ISurvey)
+def survey_activity(obj):
+    """Submissions per hour of the last week as `(hour, count)` tuples.
+
+    Metadata only, hours are absolute (see `stats.hour_key`), so the
+    counts of a window stay correct without reindexing as time passes.
+    """
+    stats = IAnnotations(obj).get(STATS_KEY)
+    if stats is None:
+        return ()
+    since = hour_key(datetime.now(timezone.utc)) - ACTIVITY_HOURS + 1
+    return tuple(stats.activity(since))
+
+
+@indexer(ISurvey)
+def survey_form_version(obj):
+    """Id of the current form version"""
+    current_id = get_form_versions(obj).current_id
+    if current_id is None:
+        raise AttributeError("survey_form_version")
+    return current_id
@@ -47,3 +47,71 @@ class IFormsSettings(Interface):
         required=False,
         default="",
     )
+
+    form_cache_control = schema.TextLine(
+        title="Form Cache-Control",
+        description="Cache-Control header of the form JSON of surveys. Clients and "
+        "proxies revalidate using the ETag of the current form version.",
+        required=False,
+        default="public, max-age=0, must-revalidate",
+    )
+
+    form_versioned_cache_control = schema.TextLine(
+        title="Versioned form Cache-Control",
+        description="Cache-Control header of the form JSON requested for a "
+        "specific form version (as done by the survey viewer)",
+        required=False,
+        default="public, max-age=31536000, immutable",
+    )
+
+    spool_submissions = schema.Bool(
+        title="Spool submissions",
+        description="Acknowledge poll submissions after appending them to a local "
+        "spool file and store them in the background in batches. Improves "
+        "throughput under load; results appear with a short delay.",
+        required=False,
+        default=False,
+    )
+
+
+class IResultStorage(Interface):
+    """Storage of the poll results of a survey.
+
+    Records are dicts with `poll_id`, `created`, `user` and `result`. They
+    are ordered by their position (see `storage.position`), which combines
+    the submission time with a hash of the `poll_id`. Backends are named
+    adapters of the survey, `storage.get_results` returns the one
+    selected for a survey.
+    """
+
+    def add(data):
+        """Store a new result record and return its position"""
+
+    def get(poll_id, default=None):
+        """The record with `poll_id` or `default`"""
+
+    def __contains__(poll_id):
+        """Whether a record with `poll_id` is stored"""
+
+    def __len__():
+        """Number of stored records"""
+
+    def values(reverse=True, start=0, limit=None, after=None, users=None):
+        """Iterate over records in submission order.
+
+        `reverse=True` returns the newest records first. `after` is a
+        position to continue behind, `start`/`limit` select a window and
+        `users` restricts the records to the given normalized user ids.
+        """
+
+    def positions(reverse=True, after=None, users=None):
+        """Iterate over record positions like `values` without loading them"""
+
+    def users(prefix=""):
+        """Sorted distinct normalized user ids starting with `prefix`"""
+
+    def remove(poll_id):
+        """Drop the record with `poll_id`, raises `KeyError` if missing"""
+
+    def clear():
+        """Drop all records"""
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Minimal RFC 6902 JSON Patch support for form definitions.
+
+`make_patch` computes a patch between two JSON documents. Lists are
+diffed by trimming their common prefix and suffix, so inserting, removing
+or changing a question in a long element list only produces operations
+for that question. `apply_patch` applies any RFC 6902 patch.
+"""
+
+import copy
+
+
+class PatchError(ValueError):
+    """A JSON patch that can't be applied"""
+
+
+def escape(token):
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+
+def unescape(token):
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def parse_pointer(pointer):
+    """Tokens of a JSON pointer"""
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise PatchError(f"Invalid JSON pointer: {pointer}")
+    return [unescape(token) for token in pointer[1:].split("/")]
+
+
+def _diff(old, new, path, ops):
+    if type(old) is not type(new):
+        ops.append(dict(op="replace", path=path, value=new))
+    elif isinstance(old, dict):
+        for key in old:
+            if key not in new:
+                ops.append(dict(op="remove", path=f"{path}/{escape(key)}"))
+        for key, value in new.items():
+            if key not in old:
+                ops.append(dict(op="add", path=f"{path}/{escape(key)}", value=value))
+            else:
+                _diff(old[key], value, f"{path}/{escape(key)}", ops)
+    elif isinstance(old, list):
+        _diff_list(old, new, path, ops)
+    elif old != new:
+        ops.append(dict(op="replace", path=path, value=new))
+
+
+def _diff_list(old, new, path, ops):
+    start = 0
+    while start < min(len(old), len(new)) and old[start] == new[start]:
+        start += 1
+    end_old, end_new = len(old), len(new)
+    while end_old > start and end_new > start and old[end_old - 1] == new[end_new - 1]:
+        end_old -= 1
+        end_new -= 1
+
+    changed = min(end_old, end_new) - start
+    # items at the same index are diffed recursively
+    for index in range(start, start + changed):
+        _diff(old[index], new[index], f"{path}/{index}", ops)
+    # surplus items are removed from the back or inserted in order
+    for index in range(end_old - 1, start + changed - 1, -1):
+        ops.append(dict(op="remove", path=f"{path}/{index}"))
+    for index in range(start + changed, end_new):
+        ops.append(dict(op="add", path=f"{path}/{index}", value=new[index]))
+
+
+def make_patch(old, new):
+    """JSON patch (list of operations) turning `old` into `new`"""
+    ops = []
+    _diff(old, new, "", ops)
+    return ops
+
+
+def _resolve(doc, tokens):
+    """The container holding the target of `tokens` and the last token"""
+    for token in tokens[:-1]:
+        doc = _child(doc, token)
+    return doc, tokens[-1]
+
+
+def _index(container, token, append=False):
+    if append and token == "-":
+        return len(container)
+    if not token.isdigit() or (token != "0" and token.startswith("0")):
+        raise PatchError(f"Invalid list index: {token}")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not append):
+        raise PatchError(f"List index out of range: {token}")
+    return index
+
+
+def _child(doc, token):
+    if isinstance(doc, dict):
+        if token not in doc:
+            raise PatchError(f"Missing key: {token}")
+        return doc[token]
+    if isinstance(doc, list):
+        return doc[_index(doc, token)]
+    raise PatchError(f"Can't descend into {type(doc).__name__}")
+
+
+def _get(doc, pointer):
+    for token in parse_pointer(pointer):
+        doc = _child(doc, token)
+    return doc
+
+
+def _add(doc, pointer, value):
+    tokens = parse_pointer(pointer)
+    if not tokens:
+        return value
+    container, token = _resolve(doc, tokens)
+    if isinstance(container, dict):
+        container[token] = value
+    elif isinstance(container, list):
+        container.insert(_index(container, token, append=True), value)
+    else:
+        raise PatchError(f"Can't add to {type(container).__name__}")
+    return doc
+
+
+def _remove(doc, pointer):
+    tokens = parse_pointer(pointer)
+    if not tokens:
+        raise PatchError("Can't remove the whole document")
+    container, token = _resolve(doc, tokens)
+    if isinstance(container, dict):
+        if token not in container:
+            raise PatchError(f"Missing key: {token}")
+        return doc, container.pop(token)
+    if isinstance(container, list):
+        return doc, container.pop(_index(container, token))
+    raise PatchError(f"Can't remove from {type(container).__name__}")
+
+
+def apply_patch(doc, patch):
+    """Apply a JSON patch to a copy of `doc` and return it.
+
+    Raises `PatchError` for malformed patches or operations that don't
+    match the document; `doc` itself is never modified.
+    """
+    if not isinstance(patch, list):
+        raise PatchError("A JSON patch must be a list of operations")
+    doc = copy.deepcopy(doc)
+    for operation in patch:
+        if not isinstance(operation, dict) or not isinstance(
+            operation.get("path"), str
+        ):
+            raise PatchError(f"Invalid operation: {operation}")
+        op, path = operation.get("op"), operation["path"]
+        if op in ("add", "replace", "test") and "value" not in operation:
+            raise PatchError(f"Missing value: {operation}")
+        if op in ("move", "copy") and not isinstance(operation.get("from"), str):
+            raise PatchError(f"Missing from: {operation}")
+
+        if op == "add":
+            doc = _add(doc, path, copy.deepcopy(operation["value"]))
+        elif op == "remove":
+            doc, _ = _remove(doc, path)
+        elif op == "replace":
+            if parse_pointer(path):
+                doc, _ = _remove(doc, path)
+            doc = _add(doc, path, copy.deepcopy(operation["value"]))
+        elif op == "move":
+            if path.startswith(operation["from"] + "/"):
+                raise PatchError(f"Can't move into a child: {operation}")
+            doc, value = _remove(doc, operation["from"])
+            doc = _add(doc, path, value)
+        elif op == "copy":
+            value = copy.deepcopy(_get(doc, operation["from"]))
+            doc = _add(doc, path, value)
+        elif op == "test":
+            if _get(doc, path) != operation["value"]:
+                raise PatchError(f"Test failed: {operation}")
+        else:
+            raise PatchError(f"Unknown operation: {op}")
+    return doc
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Portal-wide submission reports answered from catalog brains.
+
+`surveys_report` only reads the metadata columns of the survey indexes
+(see `indexers`), no survey object or annotation is loaded.
+"""
+
+from .stats import hour_key
+from datetime import datetime
+from datetime import timezone
+from operator import itemgetter
+
+import heapq
+
+
+# Number of surveys in the top lists
+TOP_SURVEYS = 10
+
+# Activity windows of the report by name, in hours
+WINDOWS = (("24h", 24), ("7d", 7 * 24))
+
+
+def survey_summary(brain, now_hour):
+    """Report entry of a survey brain"""
+    activity = brain.survey_activity or ()
+    summary = dict(
+        uid=brain.UID,
+        title=brain.Title,
+        url=brain.getURL(),
+        responses=brain.survey_responses or 0,
+        last_submission=brain.survey_last_submission or None,
+        form_version=brain.survey_form_version or None,
+    )
+    for name, hours in WINDOWS:
+        since = now_hour - hours
+        summary[name] = sum(count for hour, count in activity if hour > since)
+    return summary
+
+
+def surveys_report(brains, now=None, top=TOP_SURVEYS):
+    """Submissions per survey, recent activity and the top surveys.
+
+    `brains` are catalog brains of surveys, metadata of surveys not
+    indexed yet counts as empty. Returns the totals, the activity in the
+    windows of `WINDOWS`, the `top` surveys by responses and by activity
+    in every window, and all surveys by responses.
+    """
+    now = now or datetime.now(timezone.utc)
+    now_hour = hour_key(now)
+    surveys = [survey_summary(brain, now_hour) for brain in brains]
+    by_responses = itemgetter("responses")
+
+    activity = {}
+    top_lists = dict(responses=heapq.nlargest(top, surveys, key=by_responses))
+    for name, _ in WINDOWS:
+        active = [survey for survey in surveys if survey[name]]
+        activity[name] = dict(
+            responses=sum(survey[name] for survey in active), surveys=len(active)
+        )
+        top_lists[name] = heapq.nlargest(top, active, key=itemgetter(name))
+
+    surveys.sort(key=by_responses, reverse=True)
+    return dict(
+        generated=now,
+        surveys=len(surveys),
+        responses=sum(survey["responses"] for survey in surveys),
+        activity=activity,
+        top=top_lists,
+        items=surveys,
+    )
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""`IResultStorage` backend keeping poll results in local SQLite databases.
+
+Every survey gets its own database file (WAL mode) named by its UID in
+`ZOPYX_SURVEYJS_SQLITE_DIR` (default `<clienthome>/zopyx.surveyjs-results`).
+Writes join the Zope transaction and are committed after the ZODB voted,
+so a `ConflictError` retry never leaves a stored submission behind.
+
+The databases are local files: use this backend only with a single Zope
+instance or a directory all instances share.
+"""
+
+from .interfaces import IResultStorage
+from .storage import EPOCH
+from .storage import normalize_user
+from .storage import position
+from .storage import SLOTS
+from datetime import timedelta
+from transaction.interfaces import IDataManager
+from zope.interface import implementer
+
+import orjson
+import os
+import sqlite3
+import threading
+import transaction
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    position INTEGER PRIMARY KEY,
+    poll_id TEXT NOT NULL UNIQUE,
+    user TEXT,
+    user_key TEXT NOT NULL,
+    result BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_by_user ON results (user_key, position);
+"""
+
+_connections = threading.local()
+
+
+def connect(path):
+    """The SQLite connection of the current thread for a database file"""
+    connections = _connections.__dict__.setdefault("connections", {})
+    connection = connections.get(path)
+    if connection is None:
+        connection = sqlite3.connect(path, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        connections[path] = connection
+    return connection
+
+
+@implementer(IDataManager)
+class SQLiteDataManager(object):
+    """Commit or roll back a SQLite transaction with the Zope transaction"""
+
+    def __init__(self, connection, transaction_manager):
+        self.connection = connection
+        self.transaction_manager = transaction_manager
+
+    def abort(self, txn):
+        self.connection.rollback()
+
+    def tpc_begin(self, txn):
+        pass
+
+    def commit(self, txn):
+        pass
+
+    def tpc_vote(self, txn):
+        self.connection.commit()
+
+    def tpc_finish(self, txn):
+        pass
+
+    def tpc_abort(self, txn):
+        self.connection.rollback()
+
+    def sortKey(self):
+        # vote after the ZODB, whose conflicts abort the transaction
+        return "~zopyx.surveyjs.sqlite"
+
+
+@implementer(IResultStorage)
+class SQLiteResultStorage(object):
+    """Poll results of a survey in a SQLite database"""
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def connection(self):
+        return connect(self.path)
+
+    def _write(self):
+        """The connection inside a write transaction joined to Zope's"""
+        connection = self.connection
+        if not connection.in_transaction:
+            connection.execute("BEGIN IMMEDIATE")
+            manager = transaction.manager
+            manager.get().join(SQLiteDataManager(connection, manager))
+        return connection
+
+    def add(self, data):
+        connection = self._write()
+        pos = position(data)
+        user = data["user"]
+        result = orjson.dumps(data["result"])
+        while True:
+            try:
+                connection.execute(
+                    "INSERT INTO results VALUES (?, ?, ?, ?, ?)",
+                    (pos, data["poll_id"], user, normalize_user(user), result),
+                )
+                return pos
+            except sqlite3.IntegrityError:
+                if data["poll_id"] in self:
+                    return self._position(data["poll_id"])
+                # position taken, move the record by a microsecond
+                pos += SLOTS
+
+    def _position(self, poll_id):
+        row = self.connection.execute(
+            "SELECT position FROM results WHERE poll_id = ?", (poll_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _record(self, row):
+        pos, poll_id, user, result = row
+        return dict(
+            poll_id=poll_id,
+            created=EPOCH + timedelta(microseconds=pos // SLOTS),
+            user=user,
+            result=orjson.loads(result),
+        )
+
+    def get(self, poll_id, default=None):
+        if not poll_id:
+            return default
+        row = self.connection.execute(
+            "SELECT position, poll_id, user, result FROM results WHERE poll_id = ?",
+            (poll_id,),
+        ).fetchone()
+        return self._record(row) if row else default
+
+    def __contains__(self, poll_id):
+        return self._position(poll_id) is not None
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def _select(self, columns, reverse, start, limit, after, users):
+        where, params = [], []
+        if after is not None:
+            where.append("position < ?" if reverse else "position > ?")
+            params.append(after)
+        if users is not None:
+            where.append(f"user_key IN ({', '.join('?' * len(users))})")
+            params.extend(users)
+        query = f"SELECT {columns} FROM results"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY position DESC" if reverse else " ORDER BY position"
+        if limit is not None or start:
+            query += " LIMIT ? OFFSET ?"
+            params.extend([-1 if limit is None else limit, start])
+        return self.connection.execute(query, params)
+
+    def values(self, reverse=True, start=0, limit=None, after=None, users=None):
+        columns = "position, poll_id, user, result"
+        for row in self._select(columns, reverse, start, limit, after, users):
+            yield self._record(row)
+
+    def positions(self, reverse=True, after=None, users=None):
+        for (pos,) in self._select("position", reverse, 0, None, after, users):
+            yield pos
+
+    def users(self, prefix=""):
+        rows = self.connection.execute(
+            "SELECT DISTINCT user_key FROM results"
+            " WHERE user_key >= ? AND user_key < ? ORDER BY user_key",
+            (prefix, prefix + chr(0x10FFFF)),
+        )
+        return [user for (user,) in rows]
+
+    def remove(self, poll_id):
+        cursor = self._write().execute(
+            "DELETE FROM results WHERE poll_id = ?", (poll_id,)
+        )
+        if not cursor.rowcount:
+            raise KeyError(poll_id)
+
+    def clear(self):
+        self._write().execute("DELETE FROM results")
+
+
+def sqlite_directory():
+    directory = os.environ.get("ZOPYX_SURVEYJS_SQLITE_DIR")
+    if not directory:
+        from App.config import getConfiguration
+
+        directory = os.path.join(
+            getConfiguration().clienthome, "zopyx.surveyjs-results"
+        )
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def sqlite_results(context):
+    """`IResultStorage` adapter storing results in a SQLite database"""
+    path = os.path.join(sqlite_directory(), f"{context.UID()}.sqlite")
+    return SQLiteResultStorage(path)
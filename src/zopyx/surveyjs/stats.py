@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""Incrementally maintained per-question aggregates of poll results."""
+
+from .forms import choice_value
+from .forms import form_elements
+from .storage import date_key
+from .storage import get_current_form_json
+from .storage import get_results
+from BTrees.IOBTree import IOBTree
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from persistent import Persistent
+from zope.annotation.interfaces import IAnnotations
+
+import math
+
+
+STATS_KEY = "zopyx.surveyjs.stats"
+
+# Questions whose answers are counted per choice
+CHOICE_TYPES = (
+    "radiogroup",
+    "dropdown",
+    "checkbox",
+    "tagbox",
+    "boolean",
+    "rating",
+    "imagepicker",
+    "ranking",
+)
+
+# Questions whose answers are counted per row and column
+MATRIX_TYPES = ("matrix", "matrixdropdown")
+
+# Hours of submission counts indexed as `survey_activity` (one week)
+ACTIVITY_HOURS = 7 * 24
+
+
+class Extremum(Persistent):
+    """Minimum or maximum with application level conflict resolution"""
+
+    value = None
+
+    def __init__(self, mode, value=None):
+        self.mode = mode
+        self.value = value
+
+    def __getstate__(self):
+        return (self.mode, self.value)
+
+    def __setstate__(self, state):
+        self.mode, self.value = state
+
+    @staticmethod
+    def pick(mode, a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return min(a, b) if mode == "min" else max(a, b)
+
+    def update(self, value):
+        best = self.pick(self.mode, self.value, value)
+        # only write when the extremum actually changes
+        if best != self.value:
+            self.value = best
+
+    def _p_resolveConflict(self, old, committed, new):
+        mode = committed[0]
+        return (mode, self.pick(mode, committed[1], new[1]))
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def token(value):
+    """Counter key for an answer value.
+
+    BTree keys must be comparable with each other, so choice values of
+    mixed types are counted by their string representation.
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def hour_key(dt):
+    """Hours since the epoch of a datetime"""
+    return date_key(dt) // 3600000000
+
+
+def histogram_bucket(value):
+    """Lower bound of the decimal order of magnitude of a number.
+
+    0 <= |value| < 1 falls into bucket 0, 1..9 into 1, 10..99 into 10 and
+    so on (mirrored for negative values).
+    """
+    if abs(value) < 1:
+        return 0
+    bound = 10 ** int(math.floor(math.log10(abs(value))))
+    return bound if value > 0 else -bound
+
+
+class SurveyStats(Persistent):
+    """Running per-question aggregates of the results of a survey.
+
+    Every counter is its own `Length` and minimum/maximum values are
+    `Extremum` objects. Both resolve concurrent updates, so submissions
+    only conflict when they add a counter for a value never seen before.
+    Submissions are also counted per hour (see `activity`).
+    """
+
+    # aggregates created before the hourly counters
+    _hours = None
+
+    def __init__(self):
+        self.responses = Length()
+        self._counters = OOBTree()
+        self._extrema = OOBTree()
+        self._hours = IOBTree()
+
+    def _count(self, key, delta=1):
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters[key] = Length()
+        counter.change(delta)
+
+    def _extremum(self, key, mode, value):
+        extremum = self._extrema.get(key)
+        if extremum is None:
+            self._extrema[key] = Extremum(mode, value)
+        else:
+            extremum.update(value)
+
+    def add(self, result, form_json, created=None):
+        """Account for a new submission (submitted at `created`)"""
+        self.responses.change(1)
+        if created is not None:
+            if self._hours is None:
+                self._hours = IOBTree()
+            hour = hour_key(created)
+            counter = self._hours.get(hour)
+            if counter is None:
+                counter = self._hours[hour] = Length()
+            counter.change(1)
+        for element in form_elements(form_json):
+            name = element["name"]
+            value = result.get(name)
+            if value in (None, "", [], {}):
+                self._count((name, "skipped"))
+                continue
+            self._count((name, "answered"))
+
+            element_type = element.get("type")
+            if element_type in CHOICE_TYPES:
+                for choice in value if isinstance(value, list) else [value]:
+                    if isinstance(choice, (str, int, float, bool)):
+                        self._count((name, "choice", token(choice)))
+            elif element_type in MATRIX_TYPES and isinstance(value, dict):
+                for row, answer in value.items():
+                    if isinstance(answer, dict):
+                        for column, cell in answer.items():
+                            if isinstance(cell, (str, int, float, bool)):
+                                key = (name, "cell", row, column, token(cell))
+                                self._count(key)
+                    elif isinstance(answer, (str, int, float, bool)):
+                        self._count((name, "row", row, token(answer)))
+
+            if is_number(value):
+                self._count((name, "sum"), value)
+                self._count((name, "bucket", histogram_bucket(value)))
+                self._extremum((name, "min"), "min", value)
+                self._extremum((name, "max"), "max", value)
+
+    def activity(self, since):
+        """`(hour, submissions)` of the hours from the hour `since` on"""
+        if self._hours is None:
+            return []
+        return [(hour, counter()) for hour, counter in self._hours.items(min=since)]
+
+    def _value(self, key):
+        counter = self._counters.get(key)
+        return counter() if counter is not None else 0
+
+    def _items(self, prefix):
+        """Counters whose key starts with the tuple `prefix`"""
+        for key, counter in self._counters.items(min=prefix):
+            if key[: len(prefix)] != prefix:
+                break
+            yield key[len(prefix) :], counter()
+
+    def summary(self, form_json):
+        """Aggregates of all questions of `form_json` for dashboards"""
+        questions = []
+        for element in form_elements(form_json):
+            name = element["name"]
+            question = dict(
+                name=name,
+                type=element.get("type"),
+                title=element.get("title") or name,
+                answered=self._value((name, "answered")),
+                skipped=self._value((name, "skipped")),
+            )
+
+            if element.get("type") in CHOICE_TYPES:
+                counts = dict(
+                    (key[0], count) for key, count in self._items((name, "choice"))
+                )
+                choices = [choice_value(c) for c in element.get("choices") or ()]
+                # configured choices in form order, then everything else seen
+                question["choices"] = [
+                    dict(value=choice, count=counts.pop(token(choice), 0))
+                    for choice in choices
+                ] + [
+                    dict(value=key, count=count) for key, count in sorted(counts.items())
+                ]
+
+            if element.get("type") in MATRIX_TYPES:
+                rows = {}
+                for key, count in self._items((name, "row")):
+                    rows.setdefault(key[0], {})[key[1]] = count
+                for key, count in self._items((name, "cell")):
+                    row = rows.setdefault(key[0], {})
+                    row.setdefault(key[1], {})[key[2]] = count
+                question["rows"] = rows
+
+            numeric_count = sum(count for _, count in self._items((name, "bucket")))
+            if numeric_count:
+                total = self._value((name, "sum"))
+                question["numeric"] = dict(
+                    count=numeric_count,
+                    sum=total,
+                    mean=total / numeric_count,
+                    min=self._extrema[(name, "min")].value,
+                    max=self._extrema[(name, "max")].value,
+                    histogram=[
+                        dict(bucket=key[0], count=count)
+                        for key, count in self._items((name, "bucket"))
+                    ],
+                )
+
+            questions.append(question)
+
+        return dict(responses=self.responses(), questions=questions)
+
+
+def get_stats(context):
+    """Return the `SurveyStats` of a survey.
+
+    Surveys without aggregates get them computed once from the stored
+    results and the current form.
+    """
+    annos = IAnnotations(context)
+    stats = annos.get(STATS_KEY)
+    if stats is None:
+        stats = annos[STATS_KEY] = SurveyStats()
+        form_json = get_current_form_json(context)
+        for data in get_results(context).values(reverse=False):
+            stats.add(data["result"], form_json, data["created"])
+    return stats
+
+
+def clear_stats(context):
+    """Reset the aggregates of a survey"""
+    IAnnotations(context)[STATS_KEY] = SurveyStats()
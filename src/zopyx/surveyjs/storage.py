@@ -0,0 +1,1094 @@
+# -*- coding: utf-8 -*-
+"""Persistent storage for form versions and poll results."""
+
+from .interfaces import IResultStorage
+from .patches import apply_patch
+from .patches import make_patch
+from BTrees.IOBTree import IOBTree
+from BTrees.Length import Length
+from BTrees.LLBTree import LLBTree
+from BTrees.LOBTree import LOBTree
+from BTrees.OIBTree import OIBTree
+from BTrees.OLBTree import OLBTree
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from itertools import islice
+from operator import itemgetter
+from persistent import Persistent
+from persistent.mapping import PersistentMapping
+from zope.annotation.interfaces import IAnnotations
+from zope.component import getAdapter
+from zope.component.hooks import getSite
+from zope.interface import implementer
+
+import base64
+import hashlib
+import heapq
+import orjson
+import sys
+import uuid
+import zlib
+
+
+RESULTS_KEY = "zopyx.surveyjs.results"
+FORM_VERSIONS_KEY = "zopyx.surveyjs.form_versions"
+
+# Site-wide store of form bodies, see `FormStore`
+FORM_STORE_KEY = "zopyx.surveyjs.form_store"
+
+# Container taking the results of a survey while `compact_results` moves
+# its legacy records, see `LegacyResults`
+COMPACTING_KEY = "zopyx.surveyjs.results.compacting"
+
+# Sealed months of results, see `archives.ResultArchives`
+ARCHIVES_KEY = "zopyx.surveyjs.results.archives"
+
+# Name of the `IResultStorage` backend of a survey
+RESULT_STORAGE_KEY = "zopyx.surveyjs.result_storage"
+DEFAULT_RESULT_STORAGE = "annotation"
+
+# Name of the backend `move_results` is moving the results out of
+MOVING_KEY = "zopyx.surveyjs.result_storage.moving"
+
+# Number of result shards for new surveys
+NUM_SHARDS = 16
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Positions in the user index, see `CompactResultShard`
+POSITION_MASK = (1 << 64) - 1
+
+# Strings of results up to this length are interned, see `intern_strings`
+INTERN_LENGTH = 64
+
+# Every n-th form version is stored in full, see `FormVersions`
+SNAPSHOT_INTERVAL = 10
+
+# Result positions are `date_key * SLOTS + slot`, see `position`. The
+# number of shards of a container must divide SLOTS.
+SLOTS = 1024
+
+
+def ensure_timezone_aware(dt):
+    """Convert naive datetime to UTC-aware datetime"""
+    if dt.tzinfo is None or dt.tzinfo.utcoffset(dt) is None:
+        # Naive datetime - assume it's UTC
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def normalize_user(user):
+    """Key of a user id in the user index (anonymous users map to "")"""
+    return (user or "").strip().lower()
+
+
+def date_key(dt):
+    """Sortable integer key (microseconds since the epoch) for a datetime"""
+    delta = ensure_timezone_aware(dt) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def poll_slot(poll_id):
+    """Stable hash slot (`0 <= slot < SLOTS`) of a poll id"""
+    return zlib.crc32(poll_id.encode("utf-8")) % SLOTS
+
+
+def position(data):
+    """The position of a result record in submission order.
+
+    A 64 bit integer combining the submission time (microseconds since the
+    epoch) with the hash slot of the `poll_id`, so records submitted in the
+    same microsecond still get distinct positions.
+    """
+    return date_key(data["created"]) * SLOTS + poll_slot(data["poll_id"])
+
+
+def poll_key(poll_id):
+    """Compact integer key of a poll id.
+
+    Canonical UUIDs (as generated by `save_poll`) map to their 128 bit
+    value, any other id to a negative number derived from its bytes.
+    """
+    try:
+        key = uuid.UUID(poll_id)
+    except ValueError:
+        key = None
+    if key is not None and str(key) == poll_id:
+        return key.int
+    return -(int.from_bytes(poll_id.encode("utf-8"), "big") + 1)
+
+
+def poll_id_of(key):
+    """The poll id of a `poll_key`"""
+    if key >= 0:
+        return str(uuid.UUID(int=key))
+    key = -key - 1
+    return key.to_bytes((key.bit_length() + 7) // 8, "big").decode("utf-8")
+
+
+def poll_hash(poll_id):
+    """64 bit hash of a poll id, see `CompactResultShard`"""
+    digest = hashlib.blake2b(poll_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def form_hash(form_json):
+    """SHA-256 of the canonical JSON (sorted keys) of a form definition"""
+    data = orjson.dumps(form_json, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(data).hexdigest()
+
+
+class FormBody(Persistent):
+    """A form definition stored once and referenced by form versions"""
+
+    def __init__(self, form_json, key=None):
+        self.form_json = form_json
+        self.key = key or form_hash(form_json)
+        self.refs = Length()
+
+
+class FormStore(Persistent):
+    """Site-wide content-addressed store of form bodies.
+
+    Bodies are keyed by their `form_hash`, so identical forms (restored
+    versions, surveys cloned from the same template) are stored once.
+    Every holder of a body (see `FormVersions`) counts as a reference;
+    bodies nobody references any more are dropped from the index and
+    removed by the next pack once no version refers to them.
+    """
+
+    def __init__(self):
+        self._bodies = OOBTree()
+
+    def put(self, form_json):
+        """Return the body of `form_json` and add a reference to it"""
+        key = form_hash(form_json)
+        body = self._bodies.get(key)
+        if body is None:
+            body = self._bodies[key] = FormBody(form_json, key)
+        body.refs.change(1)
+        return body
+
+    def release(self, body):
+        """Drop a reference to a body"""
+        body.refs.change(-1)
+        if body.refs() <= 0 and self._bodies.get(body.key) is body:
+            del self._bodies[body.key]
+
+    def get(self, key, default=None):
+        return self._bodies.get(key, default)
+
+    def __len__(self):
+        return len(self._bodies)
+
+
+class PrivateFormStore(object):
+    """Stand-in for `FormStore` storing every body on its own"""
+
+    def put(self, form_json):
+        return FormBody(form_json)
+
+    def release(self, body):
+        pass
+
+
+def get_form_store(site=None):
+    """Return the `FormStore` of the (current) site"""
+    annos = IAnnotations(site if site is not None else getSite())
+    store = annos.get(FORM_STORE_KEY)
+    if store is None:
+        store = annos[FORM_STORE_KEY] = FormStore()
+    return store
+
+
+class FormVersions(Persistent):
+    """Form versions of a survey.
+
+    Every version is its own persistent object and the container keeps a
+    pointer to the current version and its form body, so rendering a
+    survey only loads those and never touches the rest of the history.
+
+    Form bodies live in a `FormStore`. Older versions are stored as JSON
+    patches (see `patches`) against their predecessor. Every
+    `SNAPSHOT_INTERVAL`-th version of a chain, and every version whose
+    patch would not be smaller than the form itself, references its full
+    body instead, so `get` applies at most `SNAPSHOT_INTERVAL - 1` patches
+    to reconstruct a version.
+    """
+
+    _current_body = None
+
+    def __init__(self, versions=None):
+        self._versions = OOBTree()
+        self.current_id = None
+        self._current = None
+        if versions:
+            for data in sorted(
+                versions.values(), key=lambda x: ensure_timezone_aware(x["created"])
+            ):
+                # legacy histories are kept completely, repeated forms included
+                self._store(data, PrivateFormStore())
+
+    def add(self, data, store=None):
+        """Store a new version and make it the current one.
+
+        Form bodies are shared through `store` (a `FormStore`). Adding a
+        form identical to the current one is a no-op returning the
+        current version.
+        """
+        previous = self.current
+        if previous is not None:
+            if self._current_body is not None:
+                current_key = self._current_body.key
+            else:
+                current_key = form_hash(previous["form_json"])
+            if form_hash(data["form_json"]) == current_key:
+                return previous
+        return self._store(data, store if store is not None else PrivateFormStore())
+
+    def _store(self, data, store):
+        form_json = data["form_json"]
+        previous = self.current
+        metadata = dict((k, v) for k, v in data.items() if k != "form_json")
+        version = PersistentMapping(metadata)
+        if previous is not None and previous["id"] in self._versions:
+            depth = self._versions[previous["id"]].get("depth", 0) + 1
+            if depth < SNAPSHOT_INTERVAL:
+                patch = make_patch(previous["form_json"], form_json)
+                if len(orjson.dumps(patch)) < len(orjson.dumps(form_json)):
+                    version.update(parent=previous["id"], depth=depth, patch=patch)
+
+        # the current pointer and snapshots each hold a reference
+        body = store.put(form_json)
+        if "patch" not in version:
+            version.update(depth=0, body=store.put(form_json))
+        self._versions[version["id"]] = version
+
+        if self._current_body is not None:
+            store.release(self._current_body)
+        self.current_id = version["id"]
+        self._current = PersistentMapping(metadata)
+        self._current_body = body
+        return self.current
+
+    @property
+    def current(self):
+        """The current version or `None`"""
+        if self._current_body is None:
+            # versions stored before form bodies existed
+            return self._current
+        return dict(self._current, form_json=self._current_body.form_json)
+
+    def _form_json(self, version):
+        patches = []
+        while "patch" in version:
+            patches.append(version["patch"])
+            version = self._versions[version["parent"]]
+        if "body" in version:
+            form_json = version["body"].form_json
+        else:
+            form_json = version["form_json"]
+        for patch in reversed(patches):
+            form_json = apply_patch(form_json, patch)
+        return form_json
+
+    def get(self, version_id, default=None):
+        """The version `version_id` including its `form_json`"""
+        if not version_id:
+            return default
+        if version_id == self.current_id:
+            return self.current
+        version = self._versions.get(version_id)
+        if version is None:
+            return default
+        data = dict(
+            (k, v)
+            for k, v in version.items()
+            if k not in ("patch", "parent", "depth", "body")
+        )
+        data["form_json"] = self._form_json(version)
+        return data
+
+    def __contains__(self, version_id):
+        return version_id in self._versions
+
+    def __len__(self):
+        return len(self._versions)
+
+    def values(self):
+        """All versions sorted by date (newest first).
+
+        Versions don't necessarily carry their `form_json`, use `get` to
+        reconstruct it.
+        """
+        return sorted(
+            self._versions.values(),
+            key=lambda x: ensure_timezone_aware(x["created"]),
+            reverse=True,
+        )
+
+
+class LegacyFormVersions(object):
+    """The form versions of a survey created before `FormVersions` existed.
+
+    These surveys keep their versions in a plain `OOBTree` keyed by version
+    id (or have none at all) until the `convert_form_versions` upgrade step
+    converts them. Reads sort the legacy versions in memory and never write,
+    so public views stay read-only. Adding a version converts the history
+    first.
+    """
+
+    def __init__(self, annotations):
+        self.annotations = annotations
+
+    @property
+    def legacy(self):
+        legacy = self.annotations.get(FORM_VERSIONS_KEY)
+        return legacy if legacy is not None else {}
+
+    def _sorted(self):
+        return sorted(
+            self.legacy.values(), key=lambda x: ensure_timezone_aware(x["created"])
+        )
+
+    def add(self, data, store=None):
+        versions = self.annotations[FORM_VERSIONS_KEY] = FormVersions(self.legacy)
+        return versions.add(data, store)
+
+    @property
+    def current(self):
+        versions = self._sorted()
+        return dict(versions[-1]) if versions else None
+
+    @property
+    def current_id(self):
+        current = self.current
+        return current["id"] if current is not None else None
+
+    def get(self, version_id, default=None):
+        data = self.legacy.get(version_id) if version_id else None
+        return dict(data) if data is not None else default
+
+    def __contains__(self, version_id):
+        return version_id in self.legacy
+
+    def __len__(self):
+        return len(self.legacy)
+
+    def values(self):
+        """All versions sorted by date (newest first)"""
+        return self._sorted()[::-1]
+
+
+def intern_strings(value):
+    """A copy of a JSON value with its dict keys and short strings (e.g.
+    choices) interned, so the pickle of a bucket stores each of them once"""
+    if isinstance(value, dict):
+        return dict((intern_strings(k), intern_strings(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [intern_strings(v) for v in value]
+    if isinstance(value, str) and len(value) <= INTERN_LENGTH:
+        return sys.intern(value)
+    return value
+
+
+class UserTable(Persistent):
+    """User ids interned as integer refs, shared by the shards of a
+    `ResultContainer`.
+
+    Every normalized user id gets one ref (0 is the anonymous user). The
+    ref is derived from a hash of the id, so concurrent submissions of new
+    users write different keys and don't conflict. `_users` keeps the first
+    user id seen for a ref, `_refs` the refs by normalized user id for
+    prefix searches.
+    """
+
+    def __init__(self):
+        self._users = IOBTree()
+        self._refs = OIBTree()
+
+    def ref(self, user):
+        """The ref of `user`, interning it if needed"""
+        key = normalize_user(user)
+        if not key:
+            return 0
+        ref = self._refs.get(key)
+        if ref is None:
+            ref = zlib.crc32(key.encode("utf-8")) & 0x7FFFFFFF or 1
+            while ref in self._users:
+                ref = ref % 0x7FFFFFFF + 1
+            self._users[ref] = user
+            self._refs[key] = ref
+        return ref
+
+    def find(self, user):
+        """The ref of a normalized user id or `None`"""
+        return 0 if user == "" else self._refs.get(user)
+
+    def user(self, ref):
+        """The user id interned as `ref`"""
+        return self._users[ref] if ref else None
+
+    def items(self, prefix=""):
+        """Iterate over `(normalized user, ref)` starting with `prefix`"""
+        if not prefix:
+            yield "", 0
+        for user, ref in self._refs.items(prefix):
+            if not user.startswith(prefix):
+                return
+            yield user, ref
+
+
+class CompactResultShard(Persistent):
+    """A slice of the results of a survey in a compact record format.
+
+    Records are stored by their `position` in an `LOBTree` as tuples of
+    `(poll_key, user_ref, result)`. The submission time is part of the
+    position, which also orders the tree. User ids are interned in the
+    `UserTable` of the container; a record whose user id differs from the
+    one interned (e.g. in case) carries it as a fourth item. Indexes:
+
+    - `_by_user`: `user_ref << 64 | position` integers, one range per user
+    - `_ids`: `poll_hash` to position, for lookups by `poll_id`. The few
+      poll ids whose hash is taken by another record of the shard are kept
+      in `_id_overflow` by their `poll_key`.
+
+    A record whose position is taken already is moved by a microsecond.
+    """
+
+    _id_overflow = None
+
+    def __init__(self, users):
+        self._records = LOBTree()
+        self._by_user = OOTreeSet()
+        self._ids = LLBTree()
+        self._users = users
+
+    def add(self, data):
+        pos = position(data)
+        while pos in self._records:
+            pos += SLOTS
+        user = data["user"]
+        ref = self._users.ref(user)
+        record = (poll_key(data["poll_id"]), ref, intern_strings(data["result"]))
+        if user != self._users.user(ref):
+            record += (user,)
+        self._records[pos] = record
+        self._by_user.insert(ref << 64 | pos)
+        key = poll_hash(data["poll_id"])
+        taken = self._ids.get(key)
+        if taken is None or self._records[taken][0] == record[0]:
+            self._ids[key] = pos
+        else:
+            if self._id_overflow is None:
+                self._id_overflow = OLBTree()
+            self._id_overflow[record[0]] = pos
+        return pos
+
+    def load(self, pos):
+        """The record at a position as a dict"""
+        record = self._records.get(pos)
+        if record is None:
+            return None
+        key, ref, result = record[:3]
+        user = record[3] if len(record) > 3 else self._users.user(ref)
+        return dict(
+            poll_id=poll_id_of(key),
+            created=EPOCH + timedelta(microseconds=pos // SLOTS),
+            user=user,
+            result=result,
+        )
+
+    def _position(self, poll_id):
+        key = poll_key(poll_id)
+        pos = self._ids.get(poll_hash(poll_id))
+        if pos is not None and self._records[pos][0] == key:
+            return pos
+        if self._id_overflow is not None:
+            return self._id_overflow.get(key)
+        return None
+
+    def get(self, poll_id, default=None):
+        pos = self._position(poll_id)
+        if pos is None:
+            return default
+        return self.load(pos)
+
+    def remove(self, poll_id):
+        pos = self._position(poll_id)
+        if pos is None:
+            raise KeyError(poll_id)
+        key = poll_hash(poll_id)
+        if self._ids.get(key) == pos:
+            del self._ids[key]
+        else:
+            del self._id_overflow[poll_key(poll_id)]
+        ref = self._records.pop(pos)[1]
+        self._by_user.remove(ref << 64 | pos)
+
+    def index(self, reverse=True, tag=None, after=None):
+        """Iterate over `(position, ref, tag)` in submission order.
+
+        `ref` identifies the record for `load`. `after` is a position;
+        iteration starts right behind it in the requested direction.
+        """
+        if after is None:
+            keys = self._records.keys()
+        elif reverse:
+            keys = self._records.keys(max=after, excludemax=True)
+        else:
+            keys = self._records.keys(min=after, excludemin=True)
+        for pos in reversed(keys) if reverse else keys:
+            yield pos, pos, tag
+
+    def user_index(self, user, reverse=True, tag=None, after=None):
+        """Like `index` but restricted to the submissions of `user`"""
+        ref = self._users.find(user)
+        if ref is None:
+            return
+        low, high = ref << 64, (ref + 1) << 64
+        if after is not None and reverse:
+            high = low | after
+        elif after is not None:
+            low = low | after
+        keys = self._by_user.keys(
+            low, high, excludemin=after is not None, excludemax=True
+        )
+        for key in reversed(keys) if reverse else keys:
+            yield key & POSITION_MASK, key & POSITION_MASK, tag
+
+    def has_user(self, ref):
+        """Whether the user interned as `ref` has records in this shard"""
+        try:
+            return self._by_user.minKey(ref << 64) < (ref + 1) << 64
+        except ValueError:
+            return False
+
+
+@implementer(IResultStorage)
+class ResultContainer(Persistent):
+    """Poll results of a survey stored in the ZODB.
+
+    Submissions are spread over a fixed number of shards by a stable hash of
+    their `poll_id`. Concurrent `save_poll` transactions therefore mostly
+    write to different BTree buckets, which keeps bucket splits from
+    turning into `ConflictError` retries. The number of records is kept in
+    a conflict-resolving `Length`, user ids in one `UserTable`.
+
+    Reads merge the position-ordered record trees of all shards, so
+    newest-first and oldest-first reads stay range scans that only load
+    the buckets of the records returned.
+    """
+
+    def __init__(self, num_shards=NUM_SHARDS):
+        if SLOTS % num_shards:
+            raise ValueError(f"The number of shards must divide {SLOTS}")
+        self._users = UserTable()
+        self._shards = tuple(
+            CompactResultShard(self._users) for _ in range(num_shards)
+        )
+        self._length = Length()
+
+    def _shard(self, poll_id):
+        return self._shards[poll_slot(poll_id) % len(self._shards)]
+
+    def add(self, data):
+        """Store a new result record and return its position"""
+        pos = self._shard(data["poll_id"]).add(data)
+        self._length.change(1)
+        return pos
+
+    def get(self, poll_id, default=None):
+        if not poll_id:
+            return default
+        return self._shard(poll_id).get(poll_id, default)
+
+    def __contains__(self, poll_id):
+        return self.get(poll_id) is not None
+
+    def __len__(self):
+        return self._length()
+
+    def remove(self, poll_id):
+        """Drop the record with `poll_id`, raises `KeyError` if missing"""
+        self._shard(poll_id).remove(poll_id)
+        self._length.change(-1)
+
+    def clear(self):
+        self._users = UserTable()
+        self._shards = tuple(CompactResultShard(self._users) for _ in self._shards)
+        self._length.set(0)
+
+    def _index(self, reverse=True, after=None, users=None):
+        if users is None:
+            streams = (
+                shard.index(reverse, tag=i, after=after)
+                for i, shard in enumerate(self._shards)
+            )
+        else:
+            streams = (
+                shard.user_index(user, reverse, tag=i, after=after)
+                for i, shard in enumerate(self._shards)
+                for user in users
+            )
+        return heapq.merge(*streams, reverse=reverse)
+
+    def users(self, prefix=""):
+        """Sorted distinct (normalized) users starting with `prefix`"""
+        return [
+            user
+            for user, ref in self._users.items(prefix)
+            if any(shard.has_user(ref) for shard in self._shards)
+        ]
+
+    def positions(self, reverse=True, after=None, users=None):
+        """Iterate over the positions (see `position`) of all records.
+
+        Walks the indexes only, no records are loaded.
+        """
+        for pos, _, _ in self._index(reverse, after, users):
+            yield pos
+
+    def values(self, reverse=True, start=0, limit=None, after=None, users=None):
+        """Iterate over result records in submission order.
+
+        `reverse=True` returns the newest records first. `after` is a
+        position (see `position`) to continue from. `users` restricts the
+        records to those of the given normalized user ids (see `users`)
+        using the user index.
+
+        Only the records in the requested `start`/`limit` window are
+        loaded, so fetching a page behind a position costs the same
+        wherever the position is.
+        """
+        shards = self._shards
+        stop = start + limit if limit is not None else None
+        index = self._index(reverse, after, users)
+        for _, ref, i in islice(index, start, stop):
+            yield shards[i].load(ref)
+
+
+def merge_archived(live, archived, last, reverse):
+    """Merge `(position, ...)` streams of live and archived records.
+
+    Archives hold sealed months, which are older than almost all live
+    records. Newest first, the archives are only opened once the live
+    records reach `last`, the newest archived position, so reading recent
+    pages never decompresses an archive.
+    """
+    key = itemgetter(0)
+    if not reverse:
+        yield from heapq.merge(live, archived, key=key)
+        return
+    live = iter(live)
+    for item in live:
+        if item[0] < last:
+            yield from heapq.merge([item], live, archived, key=key, reverse=True)
+            return
+        yield item
+    yield from archived
+
+
+@implementer(IResultStorage)
+class ArchivedResults(object):
+    """The results of a survey including its sealed archives.
+
+    Wraps the live `IResultStorage` of a survey and its `ResultArchives`
+    (see `archives`). New records go to the live storage, reads merge both
+    in submission order. Archived records can't be removed.
+    """
+
+    def __init__(self, live, archives):
+        self.live = live
+        self.archives = archives
+
+    def add(self, data):
+        return self.live.add(data)
+
+    def get(self, poll_id, default=None):
+        data = self.live.get(poll_id)
+        if data is None:
+            data = self.archives.get(poll_id)
+        return default if data is None else data
+
+    def __contains__(self, poll_id):
+        return poll_id in self.live or poll_id in self.archives
+
+    def __len__(self):
+        return len(self.live) + len(self.archives)
+
+    def remove(self, poll_id):
+        self.live.remove(poll_id)
+
+    def _items(self, reverse, after, users):
+        live = zip(
+            self.live.positions(reverse, after=after, users=users),
+            self.live.values(reverse, after=after, users=users),
+        )
+        archived = self.archives.items(reverse, after=after, users=users)
+        return merge_archived(live, archived, self.archives.last, reverse)
+
+    def values(self, reverse=True, start=0, limit=None, after=None, users=None):
+        stop = start + limit if limit is not None else None
+        for _, data in islice(self._items(reverse, after, users), start, stop):
+            yield data
+
+    def positions(self, reverse=True, after=None, users=None):
+        live = ((pos,) for pos in self.live.positions(reverse, after, users))
+        archived = self.archives.items(reverse, after=after, users=users)
+        for item in merge_archived(live, archived, self.archives.last, reverse):
+            yield item[0]
+
+    def users(self, prefix=""):
+        return sorted(set(self.live.users(prefix)).union(self.archives.users(prefix)))
+
+    def clear(self):
+        self.live.clear()
+        self.archives.clear()
+
+
+@implementer(IResultStorage)
+class MovingResults(object):
+    """The results of a survey while `move_results` moves them.
+
+    New records go to the backend the results are moved into (`current`),
+    reads merge it with the backend they are moved out of (`previous`) in
+    submission order.
+    """
+
+    def __init__(self, current, previous):
+        self.current = current
+        self.previous = previous
+
+    def add(self, data):
+        return self.current.add(data)
+
+    def get(self, poll_id, default=None):
+        data = self.current.get(poll_id)
+        if data is None:
+            data = self.previous.get(poll_id)
+        return default if data is None else data
+
+    def __contains__(self, poll_id):
+        return poll_id in self.current or poll_id in self.previous
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+    def remove(self, poll_id):
+        if poll_id in self.current:
+            self.current.remove(poll_id)
+        else:
+            self.previous.remove(poll_id)
+
+    def _items(self, reverse, after, users):
+        streams = (
+            zip(
+                results.positions(reverse, after=after, users=users),
+                results.values(reverse, after=after, users=users),
+            )
+            for results in (self.current, self.previous)
+        )
+        return heapq.merge(*streams, key=itemgetter(0), reverse=reverse)
+
+    def values(self, reverse=True, start=0, limit=None, after=None, users=None):
+        stop = start + limit if limit is not None else None
+        for _, data in islice(self._items(reverse, after, users), start, stop):
+            yield data
+
+    def positions(self, reverse=True, after=None, users=None):
+        for pos, _ in self._items(reverse, after, users):
+            yield pos
+
+    def users(self, prefix=""):
+        users = set(self.current.users(prefix))
+        return sorted(users.union(self.previous.users(prefix)))
+
+    def clear(self):
+        self.current.clear()
+        self.previous.clear()
+
+
+@implementer(IResultStorage)
+class LegacyResults(object):
+    """The results of a survey created before `ResultContainer` existed.
+
+    These surveys keep their records in a plain `OOBTree` keyed by
+    `poll_id` until the `compact_results` upgrade step moves them into a
+    `ResultContainer` kept under `COMPACTING_KEY`. New records go to that
+    container right away, so requests never convert the tree and don't
+    write to it while the upgrade step empties it. Reads sort the legacy
+    records in memory and merge them with the container.
+    """
+
+    def __init__(self, annotations):
+        self.annotations = annotations
+
+    @property
+    def legacy(self):
+        return self.annotations[RESULTS_KEY]
+
+    @property
+    def container(self):
+        return self.annotations.get(COMPACTING_KEY)
+
+    def add(self, data):
+        container = self.container
+        if container is None:
+            container = self.annotations[COMPACTING_KEY] = ResultContainer()
+        return container.add(data)
+
+    def get(self, poll_id, default=None):
+        data = self.legacy.get(poll_id) if poll_id else None
+        if data is None and self.container is not None:
+            data = self.container.get(poll_id)
+        return default if data is None else data
+
+    def __contains__(self, poll_id):
+        return self.get(poll_id) is not None
+
+    def __len__(self):
+        container = self.container
+        return len(self.legacy) + (len(container) if container is not None else 0)
+
+    def remove(self, poll_id):
+        if poll_id in self.legacy:
+            del self.legacy[poll_id]
+        elif self.container is not None:
+            self.container.remove(poll_id)
+        else:
+            raise KeyError(poll_id)
+
+    def _items(self, reverse, after, users):
+        legacy = [
+            (position(data), data)
+            for data in self.legacy.values()
+            if users is None or normalize_user(data["user"]) in users
+        ]
+        if after is not None:
+            legacy = [
+                (pos, data)
+                for pos, data in legacy
+                if (pos < after if reverse else pos > after)
+            ]
+        legacy.sort(key=itemgetter(0), reverse=reverse)
+        container = self.container
+        if container is None:
+            return iter(legacy)
+        current = zip(
+            container.positions(reverse, after=after, users=users),
+            container.values(reverse, after=after, users=users),
+        )
+        return heapq.merge(legacy, current, key=itemgetter(0), reverse=reverse)
+
+    def values(self, reverse=True, start=0, limit=None, after=None, users=None):
+        stop = start + limit if limit is not None else None
+        for _, data in islice(self._items(reverse, after, users), start, stop):
+            yield data
+
+    def positions(self, reverse=True, after=None, users=None):
+        for pos, _ in self._items(reverse, after, users):
+            yield pos
+
+    def users(self, prefix=""):
+        users = set(normalize_user(data["user"]) for data in self.legacy.values())
+        if self.container is not None:
+            users.update(self.container.users(prefix))
+        return sorted(user for user in users if user.startswith(prefix))
+
+    def clear(self):
+        self.annotations[RESULTS_KEY] = ResultContainer()
+        self.annotations.pop(COMPACTING_KEY, None)
+
+
+def encode_cursor(position):
+    """Opaque pagination cursor for a result position"""
+    data = base64.urlsafe_b64encode(orjson.dumps(position))
+    return data.rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Result position of a cursor, raises `ValueError` if it is invalid"""
+    try:
+        data = cursor.encode("ascii")
+        data += b"=" * (-len(data) % 4)
+        pos = orjson.loads(base64.urlsafe_b64decode(data))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(pos, int) or isinstance(pos, bool) or pos < 0:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return pos
+
+
+def get_form_versions(context):
+    """Return the `FormVersions` of a survey.
+
+    Surveys created before the container existed keep their versions in a
+    plain `OOBTree`, served by `LegacyFormVersions` until the
+    `convert_form_versions` upgrade step converts them.
+    """
+    annos = IAnnotations(context)
+    versions = annos.get(FORM_VERSIONS_KEY)
+    if isinstance(versions, FormVersions):
+        return versions
+    return LegacyFormVersions(annos)
+
+
+def convert_form_versions(context):
+    """Convert the legacy version history of a survey into `FormVersions`.
+
+    Returns the number of converted versions, `None` if the survey needs
+    no conversion.
+    """
+    annos = IAnnotations(context)
+    legacy = annos.get(FORM_VERSIONS_KEY)
+    if isinstance(legacy, FormVersions):
+        return None
+    versions = annos[FORM_VERSIONS_KEY] = FormVersions(legacy)
+    return len(versions)
+
+
+def get_current_form_json(context):
+    """The `form_json` of the current version of a survey (or `{}`)"""
+    current = get_form_versions(context).current
+    return current["form_json"] if current is not None else {}
+
+
+def annotation_results(context):
+    """`IResultStorage` adapter storing results in an annotation (default).
+
+    Surveys created before the container existed keep their results in a
+    plain `OOBTree`, served by `LegacyResults` until the `compact_results`
+    upgrade step converts them.
+    """
+    annos = IAnnotations(context)
+    results = annos.get(RESULTS_KEY)
+    if results is None:
+        results = annos[RESULTS_KEY] = ResultContainer()
+    elif not isinstance(results, ResultContainer):
+        results = LegacyResults(annos)
+    return results
+
+
+def result_storage_name(context):
+    """Name of the `IResultStorage` backend of a survey"""
+    return IAnnotations(context).get(RESULT_STORAGE_KEY, DEFAULT_RESULT_STORAGE)
+
+
+def get_live_results(context):
+    """The `IResultStorage` backend of a survey, without its archives.
+
+    While `move_results` is moving the results, a `MovingResults` reading
+    both backends.
+    """
+    results = getAdapter(context, IResultStorage, name=result_storage_name(context))
+    previous = IAnnotations(context).get(MOVING_KEY)
+    if previous is not None:
+        results = MovingResults(
+            results, getAdapter(context, IResultStorage, name=previous)
+        )
+    return results
+
+
+def get_results(context):
+    """Return the result storage (`IResultStorage`) of a survey.
+
+    Surveys with sealed archives get an `ArchivedResults` reading the
+    live backend and the archives.
+    """
+    results = get_live_results(context)
+    archives = IAnnotations(context).get(ARCHIVES_KEY)
+    if archives is not None and len(archives):
+        return ArchivedResults(results, archives)
+    return results
+
+
+def clear_results(context):
+    """Drop all results of a survey"""
+    get_results(context).clear()
+    IAnnotations(context).pop(COMPACTING_KEY, None)
+
+
+def move_results(context, name, batch_size=1000, on_batch=None):
+    """Move the results of a survey into the storage backend `name`.
+
+    The survey switches to the new backend first, so new submissions are
+    stored there, and reads include the old backend (see `MovingResults`)
+    until its records are moved. They are moved oldest first in batches of
+    `batch_size` and removed from the old backend, which is checked again
+    until it is empty. `on_batch` is called after the switch and after
+    every batch (e.g. to commit); an interrupted move resumes when moving
+    into `name` again. Sealed archives are kept as they are. Returns the
+    number of moved records.
+    """
+    annos = IAnnotations(context)
+    previous = annos.get(MOVING_KEY)
+    if previous is None:
+        previous = result_storage_name(context)
+        if name == previous:
+            return 0
+        annos[RESULT_STORAGE_KEY] = name
+        annos[MOVING_KEY] = previous
+        if on_batch is not None:
+            on_batch()
+    elif name != result_storage_name(context):
+        raise ValueError(
+            f"The results are being moved into {result_storage_name(context)}"
+        )
+
+    source = getAdapter(context, IResultStorage, name=previous)
+    target = getAdapter(context, IResultStorage, name=name)
+    moved = 0
+    while True:
+        batch = list(source.values(reverse=False, limit=batch_size))
+        if not batch:
+            break
+        for data in batch:
+            if data["poll_id"] not in target:
+                target.add(data)
+                moved += 1
+            source.remove(data["poll_id"])
+        if on_batch is not None:
+            on_batch()
+    del annos[MOVING_KEY]
+    return moved
+
+
+def compact_results(context, batch_size=1000, on_batch=None):
+    """Move the legacy results of a survey into a `ResultContainer`.
+
+    Surveys created before the container existed keep their records in a
+    plain `OOBTree` (see `LegacyResults`). Its records are moved
+    `batch_size` at a time into the container under `COMPACTING_KEY`,
+    which already takes new submissions. `on_batch` is called after every
+    batch (e.g. to commit), an interrupted run resumes with the records
+    left. The container replaces the emptied tree. Returns the number of
+    moved records.
+    """
+    annos = IAnnotations(context)
+    legacy = annos.get(RESULTS_KEY)
+    if legacy is None or isinstance(legacy, ResultContainer):
+        return 0
+
+    target = annos.get(COMPACTING_KEY)
+    if target is None:
+        target = annos[COMPACTING_KEY] = ResultContainer()
+    moved = 0
+    while True:
+        batch = list(islice(legacy.items(), batch_size))
+        if not batch:
+            break
+        for poll_id, data in batch:
+            if poll_id not in target:
+                target.add(data)
+                moved += 1
+            del legacy[poll_id]
+        if on_batch is not None:
+            on_batch()
+
+    annos[RESULTS_KEY] = target
+    del annos[COMPACTING_KEY]
+    return moved
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""Storing poll submissions, synchronously or through a write-behind spool.
+
+With spooling enabled (`spool_submissions` in the Forms control panel),
+`save_poll` appends each submission to a local append-only spool file and
+acknowledges it right away. A background worker moves the spooled
+submissions into the result containers in batched transactions.
+
+Crash recovery: a spool file is only deleted once all of its submissions
+are committed. Files left behind by a crash are drained again when the
+worker starts; submissions whose `poll_id` is already stored are skipped,
+so every submission is stored exactly once. A partially written last line
+(crash during `append`) belongs to a submission that was never
+acknowledged and is ignored. Submissions failing to store are logged and
+kept in a `<timestamp>.rejected` file; renaming it to `.ready` spools
+them again.
+
+Every Zope instance needs its own spool directory
+(`ZOPYX_SURVEYJS_SPOOL_DIR`, default `<clienthome>/zopyx.surveyjs-spool`).
+"""
+
+from .attachments import extract_attachments
+from .catalog import queue_reindex
+from .catalog import ReindexQueue
+from .stats import get_stats
+from .storage import get_current_form_json
+from .storage import get_results
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+from ZODB.POSException import ConflictError
+
+import logging
+import orjson
+import os
+import threading
+import time
+import transaction
+
+
+LOG = logging.getLogger("zopyx.surveyjs")
+
+# Submissions stored per transaction when draining the spool
+BATCH_SIZE = 200
+
+# Seconds between two runs of the spool worker
+DRAIN_INTERVAL = 2.0
+
+# Attempts to commit a batch before giving up on the current run
+RETRIES = 5
+
+
+def add_submission(context, data):
+    """Store a submission in the results and the aggregates of a survey.
+
+    Uploaded files are moved into blobs, see `extract_attachments`. The
+    catalog metadata of the survey is updated later, see `catalog`.
+    """
+    result = extract_attachments(context, data["result"], data["poll_id"])
+    data = dict(data, result=result)
+    get_results(context).add(data)
+    form_json = get_current_form_json(context)
+    get_stats(context).add(data["result"], form_json, data["created"])
+    queue_reindex(context, get_reindex_queue())
+
+
+class SubmissionSpool(object):
+    """Append-only spool of poll submissions on local disk.
+
+    `append` writes to `active.ndjson`. `drain` renames the active file to
+    a `<timestamp>.ready` file and stores the submissions of all ready
+    files, `batch_size` submissions per transaction.
+    """
+
+    def __init__(self, directory, batch_size=BATCH_SIZE, fsync=True):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._fp = None
+
+    @property
+    def active_path(self):
+        return os.path.join(self.directory, "active.ndjson")
+
+    def append(self, path, data):
+        """Durably spool the submission `data` for the survey at `path`"""
+        line = orjson.dumps(dict(data, path=path)) + b"\n"
+        with self._lock:
+            if self._fp is None:
+                self._fp = open(self.active_path, "ab")
+            self._fp.write(line)
+            self._fp.flush()
+            if self.fsync:
+                os.fsync(self._fp.fileno())
+
+    def rotate(self):
+        """Turn the active spool file into a ready file"""
+        with self._lock:
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+            if os.path.exists(self.active_path):
+                if os.path.getsize(self.active_path):
+                    ready = os.path.join(self.directory, f"{time.time_ns()}.ready")
+                    os.rename(self.active_path, ready)
+                else:
+                    os.unlink(self.active_path)
+
+    def pending(self):
+        """Ready spool files, oldest first"""
+        names = sorted(
+            (n for n in os.listdir(self.directory) if n.endswith(".ready")),
+            key=lambda name: int(name.split(".")[0]),
+        )
+        return [os.path.join(self.directory, name) for name in names]
+
+    def __len__(self):
+        """Number of spooled submissions not stored yet"""
+        paths = self.pending() + [self.active_path]
+        count = 0
+        for path in paths:
+            if os.path.exists(path):
+                with open(path, "rb") as fp:
+                    count += sum(1 for _ in fp)
+        return count
+
+    def drain(self, open_root):
+        """Store all spooled submissions.
+
+        `open_root` is a context manager factory yielding the application
+        root, used to traverse to surveys by their physical path, on a
+        connection bound to the thread's transaction manager. Returns the
+        number of stored submissions.
+        """
+        with self._drain_lock:
+            self.rotate()
+            stored = 0
+            for path in self.pending():
+                stored += self._drain_file(path, open_root)
+                os.unlink(path)
+            return stored
+
+    def _entries(self, path):
+        """`(survey path, submission)` pairs of a spool file"""
+        with open(path, "rb") as fp:
+            for line in fp:
+                try:
+                    data = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    LOG.warning("Skipping incomplete spool entry in %s", path)
+                    continue
+                data["created"] = datetime.fromisoformat(data["created"])
+                yield data.pop("path"), data
+
+    def _drain_file(self, path, open_root):
+        stored = 0
+        entries = self._entries(path)
+        rejected = os.path.splitext(path)[0] + ".rejected"
+        while True:
+            batch = list(islice(entries, self.batch_size))
+            if not batch:
+                return stored
+            stored += self._store_batch(batch, open_root, rejected)
+
+    def _store_batch(self, batch, open_root, rejected_path):
+        """Store a batch of spooled submissions in one transaction.
+
+        Submissions failing to store (e.g. their survey is gone) are rolled
+        back on their own and appended to `rejected_path` after the commit,
+        in the format of the spool, so they don't block the ones after
+        them.
+        """
+        for attempt in range(RETRIES):
+            transaction.begin()
+            rejected = []
+            try:
+                with open_root() as root:
+                    stored = 0
+                    for path, data in batch:
+                        context = root.unrestrictedTraverse(path, None)
+                        if context is None:
+                            LOG.warning("Survey of spooled %s gone", data["poll_id"])
+                            rejected.append((path, data))
+                            continue
+                        if data["poll_id"] in get_results(context):
+                            continue
+                        savepoint = transaction.savepoint()
+                        try:
+                            add_submission(context, data)
+                        except ConflictError:
+                            raise
+                        except Exception:
+                            savepoint.rollback()
+                            LOG.exception(
+                                "Rejecting spooled submission %s", data["poll_id"]
+                            )
+                            rejected.append((path, data))
+                            continue
+                        stored += 1
+                    transaction.commit()
+            except ConflictError:
+                transaction.abort()
+                LOG.info("Conflict storing spooled submissions, retrying")
+                continue
+            except Exception:
+                transaction.abort()
+                raise
+            if rejected:
+                with open(rejected_path, "ab") as fp:
+                    for path, data in rejected:
+                        fp.write(orjson.dumps(dict(data, path=path)) + b"\n")
+            return stored
+        raise ConflictError("Too many conflicts storing spooled submissions")
+
+
+class SpoolWorker(threading.Thread):
+    """Background thread draining a `SubmissionSpool`"""
+
+    def __init__(self, spool, open_root, interval=DRAIN_INTERVAL):
+        super(SpoolWorker, self).__init__(name="zopyx.surveyjs-spool", daemon=True)
+        self.spool = spool
+        self.open_root = open_root
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.spool.drain(self.open_root)
+            except Exception:
+                LOG.exception("Draining the submission spool failed")
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+@contextmanager
+def zope_root():
+    """The Zope application root on a new ZODB connection"""
+    import Zope2
+
+    app = Zope2.app()
+    try:
+        yield app
+    finally:
+        app._p_jar.close()
+
+
+def spool_directory():
+    directory = os.environ.get("ZOPYX_SURVEYJS_SPOOL_DIR")
+    if not directory:
+        from App.config import getConfiguration
+
+        directory = os.path.join(
+            getConfiguration().clienthome, "zopyx.surveyjs-spool"
+        )
+    return directory
+
+
+_spool = None
+_worker = None
+_reindex_queue = None
+_lock = threading.Lock()
+
+
+def get_spool():
+    """The submission spool of this process, starting its worker"""
+    global _spool, _worker
+    with _lock:
+        if _spool is None:
+            _spool = SubmissionSpool(spool_directory())
+        if _worker is None or not _worker.is_alive():
+            _worker = SpoolWorker(_spool, zope_root)
+            _worker.start()
+    return _spool
+
+
+def get_reindex_queue():
+    """The catalog reindex queue of this process"""
+    global _reindex_queue
+    with _lock:
+        if _reindex_queue is None:
+            _reindex_queue = ReindexQueue(zope_root)
+    return _reindex_queue
+
+
+def drain_on_startup(event):
+    """Subscriber: drain spool files left behind by a previous process"""
+    directory = spool_directory()
+    if os.path.isdir(directory) and os.listdir(directory):
+        get_spool()
@@ -1,4 +1,8 @@
 # -*- coding: utf-8 -*-
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from OFS.SimpleItem import SimpleItem
 from plone.app.contenttypes.testing import PLONE_APP_CONTENTTYPES_FIXTURE
 from plone.app.robotframework.testing import REMOTE_LIBRARY_BUNDLE_FIXTURE
 from plone.app.testing import (
@@ -8,6 +12,13 @@ from plone.app.testing import (
     PloneSandboxLayer,
 )
 from plone.testing import z2
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import provideAdapter
+from zope.interface import implementer
+from zope.interface import Interface
+from zopyx.surveyjs.interfaces import IResultStorage
+from zopyx.surveyjs.storage import annotation_results
 
 import zopyx.surveyjs
 
@@ -51,3 +62,32 @@ ZOPYX_SURVEYJS_ACCEPTANCE_TESTING = FunctionalTesting(
     ),
     name="ZopyxSurveyjsLayer:AcceptanceTesting",
 )
+
+
+@implementer(IAttributeAnnotatable)
+class FakeSurvey(SimpleItem):
+    """Annotatable stand-in for a survey in tests without a Plone site"""
+
+    id = "survey"
+    reindexed = 0
+
+    def reindexObject(self, idxs=[]):
+        self.reindexed += 1
+
+
+def make_record(number, user="user", poll_id=None, unit=timedelta(minutes=1)):
+    """A result record answering `number`, submitted `number` units after
+    the start of 2024 (as `poll-<number>` unless `poll_id` is given)"""
+    created = datetime(2024, 1, 1, tzinfo=timezone.utc) + number * unit
+    return dict(
+        poll_id=poll_id or "poll-%d" % number,
+        created=created,
+        user=user,
+        result={"q": number},
+    )
+
+
+def provide_storage_adapters():
+    """Register attribute annotations and the default result storage"""
+    provideAdapter(AttributeAnnotations)
+    provideAdapter(annotation_results, (Interface,), IResultStorage, name="annotation")
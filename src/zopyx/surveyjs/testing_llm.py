@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""Deterministic offline LLM model for tests and benchmarks.
+
+`OfflineModel` answers the prompts of `browser.ai_generator` the way an
+`llm` model does, without any provider or network: generation prompts
+with a SurveyJS form built from the prompt, refinement prompts with a
+JSON patch or the complete form adding a question. Latency, chunking and
+failures are configurable, so runs are reproducible:
+
+    with install(OfflineModel(latency=0.2, failures=["invalid-json"])):
+        generate_form("A contact form", MODEL_ID)
+
+`install` serves the model from the `model_registry`, the llm module is
+not needed. Where llm is installed, `register_plugin` also registers the
+model as llm plugin (`llm -m surveyjs-offline`).
+"""
+
+from .browser.ai_generator import estimate_tokens
+from .browser.ai_generator import model_registry
+from contextlib import contextmanager
+
+import orjson
+import re
+import sys
+import threading
+import time
+import uuid
+
+
+try:
+    import llm
+except ImportError:
+    llm = None
+
+
+MODEL_ID = "surveyjs-offline"
+
+# Failures `OfflineModel` can inject, by name
+FAILURES = {
+    # the provider fails while streaming the answer
+    "error": None,
+    # an answer that is no JSON
+    "invalid-json": "Sorry, I can't help with that.",
+    # JSON that is no SurveyJS form
+    "invalid-form": '{"pages": []}',
+    # a JSON patch not matching the form
+    "invalid-patch": '[{"op": "remove", "path": "/pages/99"}]',
+}
+
+QUESTION_RE = re.compile(r'question:\s*"(.*?)"\s*\n\s*\n', re.S)
+FORM_RE = re.compile(r"form definition:\s*\n\s*(\{.*?\})\s*\n\s*\n", re.S)
+CHANGES_RE = re.compile(r'following changes:\s*\n\s*"(.*?)"\s*\n\s*\n', re.S)
+
+
+class OfflineError(Exception):
+    """Injected provider failure"""
+
+
+class Usage(object):
+    def __init__(self, input, output):
+        self.input = input
+        self.output = output
+
+
+def offline_form(title: str, questions: int = 0) -> dict:
+    """The SurveyJS form `OfflineModel` generates for `title`, with
+    `questions` extra text questions"""
+    elements = [
+        {
+            "type": "text",
+            "name": "uuid",
+            "visible": False,
+            "defaultValue": str(uuid.uuid5(uuid.NAMESPACE_URL, title)),
+        },
+        {"type": "text", "name": "created", "visible": False},
+        {"type": "text", "name": "firstname", "title": "First name"},
+        {
+            "type": "text",
+            "name": "lastname",
+            "title": "Last name",
+            "startWithNewLine": False,
+        },
+        {"type": "comment", "name": "comment", "title": title},
+        {
+            "type": "matrixdynamic",
+            "name": "items",
+            "title": "Items",
+            "columns": [{"name": "item"}, {"name": "quantity"}],
+            "rowCount": 1,
+        },
+    ]
+    for index in range(1, questions + 1):
+        elements.append(
+            {"type": "text", "name": f"question{index}", "title": f"Question {index}"}
+        )
+    return {"title": title, "pages": [{"name": "page1", "elements": elements}]}
+
+
+def refinement_element(form: dict, refinement: str) -> dict:
+    """The question `OfflineModel` adds to `form` for `refinement`"""
+    pages = form.get("pages") or [{}]
+    index = len(pages[0].get("elements") or ()) + 1
+    return {"type": "text", "name": f"refinement{index}", "title": refinement}
+
+
+class OfflineResponse(object):
+    """Answer of `OfflineModel`, iterating it streams the text in chunks"""
+
+    def __init__(self, model, prompt, text, error=None):
+        self.model = model
+        self.prompt = prompt
+        self._text = text
+        self._error = error
+        self._done = None
+
+    def __iter__(self):
+        model = self.model
+        if model.latency:
+            model.sleep(model.latency)
+        if self._error is not None:
+            raise OfflineError(self._error)
+        for start in range(0, len(self._text), model.chunk_size):
+            if start and model.chunk_delay:
+                model.sleep(model.chunk_delay)
+            yield self._text[start : start + model.chunk_size]
+
+    def text(self):
+        if self._done is None:
+            self._done = "".join(self)
+        return self._done
+
+    def usage(self):
+        return Usage(estimate_tokens(self.prompt), estimate_tokens(self._text))
+
+
+class OfflineModel(object):
+    """
+    LLM model answering without a provider.
+
+    Args:
+        latency: Seconds until the first chunk
+        chunk_size: Characters per streamed chunk
+        chunk_delay: Seconds between chunks
+        failures: Names of `FAILURES` (or None for a regular answer) used
+                  for the next model calls in turn
+        questions: Extra questions of generated forms
+        sleep: Called with the seconds to wait
+    """
+
+    model_id = MODEL_ID
+    key = None
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        chunk_size: int = 64,
+        chunk_delay: float = 0.0,
+        failures=(),
+        questions: int = 0,
+        sleep=time.sleep,
+    ):
+        for failure in failures:
+            if failure is not None and failure not in FAILURES:
+                raise ValueError(f"Unknown failure: {failure}")
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.failures = list(failures)
+        self.questions = questions
+        self.sleep = sleep
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    def answer(self, prompt: str) -> str:
+        """The regular answer to `prompt`"""
+        form = FORM_RE.search(prompt)
+        if form is None:
+            question = QUESTION_RE.search(prompt)
+            title = question.group(1) if question else prompt.strip()[:100]
+            return orjson.dumps(offline_form(title, self.questions)).decode("utf-8")
+
+        form = orjson.loads(form.group(1))
+        changes = CHANGES_RE.search(prompt)
+        element = refinement_element(form, changes.group(1) if changes else "")
+        if "RFC 6902" in prompt:
+            patch = [{"op": "add", "path": "/pages/0/elements/-", "value": element}]
+            return orjson.dumps(patch).decode("utf-8")
+        form["pages"][0].setdefault("elements", []).append(element)
+        return orjson.dumps(form).decode("utf-8")
+
+    def prompt(self, prompt, **options):
+        with self._lock:
+            self.prompts.append(prompt)
+            failure = self.failures.pop(0) if self.failures else None
+        if failure == "error":
+            return OfflineResponse(self, prompt, "", error="Injected provider error")
+        if failure is not None:
+            return OfflineResponse(self, prompt, FAILURES[failure])
+        return OfflineResponse(self, prompt, self.answer(prompt))
+
+
+@contextmanager
+def install(model, api_key=None):
+    """Serves `model` as its `model_id` from the `model_registry`, the
+    registry is cleared afterwards"""
+    model_registry.clear()
+    model_registry.add(model.model_id, model, api_key)
+    try:
+        yield model
+    finally:
+        model_registry.clear()
+
+
+if llm is not None:
+
+    class LLMOfflineModel(llm.Model):
+        """`OfflineModel` as llm plugin model"""
+
+        model_id = MODEL_ID
+        can_stream = True
+
+        def __init__(self, model=None):
+            self.offline = model or OfflineModel()
+
+        def execute(self, prompt, stream, response, conversation=None):
+            yield from self.offline.prompt(prompt.prompt)
+
+    @llm.hookimpl
+    def register_models(register):
+        register(LLMOfflineModel())
+
+
+def register_plugin():
+    """Registers this module as llm plugin providing `MODEL_ID`"""
+    from llm.plugins import pm
+
+    module = sys.modules[__name__]
+    if not pm.is_registered(module):
+        pm.register(module, name="zopyx.surveyjs.offline")
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from unittest import mock
+from zopyx.surveyjs.browser.ai_generator import GENERATE_PROMPT
+from zopyx.surveyjs.browser.ai_generator import GenerationCache
+from zopyx.surveyjs.browser.ai_generator import model_registry
+from zopyx.surveyjs.browser.ai_generator import ModelRegistry
+from zopyx.surveyjs.browser.ai_generator import normalize_prompt
+from zopyx.surveyjs.browser.ai_generator import settings_modified
+
+import os
+import sys
+import types
+import unittest
+
+
+class Clock(object):
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class GenerationCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = GenerationCache(maxsize=2, ttl=60, clock=self.clock)
+
+    def key(self, prompt, model_name="gpt-4o"):
+        return self.cache.key(prompt, model_name, GENERATE_PROMPT)
+
+    def test_normalize_prompt(self):
+        self.assertEqual(
+            normalize_prompt("  A Contact\nform \t please "), "a contact form please"
+        )
+
+    def test_key(self):
+        self.assertEqual(self.key("Contact form"), self.key(" contact   FORM\n"))
+        self.assertNotEqual(self.key("Contact form"), self.key("Contact form", "claude"))
+        self.assertNotEqual(
+            self.key("Contact form"),
+            self.cache.key("Contact form", "gpt-4o", GENERATE_PROMPT + "!"),
+        )
+
+    def test_hits_and_misses(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", "{}")
+        self.assertEqual(self.cache.get("a"), "{}")
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 1))
+
+    def test_lru_eviction(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("c"), 3)
+
+    def test_ttl(self):
+        self.cache.set("a", 1)
+        self.clock.now = 59
+        self.assertEqual(self.cache.get("a"), 1)
+        self.clock.now = 60
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+
+class FakeModel(object):
+    key = None
+
+
+class ModelRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.registry = ModelRegistry(settings_ttl=60, clock=self.clock)
+        self.lookups = []
+        self.model = FakeModel()
+        module = types.ModuleType("llm")
+        module.get_model = lambda name: self.lookups.append(name) or self.model
+        self.patch = mock.patch.dict(sys.modules, {"llm": module})
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def test_models(self):
+        environ = dict(os.environ)
+        model = self.registry.get("gpt-4o", "sk-1")
+        self.assertIs(self.registry.get("gpt-4o", "sk-1"), model)
+        self.assertEqual(self.lookups, ["gpt-4o"])
+        # the key is set on a copy of the llm model, not in the environment
+        self.assertEqual(model.key, "sk-1")
+        self.assertIsNone(self.model.key)
+        self.assertEqual(dict(os.environ), environ)
+
+        other = self.registry.get("gpt-4o", "sk-2")
+        self.assertIsNot(other, model)
+        self.assertEqual(other.key, "sk-2")
+        self.assertIsNone(self.registry.get("gpt-4o").key)
+        self.assertEqual(self.lookups, ["gpt-4o"] * 3)
+        self.assertEqual(self.registry.stats()["models"], 3)
+        self.assertNotIn("sk-1", repr(self.registry._models.keys()))
+
+    def test_settings(self):
+        load = mock.Mock(return_value=("gpt-4o", None))
+        self.assertEqual(self.registry.settings(load), ("gpt-4o", None))
+        self.assertEqual(self.registry.settings(load), ("gpt-4o", None))
+        self.assertEqual(load.call_count, 1)
+        self.clock.now = 60
+        self.registry.settings(load)
+        self.assertEqual(load.call_count, 2)
+
+        self.registry.get("gpt-4o")
+        self.registry.clear()
+        self.assertEqual(self.registry.stats(), dict(models=0, settings=0))
+
+    def test_settings_per_site(self):
+        first = mock.Mock(return_value=("gpt-4o", "sk-1"))
+        second = mock.Mock(return_value=("claude", "sk-2"))
+        self.assertEqual(self.registry.settings(first, "/a"), ("gpt-4o", "sk-1"))
+        self.assertEqual(self.registry.settings(second, "/b"), ("claude", "sk-2"))
+        self.assertEqual(self.registry.settings(second, "/a"), ("gpt-4o", "sk-1"))
+        self.assertEqual(second.call_count, 1)
+        self.assertEqual(self.registry.stats()["settings"], 2)
+
+    def test_settings_modified(self):
+        model_registry.get("gpt-4o")
+        record = types.SimpleNamespace(interfaceName="plone.app.other.ISettings")
+        settings_modified(types.SimpleNamespace(record=record))
+        self.assertEqual(model_registry.stats()["models"], 1)
+        record.interfaceName = "zopyx.surveyjs.interfaces.IFormsSettings"
+        settings_modified(types.SimpleNamespace(record=record))
+        self.assertEqual(model_registry.stats()["models"], 0)
@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+from functools import partial
+from unittest import mock
+from zopyx.surveyjs.browser.ai_generator import generate_form
+from zopyx.surveyjs.browser.ai_generator import generation_cache
+from zopyx.surveyjs.browser.ai_generator import model_registry
+from zopyx.surveyjs.browser.ai_generator import refine_form
+from zopyx.surveyjs.browser.ai_jobs import format_events
+from zopyx.surveyjs.browser.ai_jobs import JobQueue
+from zopyx.surveyjs.browser.ai_jobs import parse_event_id
+from zopyx.surveyjs.browser.ai_jobs import QueueFull
+from zopyx.surveyjs.testing_llm import install
+from zopyx.surveyjs.testing_llm import MODEL_ID
+from zopyx.surveyjs.testing_llm import offline_form
+from zopyx.surveyjs.testing_llm import OfflineModel
+
+import orjson
+import sys
+import threading
+import types
+import unittest
+
+
+FORM = '{"pages": [{"name": "page1", "elements": [{"type": "text", "name": "q"}]}]}'
+
+
+class FakeResponse(object):
+    def __init__(self, text):
+        self._text = text
+
+    def __iter__(self):
+        # streams the text in chunks of 10 characters
+        for i in range(0, len(self._text), 10):
+            yield self._text[i : i + 10]
+
+    def text(self):
+        return self._text
+
+
+class Usage(object):
+    def __init__(self, input, output):
+        self.input = input
+        self.output = output
+
+
+class FakeUsageResponse(FakeResponse):
+    def usage(self):
+        return Usage(100, len(self._text))
+
+
+class BlockingResponse(FakeResponse):
+    """Streams the first chunk, the rest once `release` is set"""
+
+    release = None
+
+    def __iter__(self):
+        chunks = iter(super().__iter__())
+        yield next(chunks)
+        self.release.wait(5)
+        yield from chunks
+
+
+class FakeModel(object):
+    """
+    Stand-in for an `llm` model answering with canned texts in turn, the
+    last one repeated. Answers may be `(text, response class)` pairs.
+    """
+
+    def __init__(self, *answers, response=FakeResponse):
+        self.answers = list(answers)
+        self.response = response
+        self.prompts = []
+        self.lock = threading.Lock()
+
+    def prompt(self, prompt):
+        with self.lock:
+            self.prompts.append(prompt)
+            answer = self.answers[min(len(self.prompts), len(self.answers)) - 1]
+        if isinstance(answer, tuple):
+            return answer[1](answer[0])
+        return self.response(answer)
+
+
+def fake_llm(model):
+    module = types.ModuleType("llm")
+    module.get_model = lambda name: model
+    module.get_default_model = lambda: "fake-model"
+    return mock.patch.dict(sys.modules, {"llm": module})
+
+
+class Clock(object):
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.queue = JobQueue(
+            max_workers=1, max_pending=2, timeout=60, ttl=300, clock=self.clock
+        )
+
+    def tearDown(self):
+        self.queue.shutdown()
+
+    def test_result(self):
+        job = self.queue.submit(lambda: {"success": True, "json": {}}, "alice")
+        self.queue.shutdown()
+        info = self.queue.get(job.id, "alice")
+        timings = info.pop("timings")
+        self.assertEqual(info, dict(job=job.id, status="done", success=True, json={}))
+        self.assertEqual(timings, dict(queued=0.0, ttfb=None, total=0.0))
+        # jobs are only visible to their owner
+        self.assertIsNone(self.queue.get(job.id, "bob"))
+
+    def test_failures(self):
+        def boom():
+            raise RuntimeError("boom")
+
+        failed = self.queue.submit(boom, "alice")
+        error = self.queue.submit(lambda: {"error": "Invalid", "message": "x"}, "alice")
+        self.queue.shutdown()
+        self.assertEqual(self.queue.get(failed.id, "alice")["status"], "failed")
+        self.assertEqual(self.queue.get(failed.id, "alice")["message"], "boom")
+        self.assertEqual(self.queue.get(error.id, "alice")["status"], "failed")
+
+    def test_limits_and_timeout(self):
+        release = threading.Event()
+        blocking = self.queue.submit(lambda: release.wait(5) and {}, "alice")
+        queued = self.queue.submit(dict, "alice")
+        with self.assertRaises(QueueFull):
+            self.queue.submit(dict, "alice")
+
+        self.clock.now = 60
+        self.assertEqual(self.queue.get(blocking.id, "alice")["status"], "timeout")
+        self.assertEqual(self.queue.get(queued.id, "alice")["status"], "timeout")
+        # timed out jobs free their slots
+        self.queue.submit(dict, "alice")
+        release.set()
+        self.queue.shutdown()
+        self.assertEqual(self.queue.get(blocking.id, "alice")["status"], "timeout")
+
+        # finished jobs expire
+        self.clock.now = 360
+        self.assertIsNone(self.queue.get(blocking.id, "alice"))
+
+    def test_events(self):
+        started, release = threading.Event(), threading.Event()
+
+        def job(on_chunk):
+            self.clock.now = 1
+            on_chunk("{")
+            on_chunk('"a": 1')
+            started.set()
+            release.wait(5)
+            self.clock.now = 3
+            on_chunk("}")
+            self.clock.now = 4
+            return {"success": True}
+
+        submitted = self.queue.submit(job, "alice", stream=True)
+        self.assertIsNone(self.queue.events(submitted.id, "bob"))
+        started.wait(5)
+        event_id, events = self.queue.events(submitted.id, "alice")
+        self.assertEqual(events, [("chunk", {"text": '{"a": 1'})])
+        self.assertEqual(event_id, "0-2")
+
+        # without progress the answer is a ping, the job is not waited for
+        self.assertEqual(
+            self.queue.events(submitted.id, "alice", event_id), ("0-2", [("ping", {})])
+        )
+
+        release.set()
+        self.queue.shutdown()
+        event_id, events = self.queue.events(submitted.id, "alice", event_id)
+        self.assertEqual(event_id, "0-3")
+        self.assertEqual(events[0], ("chunk", {"text": "}"}))
+        self.assertEqual(events[1][0], "done")
+        # time to first byte and total generation time are reported apart
+        self.assertEqual(events[1][1]["timings"], dict(queued=0.0, ttfb=1.0, total=4.0))
+
+    def test_events_reset(self):
+        def job(on_chunk):
+            on_chunk("[")
+            on_chunk(None)
+            on_chunk("{}")
+            return {"success": True}
+
+        submitted = self.queue.submit(job, "alice", stream=True)
+        self.queue.shutdown()
+        for last_id in ("", "0-1", "1-5"):
+            event_id, events = self.queue.events(submitted.id, "alice", last_id)
+            self.assertEqual(
+                [event for event, data in events], ["reset", "chunk", "done"]
+            )
+            self.assertEqual(events[1][1], {"text": "{}"})
+            self.assertEqual(event_id, "1-1")
+        event_id, events = self.queue.events(submitted.id, "alice", "1-1")
+        self.assertEqual([event for event, data in events], ["done"])
+
+    def test_parse_event_id(self):
+        self.assertEqual(parse_event_id("2-17"), (2, 17))
+        for event_id in ("", None, "x", "1-2-3", "-1-2"):
+            self.assertEqual(parse_event_id(event_id), (0, 0))
+
+    def test_format_events(self):
+        events = [("chunk", {"text": "{\n"}), ("done", {"job": "1"})]
+        self.assertEqual(
+            format_events(events, "0-1", retry=500),
+            b"retry: 500\n"
+            b'event: chunk\ndata: {"text":"{\\n"}\n\n'
+            b'event: done\ndata: {"job":"1"}\nid: 0-1\n\n',
+        )
+
+
+class AIJobsTest(unittest.TestCase):
+    def setUp(self):
+        generation_cache.clear()
+        model_registry.clear()
+        self.queue = JobQueue(max_workers=2)
+
+    def tearDown(self):
+        self.queue.shutdown()
+        generation_cache.clear()
+        model_registry.clear()
+
+    def run_job(self, func):
+        job = self.queue.submit(func, "alice", stream=True)
+        self.queue.shutdown()
+        return job, self.queue.get(job.id, "alice")
+
+    def test_generate_form(self):
+        model = FakeModel("```json\n" + FORM + "\n```")
+        with fake_llm(model):
+            job, info = self.run_job(
+                partial(generate_form, "A form", "fake-model", None, "key")
+            )
+        self.assertEqual(info["status"], "done")
+        self.assertEqual(info["json"]["pages"][0]["name"], "page1")
+        # the response text was streamed to the job
+        self.assertEqual("".join(job.chunks), "```json\n" + FORM + "\n```")
+        self.assertGreater(len(job.chunks), 1)
+        self.assertIn('"A form"', model.prompts[0])
+        self.assertEqual(generation_cache.get("key"), FORM)
+
+    def test_generate_invalid_json(self):
+        with fake_llm(FakeModel("Sorry, I can't")):
+            job, info = self.run_job(
+                partial(generate_form, "A form", "fake-model", None, "key")
+            )
+        self.assertEqual(info["status"], "failed")
+        self.assertEqual(info["error"], "Invalid JSON generated")
+        self.assertEqual(info["raw_output"], "Sorry, I can't")
+        self.assertIsNone(generation_cache.get("key"))
+        # two candidates and two retries
+        self.assertEqual(info["attempts"], 4)
+
+    def test_generate_retries(self):
+        # invalid JSON and an invalid form, the second retry succeeds
+        model = FakeModel("Sorry", '{"pages": []}', FORM)
+        with fake_llm(model):
+            job, info = self.run_job(
+                partial(
+                    generate_form, "A form", "fake-model", None, "key", candidates=1
+                )
+            )
+        self.assertEqual(info["status"], "done")
+        self.assertEqual(info["attempts"], 3)
+        self.assertEqual(len(model.prompts), 3)
+        # the stream ends with the text of the valid form
+        self.assertEqual("".join(job.chunks), FORM)
+        self.assertEqual(generation_cache.get("key"), FORM)
+
+    def test_generate_invalid_form(self):
+        with fake_llm(FakeModel('{"pages": []}')):
+            job, info = self.run_job(
+                partial(
+                    generate_form, "A form", "fake-model", candidates=1, attempts=2
+                )
+            )
+        self.assertEqual(info["error"], "Invalid form generated")
+        self.assertEqual(info["attempts"], 2)
+
+    def test_generate_cancels_candidates(self):
+        BlockingResponse.release = release = threading.Event()
+        model = FakeModel(("{" + " " * 20 + "}", BlockingResponse), FORM)
+        chunks = []
+        with fake_llm(model):
+            info = generate_form(
+                "A form", "fake-model", on_chunk=chunks.append, attempts=2
+            )
+        # the first valid form won while the other candidate still runs
+        self.assertEqual(info["json"]["pages"][0]["name"], "page1")
+        self.assertEqual(info["attempts"], 2)
+        if None in chunks:
+            chunks = chunks[len(chunks) - chunks[::-1].index(None) :]
+        self.assertEqual("".join(chunks), FORM)
+        release.set()
+
+    def test_refine_form(self):
+        model = FakeModel(FORM)
+        with fake_llm(model):
+            job, info = self.run_job(
+                partial(refine_form, {"pages": []}, "Add q", None, None, mode="full")
+            )
+        self.assertEqual(info["status"], "done")
+        self.assertEqual(info["mode"], "full")
+        self.assertIn('"Add q"', model.prompts[0])
+        # the form is sent as compact JSON
+        self.assertIn('{"pages":[]}', model.prompts[0])
+
+    def test_refine_form_patch(self):
+        current = orjson.loads(FORM)
+        patch = '[{"op": "replace", "path": "/pages/0/elements/0/name", "value": "r"}]'
+        model = FakeModel(patch, response=FakeUsageResponse)
+        with fake_llm(model):
+            job, info = self.run_job(
+                partial(refine_form, current, "Rename q", None, None)
+            )
+        self.assertEqual(info["status"], "done")
+        self.assertEqual(info["mode"], "patch")
+        self.assertEqual(info["json"]["pages"][0]["elements"][0]["name"], "r")
+        self.assertEqual(info["patch"], orjson.loads(patch))
+        self.assertEqual(
+            info["usage"],
+            [
+                dict(
+                    input_tokens=100,
+                    output_tokens=len(patch),
+                    estimated=False,
+                    mode="patch",
+                )
+            ],
+        )
+        self.assertIn("RFC 6902", model.prompts[0])
+        self.assertEqual(len(model.prompts), 1)
+
+    def test_refine_form_invalid_patch_result(self):
+        current = orjson.loads(FORM)
+        # applies, but leaves no form
+        model = FakeModel('[{"op": "remove", "path": "/pages/0"}]', '{"pages": []}')
+        with fake_llm(model):
+            job, info = self.run_job(
+                partial(refine_form, current, "Remove everything", None, None)
+            )
+        self.assertEqual(len(model.prompts), 2)
+        self.assertEqual(info["status"], "failed")
+        self.assertEqual(info["error"], "Invalid form")
+        self.assertEqual([usage["mode"] for usage in info["usage"]], ["patch", "full"])
+
+    def test_refine_form_patch_fallback(self):
+        current = orjson.loads(FORM)
+        bad_patch = '[{"op": "remove", "path": "/pages/3"}]'
+        model = FakeModel(bad_patch, FORM)
+        with fake_llm(model):
+            job, info = self.run_job(
+                partial(refine_form, current, "Remove page 4", None, None)
+            )
+        self.assertEqual(info["status"], "done")
+        self.assertEqual(info["mode"], "full")
+        self.assertEqual(info["json"], current)
+        self.assertEqual(len(model.prompts), 2)
+        self.assertEqual([usage["mode"] for usage in info["usage"]], ["patch", "full"])
+        # token counts are estimated if the model doesn't report them
+        self.assertTrue(info["usage"][1]["estimated"])
+        self.assertEqual(info["usage"][1]["output_tokens"], -(-len(FORM) // 4))
+        # the streamed patch was discarded for the full form
+        self.assertEqual(job.resets, 1)
+        self.assertEqual("".join(job.chunks), FORM)
+
+
+class OfflinePipelineTest(unittest.TestCase):
+    """The AI pipeline against the offline model of `testing_llm`"""
+
+    def setUp(self):
+        generation_cache.clear()
+        self.queue = JobQueue(max_workers=2)
+        self.sleeps = []
+
+    def tearDown(self):
+        self.queue.shutdown()
+        generation_cache.clear()
+
+    def model(self, **kw):
+        return OfflineModel(sleep=self.sleeps.append, **kw)
+
+    def run_job(self, model, func):
+        with install(model):
+            job = self.queue.submit(func, "alice", stream=True)
+            self.queue.shutdown()
+        return job, self.queue.get(job.id, "alice")
+
+    def test_generate(self):
+        model = self.model(latency=0.5, chunk_size=100, chunk_delay=0.01)
+        job, info = self.run_job(
+            model, partial(generate_form, "A contact form", MODEL_ID, candidates=1)
+        )
+        self.assertEqual(info["status"], "done")
+        self.assertEqual(info["json"], offline_form("A contact form"))
+        form = orjson.dumps(info["json"]).decode("utf-8")
+        self.assertEqual(job.chunks[0], form[:100])
+        self.assertEqual(len(job.chunks), -(-len(form) // 100))
+        self.assertEqual(self.sleeps, [0.5] + [0.01] * (len(job.chunks) - 1))
+
+    def test_generate_failures(self):
+        model = self.model(failures=["error", "invalid-json", "invalid-form"])
+        job, info = self.run_job(
+            model, partial(generate_form, "A form", MODEL_ID, candidates=1)
+        )
+        # provider errors aren't retried
+        self.assertEqual(info["status"], "failed")
+        self.assertIn("Injected provider error", info["message"])
+
+        job, info = self.run_job(
+            model, partial(generate_form, "A form", MODEL_ID, candidates=1)
+        )
+        self.assertEqual(info["status"], "done")
+        self.assertEqual(info["attempts"], 3)
+
+    def test_refine(self):
+        form = offline_form("A form")
+        job, info = self.run_job(
+            self.model(), partial(refine_form, form, "Add a phone number", MODEL_ID)
+        )
+        self.assertEqual(info["mode"], "patch")
+        element = info["json"]["pages"][0]["elements"][-1]
+        self.assertEqual(element["title"], "Add a phone number")
+
+        job, info = self.run_job(
+            self.model(failures=["invalid-patch"]),
+            partial(refine_form, form, "Add a phone number", MODEL_ID),
+        )
+        self.assertEqual(info["mode"], "full")
+        self.assertEqual(len(info["json"]["pages"][0]["elements"]), 7)
+        self.assertEqual([usage["mode"] for usage in info["usage"]], ["patch", "full"])
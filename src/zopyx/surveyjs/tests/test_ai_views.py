@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from plone import api
+from plone.app.testing import setRoles
+from plone.app.testing import TEST_USER_ID
+from plone.app.testing import TEST_USER_NAME
+from plone.app.testing import TEST_USER_PASSWORD
+from plone.testing.z2 import Browser
+from urllib.parse import urlencode
+from zopyx.surveyjs.browser.ai_generator import generation_cache
+from zopyx.surveyjs.interfaces import IFormsSettings
+from zopyx.surveyjs.storage import get_form_versions
+from zopyx.surveyjs.testing import ZOPYX_SURVEYJS_FUNCTIONAL_TESTING
+from zopyx.surveyjs.testing_llm import install
+from zopyx.surveyjs.testing_llm import MODEL_ID
+from zopyx.surveyjs.testing_llm import offline_form
+from zopyx.surveyjs.testing_llm import OfflineModel
+
+import json
+import time
+import transaction
+import unittest
+
+
+class AIViewsFunctionalTest(unittest.TestCase):
+    """generate-ai-form, refine-ai-form and save-ai-form against the
+    offline model of `testing_llm`"""
+
+    layer = ZOPYX_SURVEYJS_FUNCTIONAL_TESTING
+
+    def setUp(self):
+        self.portal = self.layer["portal"]
+        setRoles(self.portal, TEST_USER_ID, ["Manager"])
+        self.survey = api.content.create(
+            container=self.portal, type="Survey", id="survey", title="Survey"
+        )
+        api.portal.set_registry_record("ai_model", MODEL_ID, interface=IFormsSettings)
+        transaction.commit()
+
+        generation_cache.clear()
+        self.model = OfflineModel(chunk_size=16)
+        installed = install(self.model)
+        installed.__enter__()
+        self.addCleanup(installed.__exit__, None, None, None)
+
+        self.browser = Browser(self.layer["app"])
+        self.browser.handleErrors = False
+        self.browser.raiseHttpErrors = False
+        self.browser.addHeader(
+            "Authorization", f"Basic {TEST_USER_NAME}:{TEST_USER_PASSWORD}"
+        )
+
+    def post(self, view, **form):
+        self.browser.post(f"{self.survey.absolute_url()}/@@{view}", urlencode(form))
+        return json.loads(self.browser.contents)
+
+    def wait(self, info):
+        """The result of the job started with `info`"""
+        for _ in range(100):
+            self.browser.open(info["status_url"])
+            info = json.loads(self.browser.contents)
+            if info["status"] not in ("queued", "running"):
+                return info
+            time.sleep(0.05)
+        self.fail("AI job did not finish")
+
+    def test_generate(self):
+        info = self.post("generate-ai-form", prompt="A contact form")
+        self.assertEqual(self.browser.headers["status"], "202 Accepted")
+        result = self.wait(info)
+        self.assertEqual(result["status"], "done")
+        self.assertEqual(result["json"], offline_form("A contact form"))
+        self.assertIsNotNone(result["timings"]["ttfb"])
+
+        # the same prompt is answered from the cache
+        prompts = len(self.model.prompts)
+        cached = self.post("generate-ai-form", prompt="  a CONTACT form")
+        self.assertTrue(cached["cached"])
+        self.assertEqual(cached["json"], result["json"])
+        self.assertEqual(len(self.model.prompts), prompts)
+
+    def test_generate_events(self):
+        info = self.post("generate-ai-form", prompt="A form", regenerate="1")
+        text = ""
+        for _ in range(100):
+            self.browser.open(info["events_url"])
+            content_type = self.browser.headers["content-type"]
+            self.assertTrue(content_type.startswith("text/event-stream"))
+            # every response ends, the browser reconnects after the last id
+            body = self.browser.contents
+            self.assertTrue(body.startswith("retry: "))
+            events = [event.splitlines() for event in body.split("\n\n")[:-1]]
+            self.assertTrue(events[-1][-1].startswith("id: "))
+            self.browser.addHeader("Last-Event-ID", events[-1][-1][len("id: ") :])
+            for event in events:
+                name = [line for line in event if line.startswith("event: ")][0]
+                data = [line for line in event if line.startswith("data: ")][0]
+                if name == "event: reset":
+                    text = ""
+                elif name == "event: chunk":
+                    text += json.loads(data[len("data: ") :])["text"]
+            if name == "event: done":
+                break
+            time.sleep(0.05)
+        else:
+            self.fail("AI job did not finish")
+        self.assertEqual(json.loads(text), offline_form("A form"))
+
+    def test_refine_and_save(self):
+        form = offline_form("A form")
+        info = self.post(
+            "refine-ai-form",
+            current_json=json.dumps(form),
+            refinement_prompt="Add a phone number",
+        )
+        result = self.wait(info)
+        self.assertEqual(result["mode"], "patch")
+        refined = result["json"]
+        self.assertEqual(
+            refined["pages"][0]["elements"][-1]["title"], "Add a phone number"
+        )
+
+        saved = self.post("save-ai-form", form_json=json.dumps(refined))
+        self.assertTrue(saved["success"])
+        transaction.begin()
+        current = get_form_versions(self.survey).current
+        self.assertEqual(current["id"], saved["version_id"])
+        self.assertEqual(current["form_json"], refined)
+
+        # saving the current form again answers the existing version
+        again = self.post("save-ai-form", form_json=json.dumps(refined))
+        self.assertEqual(again["version_id"], saved["version_id"])
+
+    def test_refine_invalid_mode(self):
+        result = self.post(
+            "refine-ai-form",
+            current_json="{}",
+            refinement_prompt="Add a phone number",
+            mode="diff",
+        )
+        self.assertEqual(self.browser.headers["status"], "400 Bad Request")
+        self.assertEqual(result["error"], "Invalid mode")
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from unittest import mock
+from ZODB.blob import BlobStorage
+from ZODB.MappingStorage import MappingStorage
+from zopyx.surveyjs.archives import get_archives
+from zopyx.surveyjs.archives import next_month
+from zopyx.surveyjs.archives import seal_results
+from zopyx.surveyjs.storage import ArchivedResults
+from zopyx.surveyjs.storage import clear_results
+from zopyx.surveyjs.storage import get_live_results
+from zopyx.surveyjs.storage import get_results
+from zopyx.surveyjs.storage import position
+from zopyx.surveyjs.testing import FakeSurvey
+from zopyx.surveyjs.testing import make_record
+from zopyx.surveyjs.testing import provide_storage_adapters
+
+import shutil
+import tempfile
+import transaction
+import unittest
+import ZODB
+
+
+DAY = timedelta(days=1)
+
+
+class ArchivesTest(unittest.TestCase):
+    def setUp(self):
+        provide_storage_adapters()
+        self.blobs = tempfile.mkdtemp()
+        self.db = ZODB.DB(BlobStorage(self.blobs, MappingStorage()))
+        self.conn = self.db.open()
+        self.survey = self.conn.root()["survey"] = FakeSurvey()
+        # one record every 10 days from January to April 2024
+        users = ["alice", "bob", None]
+        self.records = [
+            make_record(days, users[days % 3], unit=DAY)
+            for days in range(0, 120, 10)
+        ]
+        for record in self.records:
+            get_results(self.survey).add(record)
+        transaction.commit()
+
+    def tearDown(self):
+        transaction.abort()
+        self.conn.close()
+        self.db.close()
+        shutil.rmtree(self.blobs)
+
+    def seal(self, before=datetime(2024, 4, 1, tzinfo=timezone.utc)):
+        sealed = seal_results(self.survey, before, on_batch=transaction.commit)
+        transaction.commit()
+        return sealed
+
+    def ids(self, records):
+        return [data["poll_id"] for data in records]
+
+    def test_seal_closed_months(self):
+        self.assertEqual(self.seal(), 10)
+        archives = get_archives(self.survey)
+        months = archives.months()
+        self.assertEqual([a.month for a in months], [202401, 202402, 202403])
+        self.assertEqual([a.count for a in months], [4, 2, 4])
+        self.assertEqual(len(get_live_results(self.survey)), 2)
+        # sealing again is a no-op
+        self.assertEqual(self.seal(), 0)
+
+    def test_reads_merge_archives(self):
+        self.seal()
+        results = get_results(self.survey)
+        self.assertIsInstance(results, ArchivedResults)
+        self.assertEqual(len(results), 12)
+
+        expected = list(reversed(self.ids(self.records)))
+        self.assertEqual(self.ids(results.values()), expected)
+        self.assertEqual(self.ids(results.values(reverse=False)), expected[::-1])
+        self.assertEqual(self.ids(results.values(start=1, limit=3)), expected[1:4])
+        positions = [position(data) for data in reversed(self.records)]
+        self.assertEqual(list(results.positions()), positions)
+
+        after = position(self.records[5])
+        self.assertEqual(
+            self.ids(results.values(after=after)), expected[len(expected) - 5 :]
+        )
+        self.assertEqual(
+            self.ids(results.values(reverse=False, after=after)), expected[:6][::-1]
+        )
+
+        self.assertEqual(results.users(), ["", "alice", "bob"])
+        self.assertEqual(
+            self.ids(results.values(users=["bob"])),
+            ["poll-100", "poll-70", "poll-40", "poll-10"],
+        )
+
+    def test_get(self):
+        self.seal()
+        results = get_results(self.survey)
+        data = results.get("poll-20")
+        self.assertEqual(data["user"], None)
+        self.assertEqual(data["result"], {"q": 20})
+        self.assertEqual(data["created"], self.records[2]["created"])
+        self.assertIn("poll-20", results)
+        self.assertIn("poll-110", results)
+        self.assertNotIn("poll-21", results)
+        self.assertIsNone(results.get("poll-21"))
+
+    def test_late_records_are_merged(self):
+        self.seal()
+        results = get_results(self.survey)
+        results.add(make_record(15, poll_id="late", unit=DAY))
+        self.assertEqual(self.ids(results.values())[-3], "late")
+        self.assertEqual(self.seal(), 1)
+        january = get_archives(self.survey).months()[0]
+        self.assertEqual(january.count, 5)
+        self.assertEqual(
+            self.ids(data for _, data in january.items()),
+            ["poll-0", "poll-10", "late", "poll-20", "poll-30"],
+        )
+
+    def test_blocks(self):
+        with mock.patch("zopyx.surveyjs.archives.BLOCK_SIZE", 3):
+            self.seal()
+        january = get_archives(self.survey).months()[0]
+        # 4 records in two gzip members
+        self.assertEqual(len(january.offsets), 3)
+        ids = ["poll-0", "poll-10", "poll-20", "poll-30"]
+        self.assertEqual(self.ids(data for _, data in january.items()), ids)
+        self.assertEqual(
+            self.ids(data for _, data in january.items(reverse=True)), ids[::-1]
+        )
+        self.assertEqual(january.get("poll-30")["result"], {"q": 30})
+
+    def test_next_month(self):
+        self.assertEqual(next_month(202401), 202402)
+        self.assertEqual(next_month(202412), 202501)
+
+    def test_clear_results(self):
+        self.seal()
+        clear_results(self.survey)
+        self.assertEqual(len(get_results(self.survey)), 0)
+        self.assertEqual(get_archives(self.survey).months(), [])
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+from ZODB.blob import BlobStorage
+from ZODB.MappingStorage import MappingStorage
+from zopyx.surveyjs.attachments import content_disposition
+from zopyx.surveyjs.attachments import decode_data_uri
+from zopyx.surveyjs.attachments import extract_attachments
+from zopyx.surveyjs.attachments import get_attachments
+from zopyx.surveyjs.attachments import media_type
+from zopyx.surveyjs.attachments import parse_range
+from zopyx.surveyjs.attachments import range_iterator
+from zopyx.surveyjs.testing import FakeSurvey
+from zopyx.surveyjs.testing import provide_storage_adapters
+
+import base64
+import os
+import shutil
+import tempfile
+import transaction
+import unittest
+import ZODB
+
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256))
+PNG_URI = "data:image/png;base64," + base64.b64encode(PNG).decode("ascii")
+
+
+class AttachmentTest(unittest.TestCase):
+    def setUp(self):
+        provide_storage_adapters()
+        self.blobs = tempfile.mkdtemp()
+        self.db = ZODB.DB(BlobStorage(self.blobs, MappingStorage()))
+        self.conn = self.db.open()
+        self.survey = self.conn.root()["survey"] = FakeSurvey()
+
+    def tearDown(self):
+        transaction.abort()
+        self.conn.close()
+        self.db.close()
+        shutil.rmtree(self.blobs)
+
+    def test_decode_data_uri(self):
+        self.assertEqual(decode_data_uri(PNG_URI), ("image/png", PNG))
+        self.assertEqual(decode_data_uri("data:,a%20b"), ("text/plain", b"a b"))
+        self.assertIsNone(decode_data_uri("data:image/png;base64,###"))
+        self.assertIsNone(decode_data_uri("https://example.org"))
+        self.assertEqual(decode_data_uri("data:Image/PNG,x"), ("image/png", b"x"))
+        self.assertEqual(
+            decode_data_uri("data:text/html<script>,x"),
+            ("application/octet-stream", b"x"),
+        )
+
+    def test_media_type(self):
+        self.assertEqual(media_type(" Image/JPEG"), "image/jpeg")
+        self.assertEqual(media_type("text/html\r\nX: 1"), "application/octet-stream")
+        self.assertEqual(media_type(None), "application/octet-stream")
+
+    def test_content_disposition(self):
+        self.assertEqual(
+            content_disposition("image/png", "logo.png"), 'inline; filename="logo.png"'
+        )
+        for content_type in ("image/svg+xml", "text/html", "application/pdf"):
+            self.assertTrue(
+                content_disposition(content_type, "x").startswith("attachment;")
+            )
+        self.assertEqual(
+            content_disposition("text/plain", 'a"\r\nb.txt'),
+            'attachment; filename="ab.txt"',
+        )
+        self.assertEqual(
+            content_disposition("application/pdf", "Prüfung.pdf"),
+            'attachment; filename="Prfung.pdf"; filename*=UTF-8\'\'Pr%C3%BCfung.pdf',
+        )
+
+    def test_extract_attachments(self):
+        upload = dict(name="logo.png", type="image/png", content=PNG_URI)
+        result = dict(
+            name="Jane",
+            photos=[upload],
+            panel=[dict(scan=[dict(upload, name="scan.png")])],
+        )
+        converted = extract_attachments(self.survey, result, "poll-1")
+        self.assertEqual(result["photos"][0]["content"], PNG_URI)
+        self.assertEqual(converted["name"], "Jane")
+
+        photo = converted["photos"][0]
+        self.assertNotIn("content", photo)
+        self.assertEqual(photo["size"], len(PNG))
+        attachment = get_attachments(self.survey)[photo["attachment"]]
+        self.assertEqual(attachment.filename, "logo.png")
+        self.assertEqual(attachment.poll_id, "poll-1")
+        self.assertEqual(attachment.content_type, "image/png")
+        transaction.commit()
+        with open(attachment.blob.committed(), "rb") as fp:
+            self.assertEqual(fp.read(), PNG)
+
+        scan = converted["panel"][0]["scan"][0]
+        self.assertEqual(get_attachments(self.survey)[scan["attachment"]].size, 264)
+
+    def test_content_type_of_data_uri(self):
+        upload = dict(name="x.png", type="text/html", content="data:image/png,x")
+        converted = extract_attachments(self.survey, dict(file=[upload]), "poll-1")
+        attachment = get_attachments(self.survey)[converted["file"][0]["attachment"]]
+        self.assertEqual(attachment.content_type, "image/png")
+
+    def test_results_without_uploads(self):
+        result = dict(name="Jane", scores=[1, 2], matrix={"r": "c"})
+        self.assertEqual(extract_attachments(self.survey, result, "poll-1"), result)
+        self.assertEqual(len(get_attachments(self.survey)), 0)
+
+
+class RangeTest(unittest.TestCase):
+    def test_parse_range(self):
+        self.assertIsNone(parse_range(None, 100))
+        self.assertEqual(parse_range("bytes=0-9", 100), (0, 9))
+        self.assertEqual(parse_range("bytes=90-", 100), (90, 99))
+        self.assertEqual(parse_range("bytes=-10", 100), (90, 99))
+        self.assertEqual(parse_range("bytes=50-500", 100), (50, 99))
+        self.assertIsNone(parse_range("bytes=0-1,5-6", 100))
+        self.assertIsNone(parse_range("bytes=a-b", 100))
+        with self.assertRaises(ValueError):
+            parse_range("bytes=100-", 100)
+
+    def test_range_iterator(self):
+        fd, filename = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(PNG)
+            iterator = range_iterator(filename, 8, 107, streamsize=32)
+            self.assertEqual(len(iterator), 100)
+            self.assertEqual(b"".join(iterator), PNG[8:108])
+        finally:
+            os.unlink(filename)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from datetime import timezone
+from zopyx.surveyjs.caching import http_date
+from zopyx.surveyjs.caching import is_not_modified
+
+import unittest
+
+
+class FakeRequest(object):
+    def __init__(self, **headers):
+        self.headers = headers
+
+    def getHeader(self, name):
+        return self.headers.get(name.replace("-", "_"))
+
+
+CREATED = datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+
+class ConditionalRequestTest(unittest.TestCase):
+    def test_http_date(self):
+        self.assertEqual(http_date(CREATED), "Wed, 01 May 2024 12:30:15 GMT")
+
+    def test_if_none_match(self):
+        request = FakeRequest(If_None_Match='"other", W/"abc"')
+        self.assertTrue(is_not_modified(request, '"abc"', CREATED))
+        request = FakeRequest(If_None_Match='"other"')
+        self.assertFalse(is_not_modified(request, '"abc"', CREATED))
+        self.assertTrue(is_not_modified(FakeRequest(If_None_Match="*"), '"abc"'))
+
+    def test_if_none_match_wins(self):
+        request = FakeRequest(
+            If_None_Match='"other"', If_Modified_Since=http_date(CREATED)
+        )
+        self.assertFalse(is_not_modified(request, '"abc"', CREATED))
+
+    def test_if_modified_since(self):
+        request = FakeRequest(If_Modified_Since=http_date(CREATED))
+        self.assertTrue(is_not_modified(request, '"abc"', CREATED))
+        request = FakeRequest(If_Modified_Since="Wed, 01 May 2024 12:30:14 GMT")
+        self.assertFalse(is_not_modified(request, '"abc"', CREATED))
+        request = FakeRequest(If_Modified_Since="garbage")
+        self.assertFalse(is_not_modified(request, '"abc"', CREATED))
+
+    def test_unconditional(self):
+        self.assertFalse(is_not_modified(FakeRequest(), '"abc"', CREATED))
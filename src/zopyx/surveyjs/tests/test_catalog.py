@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+from OFS.Application import Application
+from OFS.SimpleItem import SimpleItem
+from zopyx.surveyjs.catalog import queue_reindex
+from zopyx.surveyjs.catalog import ReindexQueue
+from zopyx.surveyjs.catalog import SUBMISSION_INDEXES
+
+import threading
+import transaction
+import unittest
+import ZODB
+
+
+class FakeSurvey(SimpleItem):
+    def __init__(self, id):
+        self.id = id
+        self.reindexed = []
+
+    def reindexObject(self, idxs=[]):
+        self.reindexed = self.reindexed + [idxs]
+
+
+class ReindexQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.db = ZODB.DB(None)
+        with self.db.transaction() as conn:
+            app = conn.root()["Application"] = Application()
+            app._setObject("one", FakeSurvey("one"))
+            app._setObject("two", FakeSurvey("two"))
+
+    def tearDown(self):
+        transaction.abort()
+        self.db.close()
+
+    @contextmanager
+    def open_root(self):
+        conn = self.db.open()
+        try:
+            yield conn.root()["Application"]
+        finally:
+            conn.close()
+
+    def reindexed(self, name):
+        with self.open_root() as app:
+            return getattr(app, name).reindexed
+
+    def test_flush_reindexes_queued_surveys_once(self):
+        queue = ReindexQueue(self.open_root, delay=None)
+        for path in ("/one", "/two", "/one", "/gone"):
+            queue.add(path)
+        self.assertEqual(queue.flush(), 3)
+        self.assertEqual(self.reindexed("one"), [list(SUBMISSION_INDEXES)])
+        self.assertEqual(self.reindexed("two"), [list(SUBMISSION_INDEXES)])
+        self.assertEqual(queue.flush(), 0)
+
+    def test_queued_after_commit(self):
+        queue = ReindexQueue(self.open_root, delay=None)
+        with self.open_root() as app:
+            queue_reindex(app.one, queue)
+            transaction.abort()
+            self.assertEqual(len(queue), 0)
+            queue_reindex(app.one, queue)
+            transaction.commit()
+        self.assertEqual(queue._paths, {"/one"})
+
+    def test_timer_flushes(self):
+        flushed = threading.Event()
+
+        class Queue(ReindexQueue):
+            def flush(self):
+                count = super(Queue, self).flush()
+                flushed.set()
+                return count
+
+        queue = Queue(self.open_root, delay=0.01)
+        queue.add("/one")
+        queue.add("/two")
+        self.assertTrue(flushed.wait(5))
+        self.assertEqual(len(self.reindexed("one")), 1)
+        self.assertEqual(len(self.reindexed("two")), 1)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from datetime import timezone
+from zopyx.surveyjs.browser.export import cell_value
+from zopyx.surveyjs.browser.export import csv_chunks
+from zopyx.surveyjs.browser.export import form_columns
+from zopyx.surveyjs.browser.export import iter_batches
+from zopyx.surveyjs.browser.export import json_chunks
+from zopyx.surveyjs.browser.export import ndjson_chunks
+from zopyx.surveyjs.browser.export import spool
+from zopyx.surveyjs.browser.export import table_rows
+from zopyx.surveyjs.browser.export import write_xlsx
+
+import csv
+import gzip
+import io
+import orjson
+import unittest
+
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+
+RECORDS = [dict(poll_id=str(i), result={"q": i}) for i in range(7)]
+
+
+class ExportTest(unittest.TestCase):
+    def test_iter_batches(self):
+        sizes = [len(batch) for batch in iter_batches(range(7), 3)]
+        self.assertEqual(sizes, [3, 3, 1])
+
+    def test_json_chunks(self):
+        chunks = list(json_chunks(iter(RECORDS), batch_size=3))
+        # opening bracket, three batches, closing bracket
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(orjson.loads(b"".join(chunks)), RECORDS)
+
+    def test_json_chunks_empty(self):
+        self.assertEqual(orjson.loads(b"".join(json_chunks(iter([])))), [])
+
+    def test_ndjson_chunks(self):
+        calls = []
+        data = b"".join(
+            ndjson_chunks(iter(RECORDS), batch_size=2, on_batch=lambda: calls.append(1))
+        )
+        lines = data.decode("utf-8").splitlines()
+        self.assertEqual([orjson.loads(line) for line in lines], RECORDS)
+        self.assertEqual(len(calls), 4)
+
+    def test_spool_gzip(self):
+        iterator, size = spool(json_chunks(iter(RECORDS)), compress=True)
+        data = b"".join(iterator)
+        self.assertEqual(len(data), size)
+        self.assertEqual(orjson.loads(gzip.decompress(data)), RECORDS)
+
+
+FORM = {
+    "pages": [
+        {
+            "elements": [
+                {"type": "html", "name": "intro"},
+                {"type": "text", "name": "name"},
+                {
+                    "type": "checkbox",
+                    "name": "colors",
+                    "choices": ["red", {"value": "blue", "text": "Blue"}],
+                },
+                {
+                    "type": "panel",
+                    "name": "panel",
+                    "elements": [
+                        {"type": "matrix", "name": "quality", "rows": ["speed"]},
+                    ],
+                },
+                {
+                    "type": "matrixdynamic",
+                    "name": "items",
+                    "columns": [{"name": "label"}, {"name": "amount"}],
+                },
+            ]
+        }
+    ]
+}
+
+
+class TableExportTest(unittest.TestCase):
+    def setUp(self):
+        self.columns, self.dynamic = form_columns(FORM)
+        self.record = dict(
+            poll_id="p1",
+            created=datetime(2024, 1, 1, tzinfo=timezone.utc),
+            user="jane",
+            result={
+                "name": "Jane",
+                "colors": ["blue"],
+                "quality": {"speed": 5},
+                "items": [{"label": "a", "amount": 1}, {"label": "b"}],
+            },
+        )
+
+    def test_form_columns(self):
+        headers = [header for header, _ in self.columns]
+        self.assertEqual(
+            headers, ["name", "colors.red", "colors.blue", "quality.speed"]
+        )
+        headers = [header for header, _, _ in self.dynamic]
+        self.assertEqual(headers, ["items.label", "items.amount"])
+
+    def test_table_rows_with_child_rows(self):
+        rows = list(table_rows([self.record], self.columns, self.dynamic))
+        self.assertEqual(rows[0][:3], ["poll_id", "created", "user"])
+        self.assertEqual(
+            rows[1],
+            ["p1", "2024-01-01T00:00:00+00:00", "jane", "Jane", "", 1, 5, "a", 1],
+        )
+        self.assertEqual(rows[2], ["p1", "", "", "", "", "", "", "b", ""])
+
+    def test_csv_chunks(self):
+        rows = table_rows([self.record], self.columns, self.dynamic)
+        data = b"".join(csv_chunks(rows)).decode("utf-8-sig")
+        self.assertEqual(len(data.splitlines()), 3)
+        self.assertTrue(data.startswith("poll_id,created,user,name,"))
+
+    def test_formulas_are_escaped(self):
+        for value in ("=1+1", "+1", "-1", "@SUM(A1)"):
+            self.assertEqual(cell_value(value), "'" + value)
+        self.assertEqual(cell_value(["=a", "b"]), "'=a; b")
+        self.assertEqual(cell_value(-1), -1)
+        self.assertEqual(cell_value("a=b"), "a=b")
+
+        self.record["user"] = "=cmd"
+        self.record["result"]["name"] = '=HYPERLINK("http://example.org")'
+        rows = table_rows([self.record], self.columns, self.dynamic)
+        data = b"".join(csv_chunks(rows)).decode("utf-8-sig")
+        row = list(csv.reader(io.StringIO(data)))[1]
+        self.assertEqual(row[2:4], ["'=cmd", "'" + self.record["result"]["name"]])
+
+    @unittest.skipUnless(openpyxl, "openpyxl is not installed")
+    def test_write_xlsx_drops_illegal_characters(self):
+        self.record["result"]["name"] = "bad\x0bvalue"
+        fp = io.BytesIO()
+        write_xlsx(table_rows([self.record], self.columns, self.dynamic), fp)
+        fp.seek(0)
+        sheet = openpyxl.load_workbook(fp).active
+        self.assertEqual(sheet["D2"].value, "badvalue")
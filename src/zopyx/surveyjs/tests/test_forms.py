@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from zopyx.surveyjs.forms import InvalidForm
+from zopyx.surveyjs.forms import validate_form
+
+import unittest
+
+
+def form(*elements):
+    return {"pages": [{"name": "page1", "elements": list(elements)}]}
+
+
+class ValidateFormTest(unittest.TestCase):
+    def test_valid(self):
+        validate_form(form({"type": "text", "name": "q"}))
+        validate_form({"elements": [{"type": "text", "name": "q"}]})
+        validate_form(
+            form(
+                {"type": "html", "html": "<p>Hi</p>"},
+                {
+                    "type": "panel",
+                    "name": "panel1",
+                    "elements": [{"type": "text", "name": "q"}],
+                },
+                {
+                    "type": "paneldynamic",
+                    "name": "rows",
+                    "templateElements": [{"type": "text", "name": "q"}],
+                },
+            )
+        )
+
+    def test_invalid(self):
+        for invalid, message in (
+            ([], "no JSON object"),
+            ({"pages": []}, "no non-empty list"),
+            ({"pages": ["page1"]}, "Page 1 is no JSON object"),
+            ({"pages": [{"elements": {}}]}, "are no list"),
+            (form({"name": "q"}), "Element 1 of page 1 has no type"),
+            (form({"type": "text"}), "Element 1 (text) of page 1 has no name"),
+            (
+                form({"type": "panel", "name": "p", "elements": [{"type": "text"}]}),
+                "of panel p has no name",
+            ),
+            (form({"type": "html"}), "no questions"),
+            (
+                form({"type": "text", "name": "q"}, {"type": "text", "name": "q"}),
+                "Duplicate question names: q",
+            ),
+        ):
+            with self.assertRaises(InvalidForm) as raised:
+                validate_form(invalid)
+            self.assertIn(message, str(raised.exception))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from zopyx.surveyjs.patches import apply_patch
+from zopyx.surveyjs.patches import make_patch
+from zopyx.surveyjs.patches import PatchError
+
+import copy
+import random
+import unittest
+
+
+def make_form(questions=30):
+    return {
+        "title": "Survey",
+        "pages": [
+            {
+                "name": "page1",
+                "elements": [
+                    {"type": "text", "name": "q%d" % i, "title": "Question %d" % i}
+                    for i in range(questions)
+                ],
+            }
+        ],
+    }
+
+
+class MakePatchTest(unittest.TestCase):
+    def test_round_trip(self):
+        old = make_form()
+        new = copy.deepcopy(old)
+        new["title"] = "Changed"
+        new["pages"][0]["elements"][5]["title"] = "Edited"
+        del new["pages"][0]["elements"][10]
+        new["pages"][0]["elements"].insert(20, {"type": "boolean", "name": "b"})
+        new["description"] = "a/b~c"
+        patch = make_patch(old, new)
+        self.assertEqual(apply_patch(old, patch), new)
+        self.assertEqual(old, make_form())
+
+    def test_small_edit_gives_small_patch(self):
+        old = make_form(300)
+        new = copy.deepcopy(old)
+        new["pages"][0]["elements"].insert(150, {"type": "text", "name": "x"})
+        patch = make_patch(old, new)
+        self.assertLess(len(patch), 5)
+        self.assertEqual(apply_patch(old, patch), new)
+
+    def test_random_edits(self):
+        rnd = random.Random(42)
+        for _ in range(50):
+            old = make_form(rnd.randint(0, 20))
+            new = copy.deepcopy(old)
+            elements = new["pages"][0]["elements"]
+            for _ in range(rnd.randint(1, 5)):
+                action = rnd.choice(["insert", "delete", "edit"])
+                if action == "insert" or not elements:
+                    elements.insert(rnd.randint(0, len(elements)), {"name": "n"})
+                elif action == "delete":
+                    del elements[rnd.randrange(len(elements))]
+                else:
+                    elements[rnd.randrange(len(elements))]["title"] = rnd.random()
+            self.assertEqual(apply_patch(old, make_patch(old, new)), new)
+
+    def test_identical(self):
+        self.assertEqual(make_patch(make_form(), make_form()), [])
+
+
+class ApplyPatchTest(unittest.TestCase):
+    def test_operations(self):
+        doc = {"a": [1, 2, 3], "b": {"c": 1}}
+        patch = [
+            dict(op="add", path="/a/-", value=4),
+            dict(op="move", **{"from": "/b/c", "path": "/d"}),
+            dict(op="copy", **{"from": "/a/0", "path": "/b/e"}),
+            dict(op="test", path="/d", value=1),
+            dict(op="replace", path="/a/1", value=20),
+            dict(op="remove", path="/a/0"),
+        ]
+        self.assertEqual(
+            apply_patch(doc, patch), {"a": [20, 3, 4], "b": {"e": 1}, "d": 1}
+        )
+
+    def test_errors(self):
+        doc = {"a": [1]}
+        for patch in (
+            {"op": "add"},
+            [dict(op="add", path="a", value=1)],
+            [dict(op="remove", path="/missing")],
+            [dict(op="add", path="/a/5", value=1)],
+            [dict(op="test", path="/a/0", value=2)],
+            [dict(op="frobnicate", path="/a")],
+            [dict(op="replace", path="/a/01", value=1)],
+        ):
+            with self.assertRaises(PatchError):
+                apply_patch(doc, patch)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from datetime import timezone
+from zopyx.surveyjs.reports import surveys_report
+from zopyx.surveyjs.stats import hour_key
+
+import unittest
+
+
+NOW = datetime(2024, 3, 10, 12, 30, tzinfo=timezone.utc)
+HOUR = hour_key(NOW)
+
+
+class Brain(object):
+    """Catalog brain with the survey metadata columns"""
+
+    def __init__(self, uid, responses=None, activity=None):
+        self.UID = uid
+        self.Title = uid.title()
+        self.survey_responses = responses
+        self.survey_activity = activity
+        self.survey_last_submission = None
+        self.survey_form_version = None
+
+    def getURL(self):
+        return "http://nohost/plone/" + self.UID
+
+
+class SurveysReportTest(unittest.TestCase):
+    def setUp(self):
+        brains = [
+            Brain("busy", 500, ((HOUR - 100, 50), (HOUR - 2, 7), (HOUR, 3))),
+            Brain("old", 1000, ((HOUR - 200, 4),)),
+            Brain("week", 20, ((HOUR - 30, 20),)),
+            # not indexed yet
+            Brain("new"),
+        ]
+        self.report = surveys_report(brains, now=NOW, top=2)
+
+    def ids(self, surveys):
+        return [survey["uid"] for survey in surveys]
+
+    def test_totals(self):
+        self.assertEqual(self.report["surveys"], 4)
+        self.assertEqual(self.report["responses"], 1520)
+        self.assertEqual(
+            self.ids(self.report["items"]), ["old", "busy", "week", "new"]
+        )
+
+    def test_activity_windows(self):
+        activity = self.report["activity"]
+        self.assertEqual(activity["24h"], dict(responses=10, surveys=1))
+        self.assertEqual(activity["7d"], dict(responses=80, surveys=2))
+        busy = self.report["items"][1]
+        self.assertEqual((busy["24h"], busy["7d"]), (10, 60))
+
+    def test_top_lists(self):
+        top = self.report["top"]
+        self.assertEqual(self.ids(top["responses"]), ["old", "busy"])
+        self.assertEqual(self.ids(top["24h"]), ["busy"])
+        self.assertEqual(self.ids(top["7d"]), ["busy", "week"])
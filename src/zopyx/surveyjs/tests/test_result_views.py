@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from plone import api
+from plone.app.testing import login
+from plone.app.testing import setRoles
+from plone.app.testing import TEST_USER_ID
+from plone.app.testing import TEST_USER_NAME
+from plone.app.testing import TEST_USER_PASSWORD
+from plone.protect.authenticator import createToken
+from plone.testing.z2 import Browser
+from urllib.parse import urlencode
+from zExceptions import Forbidden
+from zExceptions import MethodNotAllowed
+from zopyx.surveyjs.testing import ZOPYX_SURVEYJS_FUNCTIONAL_TESTING
+
+import transaction
+import unittest
+
+
+class ResultViewsFunctionalTest(unittest.TestCase):
+    """move-results and seal-results commit in between batches and need a
+    POST with a CSRF token"""
+
+    layer = ZOPYX_SURVEYJS_FUNCTIONAL_TESTING
+
+    def setUp(self):
+        self.portal = self.layer["portal"]
+        setRoles(self.portal, TEST_USER_ID, ["Manager"])
+        login(self.portal, TEST_USER_NAME)
+        self.survey = api.content.create(
+            container=self.portal, type="Survey", id="survey", title="Survey"
+        )
+        transaction.commit()
+
+        self.browser = Browser(self.layer["app"])
+        self.browser.handleErrors = False
+        self.browser.addHeader(
+            "Authorization", f"Basic {TEST_USER_NAME}:{TEST_USER_PASSWORD}"
+        )
+
+    def url(self, view):
+        return f"{self.survey.absolute_url()}/@@{view}"
+
+    def test_post_required(self):
+        for view in ("move-results", "seal-results"):
+            with self.assertRaises(MethodNotAllowed):
+                self.browser.open(f"{self.url(view)}?_authenticator={createToken()}")
+
+    def test_authenticator_required(self):
+        for view in ("move-results", "seal-results"):
+            with self.assertRaises(Forbidden):
+                self.browser.post(self.url(view), urlencode({"storage": "sqlite"}))
+
+    def test_seal_results(self):
+        self.browser.post(
+            self.url("seal-results"), urlencode({"_authenticator": createToken()})
+        )
+        self.assertTrue(self.browser.url.endswith("/survey/results"))
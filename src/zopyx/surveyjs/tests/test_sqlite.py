@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+from zope.component import provideAdapter
+from zope.interface import Interface
+from zopyx.surveyjs.interfaces import IResultStorage
+from zopyx.surveyjs.sqlite import SQLiteResultStorage
+from zopyx.surveyjs.storage import annotation_results
+from zopyx.surveyjs.storage import get_results
+from zopyx.surveyjs.storage import move_results
+from zopyx.surveyjs.storage import poll_slot
+from zopyx.surveyjs.storage import position
+from zopyx.surveyjs.storage import SLOTS
+from zopyx.surveyjs.testing import FakeSurvey
+from zopyx.surveyjs.testing import make_record
+from zopyx.surveyjs.testing import provide_storage_adapters
+
+import os
+import shutil
+import tempfile
+import transaction
+import unittest
+
+
+class SQLiteResultStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "results.sqlite")
+        self.results = SQLiteResultStorage(self.path)
+        users = ["Alice", "alex", "bob", None]
+        for number in range(8):
+            self.results.add(make_record(number, users[number % 4]))
+        transaction.commit()
+
+    def tearDown(self):
+        transaction.abort()
+        shutil.rmtree(self.directory)
+
+    def q(self, records):
+        return [r["result"]["q"] for r in records]
+
+    def test_reads(self):
+        self.assertEqual(len(self.results), 8)
+        self.assertEqual(self.results.get("poll-3"), make_record(3, None))
+        self.assertIsNone(self.results.get("missing"))
+        self.assertIn("poll-1", self.results)
+        self.assertEqual(self.q(self.results.values(limit=3)), [7, 6, 5])
+        window = self.results.values(reverse=False, start=2, limit=2)
+        self.assertEqual(self.q(window), [2, 3])
+
+    def test_after_and_users(self):
+        anchor = position(self.results.get("poll-5"))
+        self.assertEqual(self.q(self.results.values(after=anchor)), [4, 3, 2, 1, 0])
+        self.assertEqual(self.results.users(), ["", "alex", "alice", "bob"])
+        self.assertEqual(self.results.users("al"), ["alex", "alice"])
+        records = self.results.values(users=["alex", "alice"], after=anchor)
+        self.assertEqual(self.q(records), [4, 1, 0])
+        positions = list(self.results.positions(reverse=False, after=anchor))
+        self.assertEqual(positions, [position(make_record(n)) for n in (6, 7)])
+
+    def test_writes_follow_the_transaction(self):
+        self.results.add(make_record(10))
+        self.assertEqual(len(self.results), 9)
+        transaction.abort()
+        self.assertEqual(len(SQLiteResultStorage(self.path)), 8)
+
+        self.results.clear()
+        transaction.commit()
+        self.assertEqual(len(self.results), 0)
+
+    def test_remove(self):
+        self.results.remove("poll-3")
+        transaction.commit()
+        self.assertNotIn("poll-3", self.results)
+        self.assertEqual(self.results.users(), ["", "alex", "alice", "bob"])
+        with self.assertRaises(KeyError):
+            self.results.remove("poll-3")
+
+    def test_add_is_idempotent(self):
+        self.results.add(make_record(1))
+        transaction.commit()
+        self.assertEqual(len(self.results), 8)
+
+    def test_same_position_moves_by_a_microsecond(self):
+        # a poll id with the same hash slot as "poll-1"
+        slot = poll_slot("poll-1")
+        other = next(
+            "other-%d" % i for i in range(100000) if poll_slot("other-%d" % i) == slot
+        )
+        self.results.add(dict(make_record(1), poll_id=other))
+        transaction.commit()
+        moved = self.results.get(other)
+        self.assertEqual(position(moved), position(make_record(1)) + SLOTS)
+
+    def setup_move(self):
+        provide_storage_adapters()
+        provideAdapter(
+            lambda context: self.results, (Interface,), IResultStorage, name="sqlite"
+        )
+        survey = FakeSurvey()
+        self.results.clear()
+        for number in range(5):
+            get_results(survey).add(make_record(number))
+        return survey
+
+    def test_move_results(self):
+        survey = self.setup_move()
+        self.assertEqual(move_results(survey, "sqlite", batch_size=2), 5)
+        transaction.commit()
+        self.assertIs(get_results(survey), self.results)
+        self.assertEqual(self.q(self.results.values()), [4, 3, 2, 1, 0])
+        self.assertEqual(len(annotation_results(survey)), 0)
+        self.assertEqual(move_results(survey, "sqlite"), 0)
+
+    def test_move_results_while_submitting(self):
+        survey = self.setup_move()
+        batches = []
+
+        def on_batch():
+            batches.append(len(get_results(survey)))
+            if len(batches) == 1:
+                # the survey switched to the new backend first
+                get_results(survey).add(make_record(10))
+            elif len(batches) == 2:
+                # a submission started before the switch
+                annotation_results(survey).add(make_record(11))
+
+        moved = move_results(survey, "sqlite", batch_size=2, on_batch=on_batch)
+        self.assertEqual(moved, 6)
+        self.assertEqual(batches, [5, 6, 7, 7])
+        self.assertIs(get_results(survey), self.results)
+        self.assertEqual(self.q(self.results.values()), [11, 10, 4, 3, 2, 1, 0])
+        self.assertEqual(len(annotation_results(survey)), 0)
+
+    def test_move_results_resumes(self):
+        survey = self.setup_move()
+
+        class Interrupted(Exception):
+            pass
+
+        def on_batch():
+            if len(self.results):
+                raise Interrupted()
+
+        with self.assertRaises(Interrupted):
+            move_results(survey, "sqlite", batch_size=2, on_batch=on_batch)
+        results = get_results(survey)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(self.q(results.values()), [4, 3, 2, 1, 0])
+        with self.assertRaises(ValueError):
+            move_results(survey, "annotation")
+        self.assertEqual(move_results(survey, "sqlite"), 3)
+        self.assertIs(get_results(survey), self.results)
+        self.assertEqual(len(self.results), 5)
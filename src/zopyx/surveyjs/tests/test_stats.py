@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from datetime import timezone
+from zopyx.surveyjs.stats import Extremum
+from zopyx.surveyjs.stats import histogram_bucket
+from zopyx.surveyjs.stats import hour_key
+from zopyx.surveyjs.stats import SurveyStats
+
+import unittest
+
+
+FORM = {
+    "elements": [
+        {"type": "radiogroup", "name": "color", "choices": ["red", "blue"]},
+        {"type": "checkbox", "name": "pets", "choices": [1, 2]},
+        {"type": "text", "name": "age", "inputType": "number"},
+        {"type": "matrix", "name": "quality", "rows": ["speed"]},
+        {"type": "comment", "name": "remarks"},
+    ]
+}
+
+
+class SurveyStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.stats = SurveyStats()
+        self.stats.add(
+            {"color": "red", "pets": [1, 2], "age": 42, "quality": {"speed": 5}},
+            FORM,
+        )
+        self.stats.add({"color": "green", "pets": [2], "age": 7}, FORM)
+        self.summary = self.stats.summary(FORM)
+        self.questions = {q["name"]: q for q in self.summary["questions"]}
+
+    def test_responses(self):
+        self.assertEqual(self.summary["responses"], 2)
+
+    def test_answered_skipped(self):
+        self.assertEqual(self.questions["color"]["answered"], 2)
+        self.assertEqual(self.questions["remarks"]["answered"], 0)
+        self.assertEqual(self.questions["remarks"]["skipped"], 2)
+        self.assertEqual(self.questions["quality"]["skipped"], 1)
+
+    def test_choice_counts(self):
+        self.assertEqual(
+            self.questions["color"]["choices"],
+            [
+                dict(value="red", count=1),
+                dict(value="blue", count=0),
+                dict(value="green", count=1),
+            ],
+        )
+        self.assertEqual(
+            self.questions["pets"]["choices"],
+            [dict(value=1, count=1), dict(value=2, count=2)],
+        )
+
+    def test_matrix_counts(self):
+        self.assertEqual(self.questions["quality"]["rows"], {"speed": {"5": 1}})
+
+    def test_numeric(self):
+        numeric = self.questions["age"]["numeric"]
+        self.assertEqual(numeric["count"], 2)
+        self.assertEqual(numeric["sum"], 49)
+        self.assertEqual(numeric["min"], 7)
+        self.assertEqual(numeric["max"], 42)
+        self.assertEqual(
+            numeric["histogram"], [dict(bucket=1, count=1), dict(bucket=10, count=1)]
+        )
+
+    def test_activity(self):
+        self.assertEqual(self.stats.activity(0), [])
+        for hour, minute in ((10, 5), (10, 55), (12, 0)):
+            created = datetime(2024, 1, 1, hour, minute, tzinfo=timezone.utc)
+            self.stats.add({}, FORM, created)
+        ten = hour_key(datetime(2024, 1, 1, 10, tzinfo=timezone.utc))
+        self.assertEqual(self.stats.activity(ten), [(ten, 2), (ten + 2, 1)])
+        self.assertEqual(self.stats.activity(ten + 1), [(ten + 2, 1)])
+
+    def test_histogram_bucket(self):
+        self.assertEqual(histogram_bucket(0.5), 0)
+        self.assertEqual(histogram_bucket(250), 100)
+        self.assertEqual(histogram_bucket(-12), -10)
+
+    def test_extremum_conflict_resolution(self):
+        extremum = Extremum("max", 5)
+        state = extremum._p_resolveConflict(("max", 5), ("max", 9), ("max", 7))
+        self.assertEqual(state, ("max", 9))
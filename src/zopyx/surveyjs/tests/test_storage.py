@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+from BTrees.OOBTree import OOBTree
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from unittest import mock
+from zope.annotation.interfaces import IAnnotations
+from zopyx.surveyjs.storage import COMPACTING_KEY
+from zopyx.surveyjs.storage import compact_results
+from zopyx.surveyjs.storage import convert_form_versions
+from zopyx.surveyjs.storage import date_key
+from zopyx.surveyjs.storage import decode_cursor
+from zopyx.surveyjs.storage import encode_cursor
+from zopyx.surveyjs.storage import form_hash
+from zopyx.surveyjs.storage import FormStore
+from zopyx.surveyjs.storage import FORM_VERSIONS_KEY
+from zopyx.surveyjs.storage import FormVersions
+from zopyx.surveyjs.storage import get_form_versions
+from zopyx.surveyjs.storage import get_results
+from zopyx.surveyjs.storage import LegacyFormVersions
+from zopyx.surveyjs.storage import LegacyResults
+from zopyx.surveyjs.storage import poll_id_of
+from zopyx.surveyjs.storage import poll_key
+from zopyx.surveyjs.storage import position
+from zopyx.surveyjs.storage import RESULTS_KEY
+from zopyx.surveyjs.storage import ResultContainer
+from zopyx.surveyjs.storage import SNAPSHOT_INTERVAL
+from zopyx.surveyjs.storage import UserTable
+from zopyx.surveyjs.testing import FakeSurvey
+from zopyx.surveyjs.testing import make_record
+from zopyx.surveyjs.testing import provide_storage_adapters
+
+import unittest
+import uuid
+
+
+class ResultContainerTest(unittest.TestCase):
+    def setUp(self):
+        self.results = ResultContainer()
+        # inserted out of order on purpose
+        for poll_id, minutes in (("b", 2), ("c", 3), ("a", 1)):
+            self.results.add(make_record(minutes, poll_id=poll_id))
+
+    def test_date_key_naive_is_utc(self):
+        aware = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.assertEqual(date_key(aware), date_key(aware.replace(tzinfo=None)))
+
+    def test_values_newest_first(self):
+        ids = [r["poll_id"] for r in self.results.values()]
+        self.assertEqual(ids, ["c", "b", "a"])
+
+    def test_values_oldest_first(self):
+        ids = [r["poll_id"] for r in self.results.values(reverse=False)]
+        self.assertEqual(ids, ["a", "b", "c"])
+
+    def test_values_window(self):
+        ids = [r["poll_id"] for r in self.results.values(start=1, limit=1)]
+        self.assertEqual(ids, ["b"])
+
+    def test_get_and_len(self):
+        self.assertEqual(len(self.results), 3)
+        self.assertEqual(self.results.get("a")["result"], {"q": 1})
+        self.assertIsNone(self.results.get("missing"))
+        self.assertIn("b", self.results)
+
+    def test_merged_order_across_shards(self):
+        results = ResultContainer(num_shards=4)
+        for minutes in (7, 3, 9, 1, 5, 8, 2, 6, 4, 0):
+            results.add(make_record(minutes))
+        self.assertEqual(len(results), 10)
+        used = [shard for shard in results._shards if list(shard.index())]
+        self.assertGreater(len(used), 1)
+        minutes = [r["result"]["q"] for r in results.values()]
+        self.assertEqual(minutes, list(range(9, -1, -1)))
+        window = results.values(reverse=False, start=2, limit=3)
+        minutes = [r["result"]["q"] for r in window]
+        self.assertEqual(minutes, [2, 3, 4])
+
+    def test_values_after_position(self):
+        results = ResultContainer(num_shards=4)
+        for minutes in range(10):
+            results.add(make_record(minutes))
+        anchor = position(results.get("poll-6"))
+        minutes = [r["result"]["q"] for r in results.values(after=anchor, limit=3)]
+        self.assertEqual(minutes, [5, 4, 3])
+        window = results.values(reverse=False, after=anchor, limit=3)
+        self.assertEqual([r["result"]["q"] for r in window], [7, 8, 9])
+        positions = list(results.positions(after=anchor))
+        self.assertEqual(positions[0], position(results.get("poll-5")))
+
+    def test_user_index(self):
+        results = ResultContainer(num_shards=4)
+        users = ["Alice", "alex", "bob", None]
+        for minutes in range(12):
+            results.add(make_record(minutes, users[minutes % 4]))
+        self.assertEqual(results.users(), ["", "alex", "alice", "bob"])
+        self.assertEqual(results.users("al"), ["alex", "alice"])
+        minutes = [r["result"]["q"] for r in results.values(users=["alice"])]
+        self.assertEqual(minutes, [8, 4, 0])
+        records = results.values(users=results.users("al"), reverse=False, limit=4)
+        self.assertEqual([r["result"]["q"] for r in records], [0, 1, 4, 5])
+        anchor = position(results.get("poll-5"))
+        records = results.values(users=["alex", "alice"], after=anchor)
+        self.assertEqual([r["result"]["q"] for r in records], [4, 1, 0])
+
+    def test_user_ids_keep_their_case(self):
+        results = ResultContainer(num_shards=1)
+        for minutes, user in enumerate(["Alice", "alice", " ALICE", ""]):
+            results.add(make_record(minutes, user))
+        self.assertEqual(results.users(), ["", "alice"])
+        users = [r["user"] for r in results.values(users=["alice"], reverse=False)]
+        self.assertEqual(users, ["Alice", "alice", " ALICE"])
+        self.assertEqual(results.get("poll-3")["user"], "")
+        results.remove("poll-3")
+        self.assertEqual(results.users(), ["alice"])
+
+    def test_user_table(self):
+        table = UserTable()
+        with mock.patch("zopyx.surveyjs.storage.zlib.crc32", return_value=7):
+            refs = [table.ref(user) for user in ("Alice", "bob", "alice", None)]
+        self.assertEqual(refs, [7, 8, 7, 0])
+        self.assertEqual(table.user(7), "Alice")
+        self.assertEqual(table.find("bob"), 8)
+        self.assertIsNone(table.find("carol"))
+        self.assertEqual(list(table.items()), [("", 0), ("alice", 7), ("bob", 8)])
+        self.assertEqual(list(table.items("b")), [("bob", 8)])
+
+    def test_poll_hash_collisions(self):
+        results = ResultContainer(num_shards=1)
+        with mock.patch("zopyx.surveyjs.storage.poll_hash", return_value=0):
+            for minutes in range(3):
+                results.add(make_record(minutes))
+            for minutes in range(3):
+                self.assertEqual(results.get("poll-%d" % minutes)["result"]["q"], minutes)
+            self.assertIsNone(results.get("poll-3"))
+            results.remove("poll-0")
+            self.assertIsNone(results.get("poll-0"))
+            self.assertEqual(results.get("poll-2")["result"]["q"], 2)
+            results.remove("poll-2")
+            results.remove("poll-1")
+            with self.assertRaises(KeyError):
+                results.remove("poll-1")
+        self.assertEqual(list(results.values()), [])
+
+    def test_results_are_copied(self):
+        record = make_record(1)
+        record["result"] = {"choices": ["red"]}
+        self.results.add(record)
+        record["result"]["choices"].append("blue")
+        stored = self.results.get("poll-1")
+        self.assertEqual(stored["result"], {"choices": ["red"]})
+
+    def test_cursor_round_trip(self):
+        anchor = position(self.results.get("b"))
+        cursor = encode_cursor(anchor)
+        self.assertNotIn("=", cursor)
+        self.assertEqual(decode_cursor(cursor), anchor)
+        with self.assertRaises(ValueError):
+            decode_cursor("not-a-cursor")
+        with self.assertRaises(ValueError):
+            decode_cursor(encode_cursor([1, "poll"]))
+
+    def test_compact_record_round_trip(self):
+        poll_id = str(uuid.uuid1())
+        record = make_record(1, None, poll_id=poll_id)
+        record["result"] = {"q": [1, "x"], "nested": {"a": None}}
+        results = ResultContainer()
+        results.add(record)
+        self.assertEqual(results.get(poll_id), record)
+        for poll_id in (poll_id, "a", "ÄÖ-1", poll_id.upper()):
+            self.assertEqual(poll_id_of(poll_key(poll_id)), poll_id)
+
+    def test_same_position_moves_by_a_microsecond(self):
+        results = ResultContainer(num_shards=1)
+        first = make_record(1, poll_id="a")
+        results.add(first)
+        results.add(dict(first, result={"q": 2}))
+        self.assertEqual(len(results), 2)
+        records = list(results.values(reverse=False))
+        self.assertEqual([r["result"]["q"] for r in records], [1, 2])
+        delta = records[1]["created"] - records[0]["created"]
+        self.assertEqual(delta, timedelta(microseconds=1))
+
+
+class LegacyFormatTest(unittest.TestCase):
+    """Results stored in a plain `OOBTree` before `ResultContainer` existed"""
+
+    def setUp(self):
+        provide_storage_adapters()
+        self.survey = FakeSurvey()
+        self.legacy = IAnnotations(self.survey)[RESULTS_KEY] = OOBTree()
+        users = ["alice", "bob", None]
+        for minutes in range(10):
+            record = make_record(minutes, users[minutes % 3])
+            self.legacy[record["poll_id"]] = record
+
+    def test_reads(self):
+        results = get_results(self.survey)
+        self.assertIsInstance(results, LegacyResults)
+        self.assertEqual(len(results), 10)
+        minutes = [r["result"]["q"] for r in results.values(limit=3)]
+        self.assertEqual(minutes, [9, 8, 7])
+        anchor = position(results.get("poll-6"))
+        window = results.values(reverse=False, after=anchor, limit=2)
+        self.assertEqual([r["result"]["q"] for r in window], [7, 8])
+        window = results.values(users=["alice"], after=anchor)
+        self.assertEqual([r["result"]["q"] for r in window], [3, 0])
+        self.assertEqual(results.users(), ["", "alice", "bob"])
+        # reading never converts the tree
+        self.assertIs(IAnnotations(self.survey)[RESULTS_KEY], self.legacy)
+
+    def test_new_records_go_to_the_container(self):
+        results = get_results(self.survey)
+        results.add(make_record(5.5, "carol", poll_id="new"))
+        self.assertEqual(len(self.legacy), 10)
+        self.assertEqual(len(IAnnotations(self.survey)[COMPACTING_KEY]), 1)
+        self.assertEqual(len(results), 11)
+        self.assertEqual(results.get("new")["user"], "carol")
+        minutes = [r["result"]["q"] for r in results.values(reverse=False)]
+        self.assertEqual(minutes, [0, 1, 2, 3, 4, 5, 5.5, 6, 7, 8, 9])
+        self.assertEqual(results.users("c"), ["carol"])
+
+        results.remove("new")
+        results.remove("poll-0")
+        self.assertEqual(len(results), 9)
+        with self.assertRaises(KeyError):
+            results.remove("missing")
+
+    def test_compact_results(self):
+        get_results(self.survey).add(make_record(20, poll_id="new"))
+        expected = list(get_results(self.survey).values())
+        batches = []
+        moved = compact_results(
+            self.survey, batch_size=4, on_batch=lambda: batches.append(1)
+        )
+        self.assertEqual((moved, len(batches)), (10, 3))
+        results = get_results(self.survey)
+        self.assertIsInstance(results, ResultContainer)
+        self.assertNotIn(COMPACTING_KEY, IAnnotations(self.survey))
+        self.assertEqual(list(results.values()), expected)
+        self.assertEqual(results.users(), ["", "alice", "bob", "user"])
+        self.assertEqual(compact_results(self.survey), 0)
+
+    def test_compact_results_resumes(self):
+        class Interrupted(Exception):
+            pass
+
+        def on_batch():
+            raise Interrupted()
+
+        with self.assertRaises(Interrupted):
+            compact_results(self.survey, batch_size=4, on_batch=on_batch)
+        self.assertEqual(len(self.legacy), 6)
+        self.assertEqual(len(get_results(self.survey)), 10)
+        self.assertEqual(compact_results(self.survey, batch_size=4), 6)
+        self.assertEqual(len(get_results(self.survey)), 10)
+
+
+def make_version(version_id, minutes):
+    created = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=minutes)
+    return dict(
+        id=version_id, created=created, user="user", form_json={"title": version_id}
+    )
+
+
+class FormVersionsTest(unittest.TestCase):
+    def test_current_follows_last_added(self):
+        versions = FormVersions()
+        self.assertIsNone(versions.current)
+        versions.add(make_version("v1", 1))
+        versions.add(make_version("v2", 2))
+        self.assertEqual(versions.current_id, "v2")
+        self.assertEqual(versions.current["form_json"], {"title": "v2"})
+
+    def test_restore_makes_copy_current(self):
+        versions = FormVersions()
+        versions.add(make_version("v1", 1))
+        versions.add(make_version("v2", 2))
+        restored = make_version("v3", 3)
+        restored["form_json"] = versions.get("v1")["form_json"]
+        versions.add(restored)
+        self.assertEqual(versions.current["form_json"], {"title": "v1"})
+        self.assertEqual([v["id"] for v in versions.values()], ["v3", "v2", "v1"])
+
+    def test_convert_legacy_tree(self):
+        legacy = OOBTree()
+        legacy["new"] = make_version("new", 10)
+        legacy["old"] = make_version("old", 1)
+        versions = FormVersions(legacy)
+        self.assertEqual(len(versions), 2)
+        self.assertEqual(versions.current_id, "new")
+
+    def test_convert_legacy_tree_keeps_repeated_forms(self):
+        legacy = OOBTree()
+        for number in range(1, 4):
+            legacy[str(number)] = make_version(str(number), number)
+            legacy[str(number)]["form_json"] = {"title": "same"}
+        versions = FormVersions(legacy)
+        self.assertEqual(len(versions), 3)
+        self.assertEqual(versions.current_id, "3")
+        for number in range(1, 4):
+            self.assertEqual(versions.get(str(number))["form_json"], {"title": "same"})
+
+    def test_legacy_tree_is_read_only(self):
+        provide_storage_adapters()
+        survey = FakeSurvey()
+        legacy = IAnnotations(survey)[FORM_VERSIONS_KEY] = OOBTree()
+        legacy["new"] = make_version("new", 10)
+        legacy["old"] = make_version("old", 1)
+        versions = get_form_versions(survey)
+        self.assertIsInstance(versions, LegacyFormVersions)
+        self.assertEqual(versions.current_id, "new")
+        self.assertEqual(versions.current["form_json"], {"title": "new"})
+        self.assertEqual(versions.get("old")["form_json"], {"title": "old"})
+        self.assertEqual([v["id"] for v in versions.values()], ["new", "old"])
+        self.assertIs(IAnnotations(survey)[FORM_VERSIONS_KEY], legacy)
+
+        # adding a version converts the history
+        version = versions.add(make_version("v3", 20))
+        self.assertEqual(version["id"], "v3")
+        versions = get_form_versions(survey)
+        self.assertIsInstance(versions, FormVersions)
+        self.assertEqual(len(versions), 3)
+
+    def test_convert_form_versions(self):
+        provide_storage_adapters()
+        survey = FakeSurvey()
+        self.assertIsNone(get_form_versions(survey).current)
+        self.assertNotIn(FORM_VERSIONS_KEY, IAnnotations(survey))
+        IAnnotations(survey)[FORM_VERSIONS_KEY] = OOBTree(
+            {"v1": make_version("v1", 1)}
+        )
+        self.assertEqual(convert_form_versions(survey), 1)
+        self.assertIsNone(convert_form_versions(survey))
+        self.assertEqual(get_form_versions(survey).current_id, "v1")
+
+    def test_versions_are_delta_encoded(self):
+        versions = FormVersions()
+        forms = []
+        for number in range(SNAPSHOT_INTERVAL + 3):
+            form = dict(title="form", elements=[{"name": "q%d" % i} for i in range(50)])
+            form["elements"][number]["title"] = "edit %d" % number
+            forms.append(form)
+            data = make_version("v%d" % number, number)
+            data["form_json"] = form
+            versions.add(data)
+
+        records = versions._versions
+        self.assertIn("body", records["v0"])
+        self.assertEqual(records["v1"]["parent"], "v0")
+        self.assertNotIn("body", records["v1"])
+        self.assertIn("body", records["v%d" % SNAPSHOT_INTERVAL])
+        for number, form in enumerate(forms):
+            version = versions.get("v%d" % number)
+            self.assertEqual(version["form_json"], form)
+            self.assertNotIn("patch", version)
+        self.assertEqual(versions.current["form_json"], forms[-1])
+
+    def test_unrelated_form_is_stored_in_full(self):
+        versions = FormVersions()
+        versions.add(make_version("v1", 1))
+        data = make_version("v2", 2)
+        data["form_json"] = {"completely": "different"}
+        versions.add(data)
+        self.assertEqual(versions._versions["v2"]["depth"], 0)
+        self.assertEqual(versions.get("v1")["form_json"], {"title": "v1"})
+
+    def test_unchanged_form_is_a_noop(self):
+        versions = FormVersions()
+        versions.add(make_version("v1", 1))
+        data = make_version("v2", 2)
+        data["form_json"] = {"title": "v1"}
+        self.assertEqual(versions.add(data)["id"], "v1")
+        self.assertEqual(len(versions), 1)
+
+
+class FormStoreTest(unittest.TestCase):
+    def test_bodies_are_shared(self):
+        store = FormStore()
+        first, second = FormVersions(), FormVersions()
+        template = {"title": "template", "pages": [{"name": "p1"}]}
+        for versions in (first, second):
+            data = make_version("v1", 1)
+            data["form_json"] = dict(template)
+            versions.add(data, store)
+        self.assertEqual(len(store), 1)
+        body = store.get(form_hash(template))
+        self.assertIs(first._versions["v1"]["body"], body)
+        self.assertIs(second._versions["v1"]["body"], body)
+        # the current pointer and the snapshot of both surveys
+        self.assertEqual(body.refs(), 4)
+
+    def test_unreferenced_bodies_are_dropped(self):
+        store = FormStore()
+        versions = FormVersions()
+        for number in range(3):
+            data = make_version("v%d" % number, number)
+            data["form_json"] = {"title": "form", "items": list(range(50 + number))}
+            versions.add(data, store)
+        # the snapshot v0 and the current v2 are referenced, v1 was dropped
+        self.assertEqual(len(store), 2)
+        self.assertEqual(versions.get("v1")["form_json"]["items"], list(range(51)))
+        self.assertEqual(versions.current["form_json"]["items"], list(range(52)))
+
+    def test_form_hash_is_canonical(self):
+        self.assertEqual(
+            form_hash({"a": 1, "b": [1, 2]}), form_hash({"b": [1, 2], "a": 1})
+        )
+        self.assertNotEqual(form_hash({"a": 1}), form_hash({"a": 2}))
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+from OFS.Application import Application
+from unittest import mock
+from zopyx.surveyjs import submissions
+from zopyx.surveyjs.catalog import ReindexQueue
+from zopyx.surveyjs.storage import get_results
+from zopyx.surveyjs.submissions import SubmissionSpool
+from zopyx.surveyjs.testing import FakeSurvey
+from zopyx.surveyjs.testing import make_record
+from zopyx.surveyjs.testing import provide_storage_adapters
+
+import orjson
+import os
+import shutil
+import tempfile
+import unittest
+import ZODB
+
+
+class SubmissionSpoolTest(unittest.TestCase):
+    def setUp(self):
+        provide_storage_adapters()
+        self.directory = tempfile.mkdtemp()
+        self.db = ZODB.DB(None)
+        with self.db.transaction() as conn:
+            app = conn.root()["Application"] = Application()
+            app._setObject("survey", FakeSurvey())
+        self.spool = SubmissionSpool(self.directory, batch_size=2)
+        self.queue = submissions._reindex_queue = ReindexQueue(
+            self.open_root, delay=None
+        )
+
+    def tearDown(self):
+        submissions._reindex_queue = None
+        self.db.close()
+        shutil.rmtree(self.directory)
+
+    @contextmanager
+    def open_root(self):
+        conn = self.db.open()
+        try:
+            yield conn.root()["Application"]
+        finally:
+            conn.close()
+
+    def stored(self):
+        with self.open_root() as app:
+            return [r["result"]["q"] for r in get_results(app.survey).values()]
+
+    def test_drain_in_batches(self):
+        for number in range(5):
+            self.spool.append("/survey", make_record(number))
+        self.assertEqual(len(self.spool), 5)
+        self.assertEqual(self.spool.drain(self.open_root), 5)
+        self.assertEqual(self.stored(), [4, 3, 2, 1, 0])
+        self.assertEqual(len(self.spool), 0)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_reindex_after_drain(self):
+        for number in range(5):
+            self.spool.append("/survey", make_record(number))
+        self.spool.drain(self.open_root)
+        # three batches, one reindex
+        self.assertEqual(len(self.queue), 1)
+        self.assertEqual(self.queue.flush(), 1)
+        with self.open_root() as app:
+            self.assertEqual(app.survey.reindexed, 1)
+
+    def test_recovery_is_idempotent(self):
+        for number in range(3):
+            self.spool.append("/survey", make_record(number))
+        # a crash after the first batch was committed leaves the file behind
+        self.spool.rotate()
+        batch = list(self.spool._entries(self.spool.pending()[0]))[:2]
+        self.spool._store_batch(batch, self.open_root, "unused.rejected")
+        self.assertEqual(self.stored(), [1, 0])
+
+        spool = SubmissionSpool(self.directory)
+        self.assertEqual(spool.drain(self.open_root), 1)
+        self.assertEqual(self.stored(), [2, 1, 0])
+
+    def test_torn_line_is_skipped(self):
+        self.spool.append("/survey", make_record(1))
+        with open(self.spool.active_path, "ab") as fp:
+            fp.write(b'{"poll_id": "poll-')
+        self.assertEqual(self.spool.drain(self.open_root), 1)
+        self.assertEqual(self.stored(), [1])
+
+    def rejected(self):
+        names = [n for n in os.listdir(self.directory) if n.endswith(".rejected")]
+        if not names:
+            return []
+        with open(os.path.join(self.directory, names[0]), "rb") as fp:
+            return [orjson.loads(line)["poll_id"] for line in fp]
+
+    def test_missing_survey_is_skipped(self):
+        self.spool.append("/gone", make_record(1))
+        self.spool.append("/survey", make_record(2))
+        self.assertEqual(self.spool.drain(self.open_root), 1)
+        self.assertEqual(self.stored(), [2])
+        self.assertEqual(self.rejected(), ["poll-1"])
+
+    def test_failing_submission_is_rejected(self):
+        for number in range(4):
+            self.spool.append("/survey", make_record(number))
+        add_submission = submissions.add_submission
+
+        def failing(context, data):
+            add_submission(context, data)
+            if data["poll_id"] == "poll-1":
+                raise ValueError("bad data")
+
+        with mock.patch.object(submissions, "add_submission", failing):
+            self.assertEqual(self.spool.drain(self.open_root), 3)
+        self.assertEqual(self.stored(), [3, 2, 0])
+        self.assertEqual(self.rejected(), ["poll-1"])
+        self.assertEqual(len(self.spool), 0)
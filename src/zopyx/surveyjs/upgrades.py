@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Upgrade steps of the default profile."""
+
+from .catalog import SURVEY_INDEXES
+from .storage import compact_results
+from .storage import convert_form_versions
+
+import logging
+import plone.api
+import transaction
+
+
+LOG = logging.getLogger("zopyx.surveyjs")
+
+PROFILE_ID = "profile-zopyx.surveyjs:default"
+
+# Result records moved per transaction
+COMPACT_BATCH_SIZE = 5000
+
+# Surveys reindexed or converted per transaction
+REINDEX_BATCH_SIZE = 100
+
+
+def compact_survey_results(setup_tool):
+    """Move the legacy results of all surveys into compact result containers.
+
+    Every batch is committed on its own, so the conversion of large surveys
+    does not build up one huge transaction and an interrupted run resumes
+    where it stopped. Surveys keep taking submissions meanwhile, these go
+    to the new container (see `storage.LegacyResults`).
+    """
+    setup_tool.runImportStepFromProfile(PROFILE_ID, "plone.app.registry")
+
+    catalog = plone.api.portal.get_tool("portal_catalog")
+    brains = catalog.unrestrictedSearchResults(portal_type="Survey")
+    for brain in brains:
+        survey = brain._unrestrictedGetObject()
+
+        def on_batch():
+            transaction.commit()
+            survey._p_jar.cacheGC()
+
+        moved = compact_results(survey, COMPACT_BATCH_SIZE, on_batch)
+        transaction.commit()
+        LOG.info("Compacted %d results of %s", moved, brain.getPath())
+
+
+def index_surveys(setup_tool):
+    """Add the survey indexes and metadata columns and fill them"""
+    setup_tool.runImportStepFromProfile(PROFILE_ID, "catalog")
+
+    catalog = plone.api.portal.get_tool("portal_catalog")
+    brains = catalog.unrestrictedSearchResults(portal_type="Survey")
+    for number, brain in enumerate(brains, 1):
+        brain._unrestrictedGetObject().reindexObject(idxs=list(SURVEY_INDEXES))
+        if number % REINDEX_BATCH_SIZE == 0:
+            transaction.commit()
+    transaction.commit()
+    LOG.info("Indexed %d surveys", len(brains))
+
+
+def convert_survey_form_versions(setup_tool):
+    """Convert the legacy form version histories of all surveys.
+
+    Until then `storage.LegacyFormVersions` serves them read-only, so
+    viewing a survey never writes.
+    """
+    catalog = plone.api.portal.get_tool("portal_catalog")
+    brains = catalog.unrestrictedSearchResults(portal_type="Survey")
+    converted = 0
+    for brain in brains:
+        survey = brain._unrestrictedGetObject()
+        if convert_form_versions(survey) is not None:
+            converted += 1
+            if converted % REINDEX_BATCH_SIZE == 0:
+                transaction.commit()
+                survey._p_jar.cacheGC()
+    transaction.commit()
+    LOG.info("Converted the form versions of %d surveys", converted)